@@ -23,39 +23,362 @@ Created on 15.07.2021
 #
 #
 
+from __future__ import annotations
+
+import argparse
+import base64
+import contextlib
+import functools
+import gzip
+import hashlib
+import itertools
+import json
 import logging
+import multiprocessing
 import os
+import queue
+import random
 import re
-import sys
+import signal
+import sqlite3
+import threading
+import time
 import urllib
 import xml.etree.ElementTree as et
-from datetime import datetime
+from abc import ABC, abstractmethod
+from collections import ChainMap
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Mapping, TypeVar
 
-import paramiko
 import requests
 import toml
-from cryptography.fernet import Fernet
 
+if TYPE_CHECKING:
+    import paramiko
+    from cryptography.fernet import Fernet
+
+
+T = TypeVar('T')
+
+
+class RunMetrics:
+    """
+    A class for collecting timings and counters of one run. Stages are timed by spans, which also count the errors raised in them.
+    Thread-safe, as the stages of a run are executed concurrently.
+    """
+    __prefix = 'sftp_export_last_run'
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.__lock:
+            self.__started = time.time()
+            self.__stages = {}
+            self.__counters = {}
+
+    @contextlib.contextmanager
+    def span(self, stage: str):
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - start, failed)
+
+    def time_chunks(self, stage: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Pass the chunks through and record the time spent producing them as one execution of the stage,
+        e.g. reading a streamed response without the time spent on each chunk by the consumer.
+        """
+        iterator = iter(chunks)
+        seconds = 0.0
+        failed = False
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    chunk = next(iterator, None)
+                except Exception:
+                    failed = True
+                    raise
+                finally:
+                    seconds += time.perf_counter() - start
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            self.record(stage, seconds, failed)
+
+    def record(self, stage: str, seconds: float, failed: bool = False):
+        """
+        Record one execution of a stage that was timed separately.
+        """
+        with self.__lock:
+            timing = self.__stages.setdefault(stage, {'count': 0, 'seconds': 0.0, 'errors': 0})
+            timing['count'] += 1
+            timing['seconds'] += seconds
+            timing['errors'] += failed
+
+    def increment(self, counter: str, value: int = 1):
+        with self.__lock:
+            self.__counters[counter] = self.__counters.get(counter, 0) + value
+
+    def summary(self, success: bool) -> dict:
+        """
+        Summarize the run. The throughput refers to the downloaded bytes and the duration of the stage `run`.
+        """
+        with self.__lock:
+            stages = {stage: dict(timing, seconds=round(timing['seconds'], 6)) for stage, timing in self.__stages.items()}
+            counters = dict(self.__counters)
+        duration = stages.get('run', {}).get('seconds', 0.0)
+        throughput = counters.get('bytes_downloaded', 0) / duration / 1e6 if duration else 0.0
+        return {'success': success, 'started': datetime.utcfromtimestamp(self.__started).strftime('%Y-%m-%d %H:%M:%S'),
+                'duration_seconds': duration, 'throughput_mb_per_second': round(throughput, 3), 'stages': stages, 'counters': counters}
+
+    def to_prometheus_text(self, success: bool) -> str:
+        """
+        Render the run in the Prometheus text format. All metrics are gauges of the last run.
+        """
+        summary = self.summary(success)
+        lines = []
+        self.__add_gauge(lines, 'success', 'Whether the last run finished without error', [('', int(success))])
+        self.__add_gauge(lines, 'timestamp_seconds', 'Start of the last run as unix time', [('', round(self.__started, 3))])
+        self.__add_gauge(lines, 'duration_seconds', 'Duration of the last run', [('', summary['duration_seconds'])])
+        for key, description in (('seconds', 'Time spent in each stage, summed over concurrent workers'),
+                                 ('count', 'Number of executions of each stage'), ('errors', 'Number of failed executions of each stage')):
+            samples = [(f'{{stage="{stage}"}}', timing[key]) for stage, timing in sorted(summary['stages'].items())]
+            self.__add_gauge(lines, f'stage_{key}', description, samples)
+        for counter, value in sorted(summary['counters'].items()):
+            self.__add_gauge(lines, counter, f'Value of the counter {counter}', [('', value)])
+        return ''.join(lines)
+
+    def __add_gauge(self, lines: list, name: str, description: str, samples: list):
+        if not samples:
+            return
+        lines.append(f'# HELP {self.__prefix}_{name} {description}.\n')
+        lines.append(f'# TYPE {self.__prefix}_{name} gauge\n')
+        lines.extend(f'{self.__prefix}_{name}{labels} {value}\n' for labels, value in samples)
+
+
+metrics = RunMetrics()
+
+
+class RetryPolicy:
+    """
+    A class for repeating operations that failed with a transient error. The delay before each retry grows exponentially
+    from `backoff` seconds up to `max_delay` seconds and is randomized by full jitter, so concurrent workers do not retry in lockstep.
+    """
+
+    def __init__(self, retries: int, backoff: float, max_delay: float = 60.0):
+        self.__retries = retries
+        self.__backoff = backoff
+        self.__max_delay = max_delay
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, str], scope: str) -> 'RetryPolicy':
+        return cls(int(config.get(f'{scope}.RETRIES', 3)), float(config.get(f'{scope}.RETRY_BACKOFF', 1)))
+
+    def call(self, operation: Callable[[], T], is_transient: Callable[[Exception], bool], counter: str) -> T:
+        """
+        Run the operation and return its result. Transient errors are retried up to the configured number of times
+        and counted in the given metrics counter. Other errors and the error of the last attempt are raised.
+        """
+        for attempt in itertools.count():
+            try:
+                return operation()
+            except Exception as err:
+                if attempt >= self.__retries or not is_transient(err):
+                    raise
+                delay = random.uniform(0, min(self.__max_delay, self.__backoff * 2 ** attempt))
+                logging.warning('Attempt %d failed: %s. Retrying in %.1f seconds', attempt + 1, err, delay)
+                metrics.increment(counter)
+                time.sleep(delay)
+
+
+class TokenBucket:
+    """
+    A class for limiting the rate at which several threads send bytes to one destination to `rate` bytes per second.
+    Up to one second of the rate is allowed as a burst. A chunk larger than the available tokens is sent at once and
+    paid back by waiting, so the following chunks of all threads are delayed until the rate is met again.
+    """
+
+    def __init__(self, rate: float):
+        self.__rate = rate
+        self.__tokens = rate
+        self.__updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def consume(self, num_bytes: int):
+        """
+        Take the tokens for the given number of bytes, waiting until they are paid back if the bucket runs into debt.
+        """
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self.__rate, self.__tokens + (now - self.__updated) * self.__rate) - num_bytes
+            self.__updated = now
+            delay = -self.__tokens / self.__rate
+        if delay > 0:
+            time.sleep(delay)
 
-# TODO outsource encryption to openssl
-# TODO set encryption to be asymmetrical
 
 class BrokerRequestResultManager:
     """
     A class for managing request results from the AKTIN Broker.
+    All calls to the broker share one pooled session to reuse connections.
+    The request list and request status are fetched with conditional requests. Their responses and validators (ETag and
+    Last-Modified) are cached in a file in the working directory, so unchanged responses are answered with 304 Not Modified.
+    The ids of exported request results are cached as well, together with the completion of the request at the time of the export.
+    While the completion is unchanged and the export is younger than `BROKER.EXPORT_TTL` seconds, it is downloaded again instead of
+    letting the broker export the same results once more.
     """
     __timeout = 10
 
     def __init__(self):
         self.__broker_url = os.environ['BROKER.URL']
         self.__admin_api_key = os.environ['BROKER.API_KEY']
-        self.__tag_requests = os.environ['REQUESTS.TAG']
+        self.__max_workers = int(os.environ.get('BROKER.MAX_WORKERS', 8))
+        self.__path_cache = os.path.join(os.environ['MISC.WORKING_DIR'], 'broker_cache.json')
+        self.__cache = self.__load_cache()
+        self.__cache_current = {}
+        self.__num_modified = 0
+        self.__export_ttl = float(os.environ.get('BROKER.EXPORT_TTL', 300))
+        self.__path_export_cache = os.path.join(os.environ['MISC.WORKING_DIR'], 'broker_exports.json')
+        self.__export_cache = self.__load_export_cache()
+        self.__dict_completion = {}
+        self.__lock = threading.Lock()
+        self.__session = self.__init_session()
+        self.__retry = RetryPolicy.from_config(os.environ, 'BROKER')
         self.__check_broker_server_availability()
 
+    def __load_cache(self) -> dict:
+        if not os.path.isfile(self.__path_cache):
+            return {}
+        try:
+            with open(self.__path_cache, encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, json.JSONDecodeError):
+            logging.warning('Ignoring unreadable cache %s', self.__path_cache)
+            return {}
+
+    def __load_export_cache(self) -> dict:
+        """
+        Load the cached exports and evict the expired ones.
+        """
+        if not os.path.isfile(self.__path_export_cache):
+            return {}
+        try:
+            with open(self.__path_export_cache, encoding='utf-8') as file:
+                export_cache = json.load(file)
+        except (OSError, json.JSONDecodeError):
+            logging.warning('Ignoring unreadable cache %s', self.__path_export_cache)
+            return {}
+        return {id_request: entry for id_request, entry in export_cache.items() if not self.__is_export_expired(entry)}
+
+    def __save_export_cache(self):
+        """
+        Evict the expired exports and write the cache. Must be called while holding the lock.
+        """
+        self.__export_cache = {id_request: entry for id_request, entry in self.__export_cache.items() if not self.__is_export_expired(entry)}
+        path_tmp = f'{self.__path_export_cache}.tmp'
+        with open(path_tmp, 'w', encoding='utf-8') as file:
+            json.dump(self.__export_cache, file)
+        os.replace(path_tmp, self.__path_export_cache)
+
+    def __is_export_expired(self, entry: dict) -> bool:
+        return time.time() - entry['created'] >= self.__export_ttl
+
+    def save_cache(self):
+        """
+        Replace the cache with the responses of the latest call to `get_tagged_requests_completion_by_tag()`.
+        Should only be called after a successful synchronization, as later runs rely on it to detect changes.
+        """
+        path_tmp = f'{self.__path_cache}.tmp'
+        with open(path_tmp, 'w', encoding='utf-8') as file:
+            json.dump(self.__cache_current, file)
+        os.replace(path_tmp, self.__path_cache)
+        self.__cache = self.__cache_current
+
+    def has_changed_since_last_sync(self) -> bool:
+        """
+        Whether any response of the latest call to `get_tagged_requests_completion_by_tag()` differed from the cached one.
+        """
+        return not self.__cache or self.__num_modified > 0 or self.__cache.keys() != self.__cache_current.keys()
+
+    def close(self):
+        self.__session.close()
+
+    def __get_conditional(self, url: str) -> bytes:
+        """
+        GET the given url, sending the validators of a cached response. Returns the cached content if the broker answers 304.
+        """
+        headers = self.__create_basic_header()
+        cached = self.__cache.get(url)
+        if cached is not None:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+        response = self.__send('get', url, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            metrics.increment('broker_not_modified')
+            content = cached['content'].encode('utf-8')
+            entry = cached
+        else:
+            response.raise_for_status()
+            content = response.content
+            entry = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified'),
+                     'content': response.text}
+            with self.__lock:
+                self.__num_modified += 1
+        if entry['etag'] or entry['last_modified']:
+            with self.__lock:
+                self.__cache_current[url] = entry
+        return content
+
+    def __send(self, method: str, url: str, **kwargs) -> requests.models.Response:
+        """
+        Send a request to the broker. Connection errors, timeouts and server errors are retried by the retry policy.
+        Other error responses are returned to the caller.
+        """
+        def send() -> requests.models.Response:
+            response = self.__session.request(method, url, timeout=self.__timeout, **kwargs)
+            if response.status_code >= 500 or response.status_code == 429:
+                response.close()
+                response.raise_for_status()
+            return response
+
+        return self.__retry.call(send, self.__is_transient_error, 'broker_retries')
+
+    @staticmethod
+    def __is_transient_error(err: Exception) -> bool:
+        """
+        Whether a failed call to the broker might succeed if repeated. HTTP errors are only raised for server errors
+        and rate limiting, as other error responses are not retried.
+        """
+        return isinstance(err, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                                requests.exceptions.ChunkedEncodingError, requests.exceptions.HTTPError))
+
+    def __init_session(self) -> requests.Session:
+        """
+        Creates a session whose connection pool is large enough for all concurrent workers.
+        """
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.__max_workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
     def __check_broker_server_availability(self):
         url = self.__append_to_broker_url('broker', 'status')
         try:
-            response = requests.head(url, timeout=self.__timeout)
+            response = self.__session.head(url, timeout=self.__timeout)
             response.raise_for_status()
         except requests.exceptions.Timeout:
             raise SystemExit('Connection to AKTIN Broker timed out')
@@ -76,49 +399,93 @@ class BrokerRequestResultManager:
         """
         return {'Authorization': ' '.join(['Bearer', self.__admin_api_key]), 'Connection': 'keep-alive', 'Accept': mediatype}
 
-    def get_request_result(self, id_request: str) -> requests.models.Response:
-        """
-        Retrieve the request results from the AKTIN Broker for a specific request ID.
-        To download request results from AKTIN broker, they have to be exported first as a temporarily downloadable file with an uuid.
-        """
-        logging.info('Downloading results of %s', id_request)
-        id_export = self.__export_request_result(id_request)
-        response = self.__download_exported_result(id_export)
-        return response
-
-    def __export_request_result(self, id_request: str) -> str:
+    def export_request_result(self, id_request: str, use_cache: bool = True) -> str:
         """
         Export the request results as a temporarily downloadable file with a unique ID.
+        Returns the ID of a cached export instead, if the completion of the request did not change since, as of the latest call to
+        `get_tagged_requests_completion_by_tag()`, and the export has not expired. An export whose download was answered
+        with 404 Not Found has to be replaced by calling this method again with `use_cache` set to False.
         """
+        completion = self.__dict_completion.get(id_request)
+        with self.__lock:
+            entry = self.__export_cache.get(id_request)
+        if use_cache and entry is not None and entry['completion'] == completion and not self.__is_export_expired(entry):
+            metrics.increment('broker_exports_reused')
+            return entry['id_export']
         url = self.__append_to_broker_url('broker', 'export', 'request-bundle', id_request)
-        response = requests.post(url, headers=self.__create_basic_header('text/plain'), timeout=self.__timeout)
-        response.raise_for_status()
+        with metrics.span('broker_export'):
+            response = self.__send('post', url, headers=self.__create_basic_header('text/plain'))
+            response.raise_for_status()
+        if completion is not None and self.__export_ttl > 0:
+            with self.__lock:
+                self.__export_cache[id_request] = {'completion': completion, 'id_export': response.text, 'created': time.time()}
+                self.__save_export_cache()
         return response.text
 
-    def __download_exported_result(self, id_export: str) -> requests.models.Response:
+    def download_exported_result(self, id_export: str) -> requests.models.Response:
+        """
+        Open a streamed download of an exported request result. The body is not loaded into memory.
+        """
         url = self.__append_to_broker_url('broker', 'download', id_export)
-        response = requests.get(url, headers=self.__create_basic_header(), timeout=self.__timeout)
-        response.raise_for_status()
+        with metrics.span('broker_download'):
+            response = self.__send('get', url, headers=self.__create_basic_header(), stream=True)
+            try:
+                response.raise_for_status()
+            except requests.exceptions.HTTPError:
+                response.close()
+                raise
         return response
 
-    def get_tagged_requests_completion_as_dict(self) -> dict:
+    def get_tagged_requests_completion_by_tag(self, tags: Iterable[str], dict_frozen: dict = None) -> dict:
+        """
+        Get the completion status of requests tagged with any of the given tags.
+        Returns a dictionary with the requests and their completion for each tag.
+        The status of each request is fetched only once, even if it carries several of the tags,
+        and concurrently by a bounded pool of workers.
+        `dict_frozen` holds the known completion of frozen requests for each tag. The status of a request that is frozen
+        with the same completion for all tags it carries is not fetched, and its known completion is returned instead.
+        """
+        self.__cache_current = {}
+        self.__num_modified = 0
+        dict_frozen = dict_frozen or {}
+        with metrics.span('broker_poll'):
+            dict_ids = {tag: self.__get_request_ids_with_tag(tag) for tag in tags}
+            set_requests = set().union(*dict_ids.values())
+            dict_known = self.__get_known_completion(dict_ids, dict_frozen)
+            set_poll = set_requests - dict_known.keys()
+            with ThreadPoolExecutor(max_workers=self.__max_workers) as executor:
+                dict_completion = dict(zip(set_poll, executor.map(self.__get_request_result_completion, set_poll)))
+        dict_completion.update(dict_known)
+        if dict_known:
+            metrics.increment('requests_frozen', len(dict_known))
+        self.__dict_completion = dict_completion
+        return {tag: {id_request: str(dict_completion[id_request]) for id_request in list_requests} for tag, list_requests in dict_ids.items()}
+
+    def __get_known_completion(self, dict_ids: dict, dict_frozen: dict) -> dict:
         """
-        Get the completion status of requests tagged with a specific tag.
+        Collect the known completion of the requests that are frozen for all tags they carry. Their cached status responses are
+        kept, so skipping them does not count as a change since the last synchronization.
         """
-        list_requests = self.__get_request_ids_with_tag(self.__tag_requests)
-        dict_broker = {}
-        for id_request in list_requests:
-            completion = self.__get_request_result_completion(id_request)
-            dict_broker[id_request] = str(completion)
-        return dict_broker
+        dict_tags = {}
+        for tag, list_requests in dict_ids.items():
+            for id_request in list_requests:
+                dict_tags.setdefault(id_request, set()).add(tag)
+        dict_known = {}
+        for id_request, set_tags in dict_tags.items():
+            set_completion = {dict_frozen.get(tag, {}).get(id_request) for tag in set_tags}
+            if len(set_completion) != 1 or None in set_completion:
+                continue
+            dict_known[id_request] = float(set_completion.pop())
+            url = self.__append_to_broker_url('broker', 'request', id_request, 'status')
+            if url in self.__cache:
+                self.__cache_current[url] = self.__cache[url]
+        return dict_known
 
     def __get_request_ids_with_tag(self, tag: str) -> list:
         logging.info('Checking for requests with tag %s', tag)
         url = self.__append_to_broker_url('broker', 'request', 'filtered')
         url = '?'.join([url, urllib.parse.urlencode({'type': 'application/vnd.aktin.query.request+xml', 'predicate': "//tag='%s'" % tag})])
-        response = requests.get(url, headers=self.__create_basic_header(), timeout=self.__timeout)
-        response.raise_for_status()
-        list_request_id = [element.get('id') for element in et.fromstring(response.content)]
+        list_request_id = [element.get('id') for element in et.fromstring(self.__get_conditional(url))]
         logging.info('%d requests found', len(list_request_id))
         return list_request_id
 
@@ -129,274 +496,2206 @@ class BrokerRequestResultManager:
         Returns the completion percentage (rounded to 2 decimal places) or 0.0 if no nodes found.
         """
         url = self.__append_to_broker_url('broker', 'request', id_request, 'status')
-        response = requests.get(url, headers=self.__create_basic_header(), timeout=self.__timeout)
-        root = et.fromstring(response.content)
+        root = et.fromstring(self.__get_conditional(url))
         num_nodes = len(root.findall('.//{http://aktin.org/ns/exchange}node'))
         num_completed = len(root.findall('.//{http://aktin.org/ns/exchange}completed'))
         return round(num_completed / num_nodes, 2) if num_nodes else 0.0
 
 
-class SftpFileManager:
+# TODO outsource encryption to openssl
+# TODO set encryption to be asymmetrical
+
+class StreamingFernet:
     """
-    A class for managing file operations with an SFTP server.
+    A class for creating Fernet tokens incrementally, so payloads of any size can be encrypted in constant memory.
+    The output is a regular Fernet token (see https://github.com/fernet/spec/blob/master/Spec.md) and
+    can be decrypted with `Fernet.decrypt()`.
     """
 
-    def __init__(self):
-        self.__sftp_host = os.environ['SFTP.HOST']
-        self.__sftp_username = os.environ['SFTP.USERNAME']
-        self.__sftp_password = os.environ['SFTP.PASSWORD']
-        self.__sftp_timeout = int(os.environ['SFTP.TIMEOUT'])
-        self.__sftp_foldername = os.environ['SFTP.FOLDERNAME']
-        self.__path_key_encryption = os.environ['SECURITY.PATH_ENCRYPTION_KEY']
-        self.__working_dir = os.environ['MISC.WORKING_DIR']
-        self.encryptor = self.__init_encryptor()
-        self.__connection = self.__connect_to_sftp()
-
-    def __init_encryptor(self) -> Fernet:
-        with open(self.__path_key_encryption, 'rb') as key:
-            return Fernet(key.read())
-
-    def __connect_to_sftp(self) -> paramiko.sftp_client.SFTPClient:
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.connect(self.__sftp_host, username=self.__sftp_username,
-                    password=self.__sftp_password, timeout=self.__sftp_timeout,
-                    allow_agent=False, look_for_keys=False)
-        return ssh.open_sftp()
+    def __init__(self, key: bytes):
+        key = base64.urlsafe_b64decode(key)
+        if len(key) != 32:
+            raise ValueError('Fernet key must be 32 url-safe base64-encoded bytes')
+        self.__signing_key = key[:16]
+        self.__encryption_key = key[16:]
 
-    def upload_request_result(self, response: requests.models.Response):
+    def encryptor(self) -> 'FernetStreamEncryptor':
         """
-        Upload the content of the response from `BrokerRequestResultManager.get_request_result()` to the SFTP server.
-        Extracts the filename from the response headers.
-        Prior to uploading, stores the file temporarily in the current local folder and encrypts it using Fernet.
+        Create a context that encrypts the data passed to it into one Fernet token.
         """
-        filename = self.__extract_filename_from_broker_response(response)
-        tmp_path_file = os.path.join(self.__working_dir, filename)
-        try:
-            with open(tmp_path_file, 'wb') as file:
-                file_encrypted = self.__encrypt_file(response.content)
-                file.write(file_encrypted)
-            self.upload_file(tmp_path_file)
-        finally:
-            if os.path.isfile(tmp_path_file):
-                os.remove(tmp_path_file)
+        return FernetStreamEncryptor(self.__signing_key, self.__encryption_key)
 
     @staticmethod
-    def __extract_filename_from_broker_response(response: requests.models.Response) -> str:
-        return re.search('filename=\"(.*)\"', response.headers['Content-Disposition']).group(1)
+    def calculate_token_size(size: int) -> int:
+        """
+        Calculate the size of the token for a payload of the given size: version, timestamp and IV, the padded ciphertext
+        and the HMAC, encoded in base64.
+        """
+        len_token = 1 + 8 + 16 + (size // 16 + 1) * 16 + 32
+        return -(-len_token // 3) * 4
+
+
+class FernetStreamEncryptor:
+    """
+    A class for the encryption context of `StreamingFernet`. Plaintext is passed in chunks to `update()`,
+    which returns the next part of the token. `finalize()` returns the last part including the signature.
+    """
+    __version = b'\x80'
+
+    def __init__(self, signing_key: bytes, encryption_key: bytes):
+        from cryptography.hazmat.primitives import hashes, hmac, padding
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+        iv = os.urandom(16)
+        self.__encryptor = Cipher(algorithms.AES(encryption_key), modes.CBC(iv)).encryptor()
+        self.__padder = padding.PKCS7(algorithms.AES.block_size).padder()
+        self.__signer = hmac.HMAC(signing_key, hashes.SHA256())
+        self.__encoder = Base64StreamEncoder()
+        self.__header = self.__version + int(time.time()).to_bytes(8, byteorder='big') + iv
+
+    def __sign_and_encode(self, data: bytes) -> bytes:
+        data, self.__header = self.__header + data, b''
+        self.__signer.update(data)
+        return self.__encoder.update(data)
+
+    def update(self, chunk: bytes) -> bytes:
+        return self.__sign_and_encode(self.__encryptor.update(self.__padder.update(chunk)))
+
+    def finalize(self) -> bytes:
+        token = self.__sign_and_encode(self.__encryptor.update(self.__padder.finalize()) + self.__encryptor.finalize())
+        return token + self.__encoder.update(self.__signer.finalize()) + self.__encoder.finalize()
+
+
+class Base64StreamEncoder:
+    """
+    A class for url-safe base64 encoding of a byte stream. Input is buffered until it is divisible by three bytes.
+    """
+
+    def __init__(self):
+        self.__rest = b''
+
+    def update(self, data: bytes) -> bytes:
+        data = self.__rest + data
+        cut = len(data) - len(data) % 3
+        self.__rest = data[cut:]
+        return base64.urlsafe_b64encode(data[:cut])
+
+    def finalize(self) -> bytes:
+        rest, self.__rest = self.__rest, b''
+        return base64.urlsafe_b64encode(rest)
+
+
+class AesGcmStreamCipher:
+    """
+    A class for encrypting payloads of any size into a versioned container of authenticated AES-GCM chunks.
+    Follows the STREAM construction: every chunk is sealed with a nonce made of a random prefix, the chunk counter
+    and a flag marking the final chunk, so reordered, dropped or truncated chunks are detected on decryption.
+
+    Container layout (version 1):
+    magic 'AKTS' (4 bytes) | version (1 byte) | plaintext chunk size (4 bytes, big-endian) | nonce prefix (7 bytes)
+    followed by the chunks, each being the ciphertext of up to `chunk size` bytes plus a 16 byte tag.
+    All chunks but the last one hold exactly `chunk size` bytes of plaintext. The header is authenticated with every chunk.
+    The AES-256 key is derived from the configured Fernet key with HKDF-SHA256.
+    """
+    __magic = b'AKTS'
+    __version = 1
+    __len_header = 16
+    __len_prefix = 7
+    __len_tag = 16
+    __max_chunks = 2 ** 32
 
-    def __encrypt_file(self, file: bytes) -> bytes:
-        return self.encryptor.encrypt(file)
+    def __init__(self, key: bytes, chunk_size: int = 1048576):
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+        key = base64.urlsafe_b64decode(key)
+        self.__aead = AESGCM(HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b'aktin-stream-v1').derive(key))
+        self.__chunk_size = chunk_size
 
-    def upload_file(self, path_file: str):
+    def encryptor(self) -> 'AesGcmStreamEncryptor':
         """
-        Upload a file to the SFTP server and overwrite if it already exists on the server.
+        Create a context that encrypts the data passed to it into one container.
         """
-        logging.info('Sending %s to sftp server', path_file)
-        filename = os.path.basename(path_file)
-        self.__connection.put(path_file, f"{self.__sftp_foldername}/{filename}")
+        prefix = os.urandom(self.__len_prefix)
+        header = self.__magic + bytes([self.__version]) + self.__chunk_size.to_bytes(4, byteorder='big') + prefix
+        return AesGcmStreamEncryptor(header, self.__chunk_size, functools.partial(self.__seal, header, prefix))
 
-    def delete_request_result(self, id_request: str):
-        name_zip = self.__create_results_file_name(id_request)
-        self.__delete_file(name_zip)
+    @classmethod
+    def calculate_container_size(cls, size: int, chunk_size: int) -> int:
+        """
+        Calculate the size of the container for a payload of the given size. An empty payload is sealed as one empty chunk.
+        """
+        num_chunks = max(1, -(-size // chunk_size))
+        return cls.__len_header + size + num_chunks * cls.__len_tag
 
-    @staticmethod
-    def __create_results_file_name(id_request: str) -> str:
+    def encrypt(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
         """
-        Create the file name for the request result based on the AKTIN Broker naming convention.
+        Encrypt the given chunks of plaintext and yield the container piece by piece.
         """
-        return ''.join(['export_', id_request, '.zip'])
+        encryptor = self.encryptor()
+        for chunk in chunks:
+            yield encryptor.update(chunk)
+        yield encryptor.finalize()
 
-    def __delete_file(self, filename: str):
-        logging.info('Deleting %s from sftp server', filename)
-        try:
-            self.__connection.remove(f"{self.__sftp_foldername}/{filename}")
-        except FileNotFoundError:
-            logging.info('%s could not be found', filename)
+    def decrypt(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Decrypt a container given as chunks of arbitrary size and yield the plaintext chunk by chunk.
+        Raises `cryptography.exceptions.InvalidTag` if the container was modified or truncated.
+        """
+        buffer = b''
+        header = None
+        counter = 0
+        len_sealed = None
+        for chunk in chunks:
+            buffer += chunk
+            if header is None:
+                if len(buffer) < self.__len_header:
+                    continue
+                header, buffer = buffer[:self.__len_header], buffer[self.__len_header:]
+                len_sealed = self.__parse_header(header) + self.__len_tag
+            while len(buffer) > len_sealed:
+                yield self.__open(header, counter, False, buffer[:len_sealed])
+                buffer = buffer[len_sealed:]
+                counter += 1
+        if header is None:
+            raise ValueError('Container is too short to contain a header')
+        yield self.__open(header, counter, True, buffer)
+
+    def __parse_header(self, header: bytes) -> int:
+        if header[:4] != self.__magic:
+            raise ValueError('Not an AES-GCM stream container')
+        if header[4] != self.__version:
+            raise ValueError(f'Unsupported container version {header[4]}')
+        return int.from_bytes(header[5:9], byteorder='big')
 
+    def __create_nonce(self, prefix: bytes, counter: int, is_last: bool) -> bytes:
+        if counter >= self.__max_chunks:
+            raise ValueError('Payload exceeds the maximum number of chunks')
+        return prefix + counter.to_bytes(4, byteorder='big') + (b'\x01' if is_last else b'\x00')
 
-class StatusXmlManager:
+    def __seal(self, header: bytes, prefix: bytes, counter: int, is_last: bool, plaintext: bytes) -> bytes:
+        return self.__aead.encrypt(self.__create_nonce(prefix, counter, is_last), plaintext, header)
+
+    def __open(self, header: bytes, counter: int, is_last: bool, ciphertext: bytes) -> bytes:
+        prefix = header[-self.__len_prefix:]
+        return self.__aead.decrypt(self.__create_nonce(prefix, counter, is_last), ciphertext, header)
+
+
+class AesGcmStreamEncryptor:
     """
-    A class for managing operations on an XML status file.
+    A class for the encryption context of `AesGcmStreamCipher`. Plaintext passed to `update()` is buffered until
+    a full chunk can be sealed. `finalize()` seals the remaining plaintext as the last chunk.
     """
 
-    def __init__(self):
-        self.path_status_xml = os.path.join(os.environ['MISC.WORKING_DIR'], 'status.xml')
-        if not os.path.isfile(self.path_status_xml):
-            self.__init_status_xml()
-        self.__format_date = '%Y-%m-%d %H:%M:%S'
-        self.__element_tree = et.parse(self.path_status_xml)
+    def __init__(self, header: bytes, chunk_size: int, seal: Callable[[int, bool, bytes], bytes]):
+        self.__header = header
+        self.__chunk_size = chunk_size
+        self.__seal = seal
+        self.__buffer = b''
+        self.__counter = 0
 
-    def __init_status_xml(self):
-        """
-        Creates a new 'status.xml' file in the working directory with an empty <status> tag.
-        """
-        root = et.Element('status')
-        self.__element_tree = et.ElementTree(root)
-        self.__save_current_status_xml_as_file()
+    def update(self, chunk: bytes) -> bytes:
+        output, self.__header = [self.__header], b''
+        self.__buffer += chunk
+        while len(self.__buffer) > self.__chunk_size:
+            output.append(self.__seal(self.__counter, False, self.__buffer[:self.__chunk_size]))
+            self.__buffer = self.__buffer[self.__chunk_size:]
+            self.__counter += 1
+        return b''.join(output)
 
-    def __save_current_status_xml_as_file(self):
-        self.__element_tree.write(self.path_status_xml, encoding='utf-8')
+    def finalize(self) -> bytes:
+        output, self.__header = self.__header, b''
+        return output + self.__seal(self.__counter, True, self.__buffer)
 
-    def get_element_by_id(self, id_request: str) -> et.Element:
-        root = self.__element_tree.getroot()
-        for request_status in root.iter('request-status'):
-            id_element = request_status.find('id')
-            if id_element is not None and id_element.text == id_request:
-                return request_status
-        return None
 
-    def update_or_add_element(self, id_request: str, completion: str):
-        root = self.__element_tree.getroot()
-        for request_status in root.findall('request-status'):
-            id_element = request_status.find('id')
-            if id_element is not None and id_element.text == id_request:
-                request_status.find('completion').text = completion
-                self.__add_or_update_date_tag_in_element(request_status, 'last-update')
-                break
-        else:
-            new_request_status = et.SubElement(root, 'request-status')
-            et.SubElement(new_request_status, 'id').text = id_request
-            et.SubElement(new_request_status, 'completion').text = completion
-            et.SubElement(new_request_status, 'uploaded').text = datetime.utcnow().strftime(self.__format_date)
-        self.__save_current_status_xml_as_file()
+class ContentDigest:
+    """
+    A class for computing the SHA-256 digest and byte size of a stream of chunks while passing the chunks through.
+    """
 
-    def __add_or_update_date_tag_in_element(self, parent: et.Element, name_tag: str) -> None:
-        child = parent.find(name_tag)
-        if child is None:
-            et.SubElement(parent, name_tag).text = datetime.utcnow().strftime(self.__format_date)
-        else:
-            child.text = datetime.utcnow().strftime(self.__format_date)
+    def __init__(self):
+        self.__hash = hashlib.sha256()
+        self.size = 0
 
-    def add_delete_tag_to_element(self, id_request: str):
-        parent = self.get_element_by_id(id_request)
-        self.__add_or_update_date_tag_in_element(parent, 'deleted')
-        self.__save_current_status_xml_as_file()
+    def feed(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        for chunk in chunks:
+            self.__hash.update(chunk)
+            self.size += len(chunk)
+            yield chunk
 
-    def get_request_completion_as_dict(self) -> dict:
+    @property
+    def hexdigest(self) -> str:
+        return self.__hash.hexdigest()
+
+
+class SftpConnectionPool:
+    """
+    A class for a pool of SFTP channels multiplexed over one SSH transport. The transport is opened on first use.
+    Each channel is used by one thread at a time, so operations on different channels run in parallel.
+    The transport sends keepalives. If the connection drops or times out during an operation, the transport and the channel
+    are reopened and the operation is repeated according to the retry policy.
+    """
+
+    def __init__(self, host: str, port: int, username: str, password: str, timeout: int, size: int, keepalive: int,
+                 retry_policy: RetryPolicy):
+        self.__host = host
+        self.__port = port
+        self.__username = username
+        self.__password = password
+        self.__timeout = timeout
+        self.__keepalive = keepalive
+        self.__retry = retry_policy
+        self.__lock = threading.Lock()
+        self.__ssh = None
+        self.__channels = queue.LifoQueue()
+        for _ in range(size):
+            self.__channels.put(None)
+
+    def __connect(self):
         """
-        Extract the request ID and completion from each element in the status XML.
-        Returns them as a dictionary.
+        Open a new SSH transport. Channels of a previous transport become invalid and are reopened on their next use.
         """
-        root = self.__element_tree.getroot()
-        list_ids = [element.text for element in root.findall('.//id')]
-        list_completion = [element.text for element in root.findall('.//completion')]
-        return dict(zip(list_ids, list_completion))
+        import paramiko
+        if self.__ssh is not None:
+            self.__ssh.close()
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh.connect(self.__host, port=self.__port, username=self.__username,
+                    password=self.__password, timeout=self.__timeout,
+                    allow_agent=False, look_for_keys=False)
+        ssh.get_transport().set_keepalive(self.__keepalive)
+        self.__ssh = ssh
 
-    def compare_request_completion_between_broker_and_sftp(self, dict_broker: dict, dict_xml: dict) -> (set, set, set):
-        set_new = set(dict_broker.keys()).difference(set(dict_xml.keys()))
-        set_update = self.__get_requests_to_update(dict_broker, dict_xml)
-        set_delete = self.__get_requests_to_delete(dict_broker, dict_xml)
-        logging.info(f"{len(set_new)} new requests, {len(set_update)} requests to update, {len(set_delete)} requests to delete")
-        return set_new, set_update, set_delete
+    def __is_transport_active(self) -> bool:
+        return self.__ssh is not None and self.__ssh.get_transport() is not None and self.__ssh.get_transport().is_active()
 
-    def __get_requests_to_update(self, dict_broker: dict, dict_xml: dict) -> set:
+    def __open_channel(self) -> paramiko.sftp_client.SFTPClient:
+        with self.__lock:
+            if not self.__is_transport_active():
+                self.__connect()
+            return self.__ssh.open_sftp()
+
+    @staticmethod
+    def __is_channel_usable(channel: paramiko.sftp_client.SFTPClient) -> bool:
+        return channel is not None and not channel.get_channel().closed and channel.get_channel().get_transport().is_active()
+
+    def __is_transient_error(self, err: Exception) -> bool:
         """
-        A request has to be updated on sftp server if its completion rate changed
+        Whether an operation failed because the connection dropped or timed out, unlike errors reported by the server.
         """
-        set_update = set(dict_broker.keys()).intersection(set(dict_xml.keys()))
-        for key in set_update.copy():
-            if dict_broker.get(key) == dict_xml.get(key):
-                set_update.remove(key)
-            if self.__is_request_tagged_as_deleted(key):
-                set_update.remove(key)
-        return set_update
+        import paramiko
+        if isinstance(err, paramiko.AuthenticationException):
+            return False
+        return isinstance(err, (EOFError, TimeoutError, ConnectionError, paramiko.SSHException)) or not self.__is_transport_active()
 
-    def __get_requests_to_delete(self, dict_broker: dict, dict_xml: dict) -> set:
+    def run(self, operation: Callable[[paramiko.sftp_client.SFTPClient], T]) -> T:
         """
-        A request with the tag "deleted" is already deleted on sftp server
+        Run the given operation on a free channel of the pool and return its result.
+        An operation that failed because the connection dropped is repeated on a reopened channel.
         """
-        set_delete = set(dict_xml.keys()).difference(set(dict_broker.keys()))
-        for key in set_delete.copy():
-            if self.__is_request_tagged_as_deleted(key):
-                set_delete.remove(key)
-        return set_delete
+        return self.__retry.call(functools.partial(self.__run_on_channel, operation), self.__is_transient_error, 'sftp_retries')
 
-    def __is_request_tagged_as_deleted(self, id_request: str) -> bool:
-        parent = self.get_element_by_id(id_request)
-        child = parent.find('deleted')
-        return child is not None
+    def __run_on_channel(self, operation: Callable[[paramiko.sftp_client.SFTPClient], T]) -> T:
+        channel = self.__channels.get()
+        try:
+            if not self.__is_channel_usable(channel):
+                channel = self.__open_channel()
+            return operation(channel)
+        finally:
+            self.__channels.put(channel if self.__is_channel_usable(channel) else None)
 
+    def close(self):
+        with self.__lock:
+            if self.__ssh is not None:
+                self.__ssh.close()
+                self.__ssh = None
 
-class Manager:
+
+class EncryptedFileWriter:
     """
-    A manager class that coordinates the uploading of tagged results to an SFTP server.
+    A class for writing plaintext in chunks to a local file, encrypted by the given encryption context.
     """
 
-    def __init__(self, path_toml: str):
-        self.__verify_and_load_toml(path_toml)
-        self.__broker = BrokerRequestResultManager()
-        self.__sftp = SftpFileManager()
-        self.__xml = StatusXmlManager()
+    def __init__(self, path: str, encryptor: FernetStreamEncryptor | AesGcmStreamEncryptor):
+        self.path = path
+        self.__encryptor = encryptor
+        self.__file = open(path, 'wb')
 
-    def __flatten_dict(self, d, parent_key='', sep='.'):
-        items = []
-        for k, v in d.items():
-            new_key = f'{parent_key}{sep}{k}' if parent_key else k
-            if isinstance(v, dict):
-                items.extend(self.__flatten_dict(v, new_key, sep=sep).items())
-            else:
-                items.append((new_key, v))
-        return dict(items)
+    def write(self, chunk: bytes):
+        self.__file.write(self.__encryptor.update(chunk))
+
+    def close(self):
+        self.__file.write(self.__encryptor.finalize())
+        self.__file.close()
 
-    def __verify_and_load_toml(self, path_toml: str):
+    def discard(self):
+        self.__file.close()
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+class SftpFileManager:
+    """
+    A class for managing file operations with an SFTP server.
+    Uploaded files are encrypted either as Fernet tokens (legacy, default) or as AES-GCM stream containers.
+    Files are uploaded under a temporary name and only renamed to their final name once they are complete and verified,
+    so that the folder on the SFTP server never holds partially written files under their final name.
+    The configuration is read from the environment unless another mapping is given.
+    """
+    __encryption_modes = ('fernet', 'aes-gcm-stream')
+    __verification_modes = ('size', 'checksum')
+    __suffix_tmp = '.part'
+
+    def __init__(self, config: Mapping[str, str] = os.environ):
+        self.__sftp_host = config['SFTP.HOST']
+        self.__sftp_port = int(config.get('SFTP.PORT', 22))
+        self.__sftp_username = config['SFTP.USERNAME']
+        self.__sftp_password = config['SFTP.PASSWORD']
+        self.__sftp_timeout = int(config['SFTP.TIMEOUT'])
+        self.__sftp_foldername = config['SFTP.FOLDERNAME']
+        self.__sftp_pool_size = int(config.get('SFTP.POOL_SIZE', 4))
+        self.__sftp_keepalive = int(config.get('SFTP.KEEPALIVE', 30))
+        self.__sftp_verify = config.get('SFTP.VERIFY', 'size')
+        if self.__sftp_verify not in self.__verification_modes:
+            raise SystemExit(f'unknown verification mode {self.__sftp_verify}')
+        self.__supports_posix_rename = True
+        self.__path_key_encryption = config['SECURITY.PATH_ENCRYPTION_KEY']
+        self.__working_dir = config['MISC.WORKING_DIR']
+        self.__encryption_mode = config.get('SECURITY.ENCRYPTION_MODE', 'fernet')
+        self.__chunk_size = int(config.get('MISC.CHUNK_SIZE', 1048576))
+        if self.__encryption_mode not in self.__encryption_modes:
+            raise SystemExit(f'unknown encryption mode {self.__encryption_mode}')
+        self.__key = None
+        self.__encryptors = None
+        self.__pool = SftpConnectionPool(self.__sftp_host, self.__sftp_port, self.__sftp_username, self.__sftp_password,
+                                         self.__sftp_timeout, self.__sftp_pool_size, self.__sftp_keepalive,
+                                         RetryPolicy.from_config(config, 'SFTP'))
+        bandwidth_limit = float(config.get('SFTP.BANDWIDTH_LIMIT', 0))
+        self.__bandwidth = TokenBucket(bandwidth_limit) if bandwidth_limit > 0 else None
+
+    def __load_encryptors(self) -> (Fernet, StreamingFernet | AesGcmStreamCipher):
         """
-        This method verifies the TOML file path, loads the configuration, flattens it into a dictionary,
-        and sets the environment variables based on the loaded configuration.
+        Read the key on first use, so runs without uploads do not need it.
+        `encryptor` stays a plain Fernet instance for single-shot use. Uploads are encrypted by the stream encryptor
+        of the configured mode.
         """
-        required_keys = {'BROKER.URL', 'BROKER.API_KEY', 'REQUESTS.TAG', 'SFTP.HOST', 'SFTP.USERNAME',
-                         'SFTP.PASSWORD', 'SFTP.TIMEOUT', 'SFTP.FOLDERNAME', 'SECURITY.PATH_ENCRYPTION_KEY',
-                         'MISC.WORKING_DIR'}
-        optional_keys = {'REQUESTS_CA_BUNDLE'}
-        if not os.path.isfile(path_toml):
-            raise SystemExit('invalid TOML file path')
-        with open(path_toml, encoding='utf-8') as file:
-            dict_config = toml.load(file)
-        flattened_config = self.__flatten_dict(dict_config)
-        loaded_keys = set(flattened_config.keys())
-        missing_keys = required_keys - loaded_keys
-        if missing_keys:
-            raise SystemExit(f'following keys are missing in config file: {missing_keys}')
-        for key in required_keys | optional_keys:
-            if key in flattened_config:
-                value = flattened_config[key]
-                os.environ[key] = str(value)
+        if self.__encryptors is None:
+            from cryptography.fernet import Fernet
+            with open(self.__path_key_encryption, 'rb') as key:
+                self.__key = key.read()
+            self.__encryptors = Fernet(self.__key), self.create_stream_encryptor(self.__encryption_mode, self.__key, self.__chunk_size)
+        return self.__encryptors
 
-    def upload_tagged_results_to_sftp(self):
+    @property
+    def encryptor(self) -> Fernet:
+        return self.__load_encryptors()[0]
+
+    @staticmethod
+    def create_stream_encryptor(encryption_mode: str, key: bytes, chunk_size: int) -> StreamingFernet | AesGcmStreamCipher:
+        if encryption_mode == 'aes-gcm-stream':
+            return AesGcmStreamCipher(key, chunk_size)
+        return StreamingFernet(key)
+
+    @property
+    def pool_size(self) -> int:
+        return self.__sftp_pool_size
+
+    def __throttle(self, num_bytes: int):
         """
-        Upload tagged results to the SFTP server.
+        Wait before sending the given number of bytes if the uploads of all channels would exceed `SFTP.BANDWIDTH_LIMIT`.
+        """
+        if self.__bandwidth is not None:
+            self.__bandwidth.consume(num_bytes)
 
-        This method performs the following actions:
-        - Retrieves the completion status of tagged requests from the broker.
-        - Compares the completion status between the broker and the SFTP server.
-        - Deletes results from the SFTP server for requests that have been deleted from the broker.
-        - Uploads new and updated results to the SFTP server.
-        - Updates the completion status in the status XML file.
-        - Uploads the status XML file to the SFTP server.
-
-        If any upload or connection fails, an exception is raised, and the process is discontinued.
-        The status XML file is saved after every modification to ensure the most up-to-date state in case of failure.
-        """
-        dict_broker = self.__broker.get_tagged_requests_completion_as_dict()
-        dict_xml = self.__xml.get_request_completion_as_dict()
-        set_new, set_update, set_delete = self.__xml.compare_request_completion_between_broker_and_sftp(dict_broker, dict_xml)
-
-        for id_request in set_delete:
-            self.__sftp.delete_request_result(id_request)
-            self.__xml.add_delete_tag_to_element(id_request)
-        for id_request in set_new.union(set_update):
-            response_zip = self.__broker.get_request_result(id_request)
-            self.__sftp.upload_request_result(response_zip)
-            completion = dict_broker.get(id_request)
-            self.__xml.update_or_add_element(id_request, completion)
-        self.__sftp.upload_file(self.__xml.path_status_xml)
-
-
-def main(path_toml: str):
-    try:
-        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s', handlers=[logging.StreamHandler()])
-        manager = Manager(path_toml)
-        manager.upload_tagged_results_to_sftp()
+    def submit_encryption(self, executor: Executor, path_plain: str, filename: str) -> (str, Future):
+        """
+        Encrypt a local file in the configured mode into a temporary file in the working directory, using the given executor.
+        Only the paths and the key are passed to the executor, so a process pool does not need to pickle the content.
+        Returns the path to the temporary file together with the future of the encryption.
+        """
+        path_encrypted = os.path.join(self.__working_dir, filename)
+        self.__load_encryptors()
+        future = executor.submit(self.encrypt_file, path_plain, path_encrypted, self.__encryption_mode, self.__key, self.__chunk_size)
+        future.add_done_callback(self.__record_encryption)
+        return path_encrypted, future
+
+    @staticmethod
+    def __record_encryption(future: Future):
+        if not future.cancelled():
+            failed = future.exception() is not None
+            metrics.record('encrypt', 0.0 if failed else future.result(), failed)
+
+    @staticmethod
+    def encrypt_file(path_plain: str, path_encrypted: str, encryption_mode: str, key: bytes, chunk_size: int) -> float:
+        """
+        Encrypt a local file chunk by chunk into another local file. Runs in a worker process of `submit_encryption()`.
+        Returns the seconds spent, as the metrics of the worker process are not collected.
+        """
+        start = time.perf_counter()
+        writer = EncryptedFileWriter(path_encrypted, SftpFileManager.create_stream_encryptor(encryption_mode, key, chunk_size).encryptor())
+        try:
+            with open(path_plain, 'rb') as file:
+                for chunk in iter(lambda: file.read(chunk_size), b''):
+                    writer.write(chunk)
+            writer.close()
+        except Exception:
+            writer.discard()
+            raise
+        return time.perf_counter() - start
+
+    def open_encrypted_tmp_file(self, filename: str) -> 'EncryptedFileWriter':
+        """
+        Open a temporary file in the working directory, to which plaintext is written encrypted in the configured mode.
+        """
+        return EncryptedFileWriter(os.path.join(self.__working_dir, filename), self.__load_encryptors()[1].encryptor())
+
+    @staticmethod
+    def remove_tmp_file(tmp_path_file: str):
+        if os.path.isfile(tmp_path_file):
+            os.remove(tmp_path_file)
+
+    @staticmethod
+    def extract_filename_from_broker_response(response: requests.models.Response) -> str:
+        return re.search('filename=\"(.*)\"', response.headers['Content-Disposition']).group(1)
+
+    def stage_file(self, path_file: str):
+        """
+        Upload a file to the SFTP server under a temporary name, so that it is not visible under its final name yet.
+        The uploaded file is verified by its size or, with `SFTP.VERIFY = "checksum"`, by its SHA-256 checksum.
+        If the connection drops, the upload is retried and resumes at the size of the file on the server,
+        as long as the file was already written by a previous attempt of this upload.
+        """
+        logging.info('Sending %s to sftp server', path_file)
+        path_remote = self.__create_remote_path(self.__create_tmp_file_name(os.path.basename(path_file)))
+        size = os.path.getsize(path_file)
+        opened = []
+
+        def put(sftp: paramiko.sftp_client.SFTPClient):
+            offset = min(sftp.stat(path_remote).st_size, size) if opened else 0
+            if offset:
+                logging.info('Resuming upload of %s at byte %d', path_file, offset)
+            with open(path_file, 'rb') as file_local, sftp.open(path_remote, 'r+b' if offset else 'wb') as file_remote:
+                opened.append(True)
+                file_remote.set_pipelined(True)
+                file_local.seek(offset)
+                file_remote.seek(offset)
+                for chunk in iter(lambda: file_local.read(self.__chunk_size), b''):
+                    self.__throttle(len(chunk))
+                    file_remote.write(chunk)
+            size_remote = sftp.stat(path_remote).st_size
+            if size_remote != size:
+                raise IOError(f'size mismatch in upload of {path_file}: {size_remote} != {size}')
+            if self.__sftp_verify == 'checksum':
+                self.__verify_checksum(sftp, path_file, path_remote)
+
+        with metrics.span('sftp_upload'):
+            self.__pool.run(put)
+        metrics.increment('bytes_uploaded', size)
+
+    def __verify_checksum(self, sftp: paramiko.sftp_client.SFTPClient, path_file: str, path_remote: str):
+        """
+        Compare the SHA-256 checksum of the local and the uploaded file. The checksum of the uploaded file is calculated
+        by the server if it supports the `check-file` extension. Otherwise, the uploaded file is read back.
+        """
+        with open(path_file, 'rb') as file_local:
+            checksum_local = hashlib.sha256()
+            for chunk in iter(lambda: file_local.read(self.__chunk_size), b''):
+                checksum_local.update(chunk)
+        with sftp.open(path_remote, 'rb') as file_remote:
+            try:
+                checksum_remote = file_remote.check('sha256')
+            except IOError:
+                file_remote.prefetch()
+                checksum = hashlib.sha256()
+                for chunk in iter(lambda: file_remote.read(self.__chunk_size), b''):
+                    checksum.update(chunk)
+                checksum_remote = checksum.digest()
+        if checksum_remote != checksum_local.digest():
+            raise IOError(f'checksum mismatch in upload of {path_file}')
+
+    def publish_files(self, filenames: list) -> dict:
+        """
+        Rename staged files to their final names, replacing existing files. The renames are executed concurrently on all channels.
+        Uses the atomic `posix-rename` extension if the server supports it. Otherwise, an existing file is renamed aside and removed after the rename.
+        Returns the files that could not be renamed, mapped to the raised exception.
+        """
+        failures = {}
+        with metrics.span('sftp_publish'), ThreadPoolExecutor(max_workers=self.__sftp_pool_size) as executor:
+            futures = {executor.submit(self.__pool.run, functools.partial(self.__rename_into_place, filename)): filename
+                       for filename in filenames}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as err:
+                    failures[futures[future]] = err
+        return failures
+
+    def __rename_into_place(self, filename: str, sftp: paramiko.sftp_client.SFTPClient):
+        path_tmp = self.__create_remote_path(self.__create_tmp_file_name(filename))
+        path_final = self.__create_remote_path(filename)
+        if self.__supports_posix_rename:
+            try:
+                sftp.posix_rename(path_tmp, path_final)
+                return
+            except IOError as err:
+                if not self.__is_unsupported_error(err):
+                    raise
+            logging.info('SFTP server does not support posix-rename, replacing files by renaming them aside')
+            self.__supports_posix_rename = False
+        self.__replace_by_rename(filename, sftp, path_tmp, path_final)
+
+    def __replace_by_rename(self, filename: str, sftp: paramiko.sftp_client.SFTPClient, path_tmp: str, path_final: str):
+        """
+        Replace a file with plain renames, which fail if the new name exists. The existing file is renamed aside and only removed
+        once the new file is in place. If the new file cannot be renamed into place, the existing file is renamed back.
+        """
+        path_aside = self.__create_remote_path(self.__create_tmp_file_name(f'{filename}.old'))
+        sftp.stat(path_tmp)
+        with contextlib.suppress(FileNotFoundError):
+            sftp.remove(path_aside)
+        try:
+            sftp.rename(path_final, path_aside)
+        except FileNotFoundError:
+            path_aside = None
+        try:
+            sftp.rename(path_tmp, path_final)
+        except Exception:
+            if path_aside is not None:
+                sftp.rename(path_aside, path_final)
+            raise
+        if path_aside is not None:
+            try:
+                sftp.remove(path_aside)
+            except IOError as err:
+                logging.warning('Removing the replaced file %s failed: %s', path_aside, err)
+
+    @staticmethod
+    def __is_unsupported_error(err: IOError) -> bool:
+        """
+        Whether the server answered with the status SSH_FX_OP_UNSUPPORTED. paramiko raises every status except for missing files
+        and denied permissions as IOError without errno, so the status is told apart by its standard description.
+        """
+        import paramiko
+        return err.errno is None and str(err).lower() == paramiko.sftp.SFTP_DESC[paramiko.sftp.SFTP_OP_UNSUPPORTED].lower()
+
+    def __create_remote_path(self, filename: str) -> str:
+        return f"{self.__sftp_foldername}/{filename}"
+
+    def __create_tmp_file_name(self, filename: str) -> str:
+        return f'{filename}{self.__suffix_tmp}'
+
+    def close(self):
+        self.__pool.close()
+
+    def delete_request_result(self, id_request: str):
+        name_zip = self.create_results_file_name(id_request)
+        self.__delete_file(name_zip)
+
+    def list_files(self) -> dict:
+        """
+        List the files in the folder on the SFTP server with a single request.
+        Returns their attributes, including size and modification time, by filename.
+        """
+        with metrics.span('sftp_list'):
+            list_attr = self.__pool.run(lambda sftp: sftp.listdir_attr(self.__sftp_foldername))
+        return {attr.filename: attr for attr in list_attr}
+
+    def delete_files(self, filenames: list) -> dict:
+        """
+        Delete files from the SFTP server concurrently on all channels. Files that no longer exist are ignored.
+        Returns the files that could not be deleted, mapped to the raised exception.
+        """
+        failures = {}
+        with ThreadPoolExecutor(max_workers=self.__sftp_pool_size) as executor:
+            futures = {executor.submit(self.__delete_file, filename): filename for filename in filenames}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as err:
+                    failures[futures[future]] = err
+        return failures
+
+    def calculate_encrypted_size(self, size: int) -> int:
+        """
+        Calculate the size of a result of the given size once it is encrypted in the configured mode.
+        """
+        if self.__encryption_mode == 'aes-gcm-stream':
+            return AesGcmStreamCipher.calculate_container_size(size, self.__chunk_size)
+        return StreamingFernet.calculate_token_size(size)
+
+    @classmethod
+    def is_tmp_file_name(cls, filename: str) -> bool:
+        return filename.endswith(cls.__suffix_tmp)
+
+    @staticmethod
+    def is_results_file_name(filename: str) -> bool:
+        return re.fullmatch(r'export_.+\.zip', filename) is not None
+
+    @staticmethod
+    def create_results_file_name(id_request: str) -> str:
+        """
+        Create the file name for the request result based on the AKTIN Broker naming convention.
+        """
+        return ''.join(['export_', id_request, '.zip'])
+
+    def __delete_file(self, filename: str):
+        logging.info('Deleting %s from sftp server', filename)
+        try:
+            with metrics.span('sftp_delete'):
+                self.__pool.run(lambda sftp: sftp.remove(self.__create_remote_path(filename)))
+        except FileNotFoundError:
+            logging.info('%s could not be found', filename)
+
+
+class StatusStore(ABC):
+    """
+    Interface of the stores that keep track of the request results uploaded to the SFTP server.
+    Every store keeps an XML export of its state at `path_status_xml`, which is uploaded to the SFTP server.
+    """
+    path_status_xml: str
+
+    @abstractmethod
+    def update_or_add_element(self, id_request: str, completion: str, digest: str = None, size: int = None):
+        pass
+
+    @abstractmethod
+    def update_completion_of_element(self, id_request: str, completion: str):
+        pass
+
+    @abstractmethod
+    def add_delete_tag_to_element(self, id_request: str):
+        pass
+
+    @abstractmethod
+    def is_request_tagged_as_deleted(self, id_request: str) -> bool:
+        pass
+
+    @abstractmethod
+    def get_request_completion_as_dict(self) -> dict:
+        pass
+
+    @abstractmethod
+    def get_request_digest_as_dict(self) -> dict:
+        pass
+
+    @abstractmethod
+    def get_request_size_as_dict(self) -> dict:
+        pass
+
+    @abstractmethod
+    def get_request_upload_time_as_dict(self) -> dict:
+        pass
+
+    @abstractmethod
+    def flush(self):
+        """
+        Persist all pending changes and bring the XML export at `path_status_xml` up to date.
+        """
+        pass
+
+    def close(self):
+        """
+        Release resources held by the store. Pending changes have to be flushed before.
+        """
+        pass
+
+    def compare_request_completion_between_broker_and_sftp(self, dict_broker: dict, dict_xml: dict) -> (set, set, set):
+        set_new = dict_broker.keys() - dict_xml.keys()
+        set_update = self.__get_requests_to_update(dict_broker, dict_xml)
+        set_delete = self.__get_requests_to_delete(dict_broker, dict_xml)
+        logging.info(f"{len(set_new)} new requests, {len(set_update)} requests to update, {len(set_delete)} requests to delete")
+        return set_new, set_update, set_delete
+
+    def __get_requests_to_update(self, dict_broker: dict, dict_xml: dict) -> set:
+        """
+        A request has to be updated on sftp server if its completion rate changed
+        """
+        set_common = dict_broker.keys() & dict_xml.keys()
+        return {key for key in set_common if dict_broker[key] != dict_xml[key] and not self.is_request_tagged_as_deleted(key)}
+
+    def __get_requests_to_delete(self, dict_broker: dict, dict_xml: dict) -> set:
+        """
+        A request with the tag "deleted" is already deleted on sftp server
+        """
+        set_missing = dict_xml.keys() - dict_broker.keys()
+        return {key for key in set_missing if not self.is_request_tagged_as_deleted(key)}
+
+
+class StatusXmlManager(StatusStore):
+    """
+    A class for managing operations on an XML status file.
+    Elements are looked up via an index of request ids, which is built once on load and kept current on every mutation.
+
+    Mutations are written behind: the XML file is only rewritten after a configurable number of mutations
+    or seconds, and on `flush()`. A count of 0 disables flushing by count, which is the default if only an interval is configured. Each rewrite goes to a temporary file that is synced and renamed in place.
+    Until then, every mutation is appended to a journal, which is replayed on the next start after a crash.
+    The configuration is read from the environment unless another mapping is given.
+    """
+
+    def __init__(self, config: Mapping[str, str] = os.environ):
+        self.path_status_xml = os.path.join(config['MISC.WORKING_DIR'], 'status.xml')
+        self.__path_journal = os.path.join(config['MISC.WORKING_DIR'], 'status.journal')
+        self.__flush_interval = float(config.get('MISC.STATUS_FLUSH_INTERVAL', 0))
+        self.__flush_count = int(config.get('MISC.STATUS_FLUSH_COUNT', 0 if self.__flush_interval > 0 else 1))
+        self.__num_pending = 0
+        self.__time_last_flush = time.monotonic()
+        self.__journal = None
+        if not os.path.isfile(self.path_status_xml):
+            self.__init_status_xml()
+        self.__format_date = '%Y-%m-%d %H:%M:%S'
+        self.__element_tree = et.parse(self.path_status_xml)
+        self.__index = self.__build_index()
+        self.__replay_journal()
+
+    def __init_status_xml(self):
+        """
+        Creates a new 'status.xml' file in the working directory with an empty <status> tag.
+        """
+        root = et.Element('status')
+        self.__element_tree = et.ElementTree(root)
+        self.__save_current_status_xml_as_file()
+
+    def __save_current_status_xml_as_file(self):
+        path_tmp = f'{self.path_status_xml}.tmp'
+        with metrics.span('status_save'):
+            with open(path_tmp, 'wb') as file:
+                self.__element_tree.write(file, encoding='utf-8')
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(path_tmp, self.path_status_xml)
+
+    def flush(self):
+        """
+        Write all pending mutations to the XML file and discard the journal.
+        """
+        self.__save_current_status_xml_as_file()
+        if self.__journal is not None:
+            self.__journal.close()
+            self.__journal = None
+        if os.path.isfile(self.__path_journal):
+            os.remove(self.__path_journal)
+        self.__num_pending = 0
+        self.__time_last_flush = time.monotonic()
+
+    def __is_flush_due(self) -> bool:
+        return 0 < self.__flush_count <= self.__num_pending or time.monotonic() - self.__time_last_flush >= self.__flush_interval > 0
+
+    def __append_to_journal(self, mutation: dict):
+        if self.__journal is None:
+            self.__journal = open(self.__path_journal, 'a', encoding='utf-8')
+        self.__journal.write(json.dumps(mutation) + '\n')
+        self.__journal.flush()
+        os.fsync(self.__journal.fileno())
+
+    def __replay_journal(self):
+        """
+        Apply the mutations of a journal left behind by an interrupted run. A torn last line is ignored.
+        """
+        if not os.path.isfile(self.__path_journal):
+            return
+        with open(self.__path_journal, encoding='utf-8') as journal:
+            lines = journal.readlines()
+        num_replayed = 0
+        for line in lines:
+            try:
+                mutation = json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning('Skipping incomplete entry in %s', self.__path_journal)
+                continue
+            self.__apply(mutation)
+            num_replayed += 1
+        logging.info('%d pending status changes replayed from journal', num_replayed)
+        self.flush()
+
+    def __commit(self, mutation: dict):
+        mutation['timestamp'] = datetime.utcnow().strftime(self.__format_date)
+        self.__apply(mutation)
+        self.__num_pending += 1
+        if self.__is_flush_due():
+            self.flush()
+        else:
+            self.__append_to_journal(mutation)
+
+    def __apply(self, mutation: dict):
+        operation = mutation['operation']
+        if operation == 'upload':
+            self.__apply_upload(mutation['id'], mutation['completion'], mutation['digest'], mutation['size'], mutation['timestamp'])
+        elif operation == 'completion':
+            self.get_element_by_id(mutation['id']).find('completion').text = mutation['completion']
+        elif operation == 'delete':
+            self.__add_or_update_tag_in_element(self.get_element_by_id(mutation['id']), 'deleted', mutation['timestamp'])
+
+    def __build_index(self) -> dict:
+        """
+        Map each request id to its element. If an id occurs more than once, the first element is used.
+        """
+        index = {}
+        for request_status in self.__element_tree.getroot().iter('request-status'):
+            id_element = request_status.find('id')
+            if id_element is not None:
+                index.setdefault(id_element.text, request_status)
+        return index
+
+    def get_element_by_id(self, id_request: str) -> et.Element:
+        return self.__index.get(id_request)
+
+    def get_root(self) -> et.Element:
+        return self.__element_tree.getroot()
+
+    def update_or_add_element(self, id_request: str, completion: str, digest: str = None, size: int = None):
+        """
+        Note the upload of a request result. If given, the SHA-256 digest and byte size of the uploaded result are stored as well.
+        """
+        self.__commit({'operation': 'upload', 'id': id_request, 'completion': completion, 'digest': digest, 'size': size})
+
+    def __apply_upload(self, id_request: str, completion: str, digest: str, size: int, timestamp: str):
+        request_status = self.get_element_by_id(id_request)
+        if request_status is not None:
+            request_status.find('completion').text = completion
+            self.__add_or_update_tag_in_element(request_status, 'last-update', timestamp)
+        else:
+            request_status = et.SubElement(self.__element_tree.getroot(), 'request-status')
+            et.SubElement(request_status, 'id').text = id_request
+            et.SubElement(request_status, 'completion').text = completion
+            et.SubElement(request_status, 'uploaded').text = timestamp
+            self.__index[id_request] = request_status
+        self.__add_content_tags_to_element(request_status, digest, size)
+
+    def update_completion_of_element(self, id_request: str, completion: str):
+        """
+        Update only the completion of a request whose result on the SFTP server did not change.
+        """
+        self.__commit({'operation': 'completion', 'id': id_request, 'completion': completion})
+
+    def __add_content_tags_to_element(self, parent: et.Element, digest: str, size: int) -> None:
+        if digest is not None:
+            self.__add_or_update_tag_in_element(parent, 'digest', digest)
+        if size is not None:
+            self.__add_or_update_tag_in_element(parent, 'size', str(size))
+
+    @staticmethod
+    def __add_or_update_tag_in_element(parent: et.Element, name_tag: str, text: str) -> None:
+        child = parent.find(name_tag)
+        if child is None:
+            et.SubElement(parent, name_tag).text = text
+        else:
+            child.text = text
+
+    def add_delete_tag_to_element(self, id_request: str):
+        self.__commit({'operation': 'delete', 'id': id_request})
+
+    def get_request_completion_as_dict(self) -> dict:
+        """
+        Extract the request ID and completion from each element in the status XML.
+        Returns them as a dictionary.
+        """
+        return {id_request: request_status.find('completion').text for id_request, request_status in self.__index.items()}
+
+    def get_request_digest_as_dict(self) -> dict:
+        """
+        Extract the request ID and content digest of each element in the status XML that has a digest.
+        Returns them as a dictionary.
+        """
+        dict_digest = {}
+        for id_request, request_status in self.__index.items():
+            digest_element = request_status.find('digest')
+            if digest_element is not None:
+                dict_digest[id_request] = digest_element.text
+        return dict_digest
+
+    def get_request_size_as_dict(self) -> dict:
+        """
+        Extract the request ID and byte size of each element in the status XML that has a size.
+        Returns them as a dictionary.
+        """
+        dict_size = {}
+        for id_request, request_status in self.__index.items():
+            size_element = request_status.find('size')
+            if size_element is not None:
+                dict_size[id_request] = int(size_element.text)
+        return dict_size
+
+    def get_request_upload_time_as_dict(self) -> dict:
+        """
+        Extract the request ID and the time of the first upload (UTC) from each element in the status XML.
+        Returns them as a dictionary.
+        """
+        return {id_request: datetime.strptime(request_status.find('uploaded').text, self.__format_date)
+                for id_request, request_status in self.__index.items()}
+
+    def is_request_tagged_as_deleted(self, id_request: str) -> bool:
+        parent = self.get_element_by_id(id_request)
+        child = parent.find('deleted')
+        return child is not None
+
+
+class StatusSqliteManager(StatusStore):
+    """
+    A class for keeping track of uploaded request results in an SQLite database.
+    Lookups use the primary key index. Changes are committed in transactions of up to `MISC.STATUS_FLUSH_COUNT` changes.
+    On first use, an existing XML status file is migrated into the database. The XML status file is
+    still exported on every `flush()`, so it can be uploaded for downstream consumers.
+    """
+
+    def __init__(self, config: Mapping[str, str] = os.environ):
+        self.__config = config
+        self.path_status_xml = os.path.join(config['MISC.WORKING_DIR'], 'status.xml')
+        self.__path_db = os.path.join(config['MISC.WORKING_DIR'], 'status.db')
+        self.__flush_count = int(config.get('MISC.STATUS_FLUSH_COUNT', 1))
+        self.__format_date = '%Y-%m-%d %H:%M:%S'
+        self.__num_pending = 0
+        is_new_db = not os.path.isfile(self.__path_db)
+        self.__connection = sqlite3.connect(self.__path_db)
+        self.__create_table()
+        if is_new_db and os.path.isfile(self.path_status_xml):
+            self.__migrate_status_xml()
+
+    def __create_table(self):
+        with self.__connection:
+            self.__connection.execute("""
+                CREATE TABLE IF NOT EXISTS request_status (
+                    id TEXT PRIMARY KEY,
+                    completion TEXT NOT NULL,
+                    uploaded TEXT NOT NULL,
+                    last_update TEXT,
+                    deleted TEXT,
+                    digest TEXT,
+                    size INTEGER
+                )""")
+
+    def __migrate_status_xml(self):
+        """
+        Import all elements of the existing XML status file in one transaction.
+        """
+        root = StatusXmlManager(self.__config).get_root()
+        rows = []
+        for request_status in root.iter('request-status'):
+            rows.append(tuple(self.__get_child_text(request_status, name_tag)
+                              for name_tag in ('id', 'completion', 'uploaded', 'last-update', 'deleted', 'digest', 'size')))
+        with self.__connection:
+            self.__connection.executemany('INSERT OR IGNORE INTO request_status VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        logging.info('%d elements migrated from %s', len(rows), self.path_status_xml)
+
+    @staticmethod
+    def __get_child_text(parent: et.Element, name_tag: str) -> str:
+        child = parent.find(name_tag)
+        return child.text if child is not None else None
+
+    def __execute(self, statement: str, parameters: tuple):
+        """
+        Execute a change in the current transaction and commit it once enough changes are pending.
+        """
+        self.__connection.execute(statement, parameters)
+        self.__num_pending += 1
+        if self.__num_pending >= self.__flush_count:
+            self.__commit()
+
+    def __commit(self):
+        self.__connection.commit()
+        self.__num_pending = 0
+
+    def __now(self) -> str:
+        return datetime.utcnow().strftime(self.__format_date)
+
+    def update_or_add_element(self, id_request: str, completion: str, digest: str = None, size: int = None):
+        """
+        Note the upload of a request result. If given, the SHA-256 digest and byte size of the uploaded result are stored as well.
+        """
+        now = self.__now()
+        self.__execute("""
+            INSERT INTO request_status (id, completion, uploaded, digest, size) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                completion = excluded.completion,
+                last_update = excluded.uploaded,
+                digest = COALESCE(excluded.digest, digest),
+                size = COALESCE(excluded.size, size)""", (id_request, completion, now, digest, size))
+
+    def update_completion_of_element(self, id_request: str, completion: str):
+        self.__execute('UPDATE request_status SET completion = ? WHERE id = ?', (completion, id_request))
+
+    def add_delete_tag_to_element(self, id_request: str):
+        self.__execute('UPDATE request_status SET deleted = ? WHERE id = ?', (self.__now(), id_request))
+
+    def is_request_tagged_as_deleted(self, id_request: str) -> bool:
+        row = self.__connection.execute('SELECT deleted FROM request_status WHERE id = ?', (id_request,)).fetchone()
+        return row is not None and row[0] is not None
+
+    def get_request_completion_as_dict(self) -> dict:
+        return dict(self.__connection.execute('SELECT id, completion FROM request_status'))
+
+    def get_request_digest_as_dict(self) -> dict:
+        return dict(self.__connection.execute('SELECT id, digest FROM request_status WHERE digest IS NOT NULL'))
+
+    def get_request_size_as_dict(self) -> dict:
+        return dict(self.__connection.execute('SELECT id, size FROM request_status WHERE size IS NOT NULL'))
+
+    def get_request_upload_time_as_dict(self) -> dict:
+        return {id_request: datetime.strptime(uploaded, self.__format_date)
+                for id_request, uploaded in self.__connection.execute('SELECT id, uploaded FROM request_status')}
+
+    def flush(self):
+        """
+        Commit all pending changes and export the database as XML status file.
+        """
+        with metrics.span('status_save'):
+            self.__commit()
+            self.__export_status_xml()
+
+    def __export_status_xml(self):
+        root = et.Element('status')
+        rows = self.__connection.execute('SELECT id, completion, uploaded, last_update, deleted, digest, size FROM request_status ORDER BY rowid')
+        for row in rows:
+            request_status = et.SubElement(root, 'request-status')
+            for name_tag, value in zip(('id', 'completion', 'uploaded', 'last-update', 'deleted', 'digest', 'size'), row):
+                if value is not None:
+                    et.SubElement(request_status, name_tag).text = str(value)
+        path_tmp = f'{self.path_status_xml}.tmp'
+        with open(path_tmp, 'wb') as file:
+            et.ElementTree(root).write(file, encoding='utf-8')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path_tmp, self.path_status_xml)
+
+    def close(self):
+        self.__connection.close()
+
+
+class StatusManifest:
+    """
+    A class for publishing the status XML file of a target to its SFTP server.
+    The upload is skipped if the file is identical to its last upload, which is kept as a copy in the working directory.
+    With `MISC.STATUS_VARIANT`, a compressed variant `status.xml.gz` is published as well, either as plain gzip (`gzip`) or
+    encrypted like the results (`gzip-encrypted`). With `MISC.STATUS_CHANGELOG`, the request statuses that changed with each of the
+    last uploads are published in `status_changes.xml`, so consumers can catch up without fetching the full file.
+    All files are staged first and renamed into place in one batch.
+    """
+    __variants = ('none', 'gzip', 'gzip-encrypted')
+
+    def __init__(self, config: Mapping[str, str], sftp: SftpFileManager, path_status_xml: str):
+        self.__sftp = sftp
+        self.__path_status_xml = path_status_xml
+        self.__working_dir = config['MISC.WORKING_DIR']
+        self.__path_uploaded = os.path.join(self.__working_dir, 'status.uploaded.xml')
+        self.__path_changelog = os.path.join(self.__working_dir, 'status_changes.xml')
+        self.__variant = config.get('MISC.STATUS_VARIANT', 'none')
+        if self.__variant not in self.__variants:
+            raise SystemExit(f'unknown status variant {self.__variant}')
+        self.__num_changelog_runs = int(config.get('MISC.STATUS_CHANGELOG', 0))
+
+    def publish(self, force: bool = False):
+        """
+        Upload the status XML file and its configured variants, unless the file did not change since its last upload.
+        With `force`, the files are uploaded in any case, e.g. if they might be missing on the SFTP server.
+        """
+        with open(self.__path_status_xml, 'rb') as file:
+            content = file.read()
+        content_uploaded = self.__read_uploaded()
+        if not force and content == content_uploaded:
+            logging.info('%s is unchanged since its last upload', self.__path_status_xml)
+            metrics.increment('status_uploads_skipped')
+            return
+        list_paths = [self.__path_status_xml]
+        if self.__variant != 'none':
+            list_paths.append(self.__write_compressed_variant(content))
+        if self.__num_changelog_runs > 0 and content_uploaded is not None and content != content_uploaded:
+            list_paths.append(self.__write_changelog(content_uploaded, content))
+        elif self.__num_changelog_runs > 0 and os.path.isfile(self.__path_changelog):
+            list_paths.append(self.__path_changelog)
+        try:
+            for path in list_paths:
+                self.__sftp.stage_file(path)
+            failures = self.__sftp.publish_files([os.path.basename(path) for path in list_paths])
+            if failures:
+                raise next(iter(failures.values()))
+        finally:
+            for path in list_paths[1:]:
+                if path != self.__path_changelog:
+                    SftpFileManager.remove_tmp_file(path)
+        path_tmp = f'{self.__path_uploaded}.tmp'
+        with open(path_tmp, 'wb') as file:
+            file.write(content)
+        os.replace(path_tmp, self.__path_uploaded)
+
+    def __read_uploaded(self) -> bytes | None:
+        if not os.path.isfile(self.__path_uploaded):
+            return None
+        with open(self.__path_uploaded, 'rb') as file:
+            return file.read()
+
+    def __write_compressed_variant(self, content: bytes) -> str:
+        filename = f'{os.path.basename(self.__path_status_xml)}.gz'
+        content = gzip.compress(content, mtime=0)
+        if self.__variant == 'gzip-encrypted':
+            writer = self.__sftp.open_encrypted_tmp_file(filename)
+            writer.write(content)
+            writer.close()
+            return writer.path
+        path = os.path.join(self.__working_dir, filename)
+        with open(path, 'wb') as file:
+            file.write(content)
+        return path
+
+    def __write_changelog(self, content_uploaded: bytes, content: bytes) -> str:
+        """
+        Append the request statuses that were added or changed since the last upload to the change log, as one run
+        identified by the SHA-256 digests of the previous and the current status XML file. Only the latest runs are kept.
+        """
+        dict_previous = {element.findtext('id'): et.tostring(element) for element in et.fromstring(content_uploaded).iter('request-status')}
+        run = et.Element('run', {'time': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                                 'previous': hashlib.sha256(content_uploaded).hexdigest(), 'current': hashlib.sha256(content).hexdigest()})
+        for element in et.fromstring(content).iter('request-status'):
+            if dict_previous.get(element.findtext('id')) != et.tostring(element):
+                run.append(element)
+        root = et.parse(self.__path_changelog).getroot() if os.path.isfile(self.__path_changelog) else et.Element('status-changes')
+        root.append(run)
+        for element in root.findall('run')[:-self.__num_changelog_runs]:
+            root.remove(element)
+        path_tmp = f'{self.__path_changelog}.tmp'
+        et.ElementTree(root).write(path_tmp, encoding='utf-8', xml_declaration=True)
+        os.replace(path_tmp, self.__path_changelog)
+        return self.__path_changelog
+
+
+class BundleCache:
+    """
+    A class for keeping encrypted request results on disk after their upload, so they can be uploaded again without the broker.
+    Only the latest result of each request is kept, identified by the content digest of the unencrypted result.
+    The SHA-256 checksum of each encrypted file is checked before it is handed out. Once the cache exceeds `max_size` bytes,
+    the least recently used results are evicted. A `max_size` of 0 disables the cache.
+    """
+
+    def __init__(self, path_dir: str, max_size: int):
+        self.__path_dir = path_dir
+        self.__path_index = os.path.join(path_dir, 'index.json')
+        self.__max_size = max_size
+        self.__lock = threading.Lock()
+        self.__index = self.__load_index() if max_size > 0 else {}
+
+    def __load_index(self) -> dict:
+        os.makedirs(self.__path_dir, exist_ok=True)
+        if not os.path.isfile(self.__path_index):
+            return {}
+        try:
+            with open(self.__path_index, encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, json.JSONDecodeError):
+            logging.warning('Ignoring unreadable cache %s', self.__path_index)
+            return {}
+
+    def __save_index(self):
+        path_tmp = f'{self.__path_index}.tmp'
+        with open(path_tmp, 'w', encoding='utf-8') as file:
+            json.dump(self.__index, file)
+        os.replace(path_tmp, self.__path_index)
+
+    def __create_path(self, id_request: str, filename: str) -> str:
+        return os.path.join(self.__path_dir, id_request, filename)
+
+    @staticmethod
+    def __calculate_checksum(path: str) -> str:
+        checksum = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1048576), b''):
+                checksum.update(chunk)
+        return checksum.hexdigest()
+
+    def put(self, id_request: str, digest: str, path_file: str):
+        """
+        Move the encrypted result of a request into the cache, replacing an older result of the request.
+        The file is removed instead if the cache is disabled.
+        """
+        if self.__max_size <= 0:
+            SftpFileManager.remove_tmp_file(path_file)
+            return
+        filename = os.path.basename(path_file)
+        entry = {'digest': digest, 'filename': filename, 'size': os.path.getsize(path_file),
+                 'checksum': self.__calculate_checksum(path_file), 'last_used': time.time()}
+        with self.__lock:
+            self.__remove_entry(id_request)
+            os.makedirs(os.path.dirname(self.__create_path(id_request, filename)), exist_ok=True)
+            os.replace(path_file, self.__create_path(id_request, filename))
+            self.__index[id_request] = entry
+            self.__evict()
+            self.__save_index()
+
+    def get(self, id_request: str, digest: str) -> str | None:
+        """
+        Get the path to the cached encrypted result of a request, if its content digest matches.
+        A cached file that is missing or fails the integrity check is evicted.
+        """
+        with self.__lock:
+            entry = self.__index.get(id_request)
+            if entry is None or entry['digest'] != digest:
+                return None
+            path = self.__create_path(id_request, entry['filename'])
+            if not os.path.isfile(path) or self.__calculate_checksum(path) != entry['checksum']:
+                logging.warning('Cached result of %s is damaged, evicting it', id_request)
+                self.__remove_entry(id_request)
+                self.__save_index()
+                return None
+            entry['last_used'] = time.time()
+            self.__save_index()
+            return path
+
+    def remove(self, id_request: str):
+        with self.__lock:
+            if id_request in self.__index:
+                self.__remove_entry(id_request)
+                self.__save_index()
+
+    def __remove_entry(self, id_request: str):
+        entry = self.__index.pop(id_request, None)
+        if entry is not None:
+            SftpFileManager.remove_tmp_file(self.__create_path(id_request, entry['filename']))
+
+    def __evict(self):
+        """
+        Evict the least recently used results until the cache fits its size limit.
+        """
+        size = sum(entry['size'] for entry in self.__index.values())
+        for id_request in sorted(self.__index, key=lambda key: self.__index[key]['last_used']):
+            if size <= self.__max_size:
+                break
+            size -= self.__index[id_request]['size']
+            self.__remove_entry(id_request)
+
+
+class ExportTarget:
+    """
+    A class for one recipient of request results. Each target filters the requests by its own tag and has its own
+    SFTP destination, encryption key, status store, status manifest and cache of encrypted results.
+    """
+
+    def __init__(self, name: str, config: Mapping[str, str]):
+        self.name = name
+        self.tag = config['REQUESTS.TAG']
+        os.makedirs(config['MISC.WORKING_DIR'], exist_ok=True)
+        self.sftp = SftpFileManager(config)
+        self.status = self.__init_status_store(config)
+        self.manifest = StatusManifest(config, self.sftp, self.status.path_status_xml)
+        self.cache = BundleCache(os.path.join(config['MISC.WORKING_DIR'], 'cache'), int(config.get('MISC.BUNDLE_CACHE_SIZE', 0)))
+
+    @staticmethod
+    def __init_status_store(config: Mapping[str, str]) -> StatusStore:
+        backend = config.get('MISC.STATUS_BACKEND', 'xml')
+        if backend == 'xml':
+            return StatusXmlManager(config)
+        if backend == 'sqlite':
+            return StatusSqliteManager(config)
+        raise SystemExit(f'unknown status backend {backend}')
+
+    def close(self):
+        self.sftp.close()
+        self.status.close()
+
+
+class ResultUploadPipeline:
+    """
+    A class for transferring request results from the AKTIN Broker to the SFTP servers of all export targets in concurrent stages.
+    Export, download and upload workers are connected by bounded queues, so a slow stage throttles the stages in front of it.
+    Only the calling thread modifies the status stores. If a stage fails as a whole, all stages are stopped and their temporary files removed.
+    """
+    __sentinel = object()
+    __poll_interval = 0.1
+
+    def __init__(self, broker: BrokerRequestResultManager, targets: list):
+        self.__broker = broker
+        self.__queue_size = int(os.environ.get('PIPELINE.QUEUE_SIZE', 4))
+        self.__num_exporters = int(os.environ.get('PIPELINE.EXPORT_WORKERS', 2))
+        self.__num_downloaders = int(os.environ.get('PIPELINE.DOWNLOAD_WORKERS', 2))
+        self.__chunk_size = int(os.environ.get('MISC.CHUNK_SIZE', 1048576))
+        self.__num_uploaders = sum(target.sftp.pool_size for target in targets)
+        encrypt_processes = os.environ.get('PIPELINE.ENCRYPT_PROCESSES', '0')
+        self.__num_encrypt_processes = (os.cpu_count() or 1) if encrypt_processes == 'auto' else int(encrypt_processes)
+        self.__publish_batch = int(os.environ.get('PIPELINE.PUBLISH_BATCH', 16))
+        self.__encrypt_pool = None
+        self.__lock = threading.Lock()
+        self.__working_dir = os.environ['MISC.WORKING_DIR']
+        self.__retry = RetryPolicy.from_config(os.environ, 'BROKER')
+        self.__stop = threading.Event()
+        self.__discarded = []
+        self.__num_running = {}
+        self.failures = []
+
+    def run(self, jobs: list):
+        """
+        Transfer the results of the given jobs. Each job is a tuple (id, destinations) with a list of tuples (target, digest),
+        where digest is the content digest of the last upload of the request to the target.
+        Yields a tuple (target, id, digest, size, uploaded) for each destination as soon as its upload is skipped as unchanged,
+        or once the batch of the uploaded file is renamed into place.
+        Requests that failed are listed as tuples (target, id) in `failures` after the run.
+        If any stage fails as a whole, all stages are stopped and the exception is raised in the calling thread.
+        """
+        self.__stop.clear()
+        self.failures = []
+        self.__discarded = []
+        self.__num_running = {'export': self.__num_exporters, 'download': self.__num_downloaders}
+        queue_jobs = queue.Queue()
+        for job in jobs:
+            queue_jobs.put(job)
+        queue_download = queue.Queue(maxsize=self.__queue_size)
+        queue_upload = queue.Queue(maxsize=self.__queue_size)
+        queue_done = queue.Queue()
+        threads = [threading.Thread(target=self.__export_stage, args=(queue_jobs, queue_download, queue_done), daemon=True)
+                   for _ in range(self.__num_exporters)]
+        threads.extend(threading.Thread(target=self.__download_stage, args=(queue_download, queue_upload, queue_done), daemon=True)
+                       for _ in range(self.__num_downloaders))
+        threads.extend(threading.Thread(target=self.__upload_stage, args=(queue_upload, queue_done), daemon=True)
+                       for _ in range(self.__num_uploaders))
+        if self.__num_encrypt_processes > 0 and jobs:
+            self.__encrypt_pool = self.__create_encrypt_pool()
+        for thread in threads:
+            thread.start()
+        try:
+            num_finished = 0
+            dict_staged = {}
+            num_staged = 0
+            while num_finished < self.__num_uploaders:
+                item = queue_done.get()
+                if item is self.__sentinel:
+                    num_finished += 1
+                elif isinstance(item, Exception):
+                    raise item
+                elif item[4] is None:
+                    yield item[:4] + (False,)
+                else:
+                    dict_staged.setdefault(item[0], []).append(item)
+                    num_staged += 1
+                if num_staged >= self.__publish_batch or num_staged and queue_done.empty() and queue_upload.empty():
+                    yield from self.__publish(dict_staged)
+                    dict_staged, num_staged = {}, 0
+            yield from self.__publish(dict_staged)
+        finally:
+            self.__stop.set()
+            for thread in threads:
+                thread.join()
+            if self.__encrypt_pool is not None:
+                self.__encrypt_pool.shutdown(cancel_futures=True)
+                self.__encrypt_pool = None
+            self.__discard_pending_uploads(queue_upload)
+
+    def __export_stage(self, queue_jobs: queue.Queue, queue_download: queue.Queue, queue_done: queue.Queue):
+        try:
+            while not self.__stop.is_set():
+                try:
+                    id_request, destinations = queue_jobs.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    id_export = self.__broker.export_request_result(id_request)
+                except Exception as err:
+                    self.__record_failure(id_request, destinations, err)
+                    continue
+                self.__put(queue_download, (id_request, id_export, destinations))
+        except Exception as err:
+            self.__fail(queue_done, err)
+        finally:
+            self.__finish_stage('export', queue_download)
+
+    def __download_stage(self, queue_download: queue.Queue, queue_upload: queue.Queue, queue_done: queue.Queue):
+        """
+        Run by `PIPELINE.DOWNLOAD_WORKERS` threads. Each result is downloaded once and encrypted for every target whose tag matches,
+        unless its content digest matches the digest of the last upload to the target.
+        """
+        try:
+            while True:
+                item = self.__get(queue_download)
+                if item is None:
+                    return
+                if item is self.__sentinel:
+                    self.__put(queue_download, self.__sentinel)
+                    return
+                id_request, id_export, destinations = item
+                logging.info('Downloading results of %s', id_request)
+                download = self.__download_and_encrypt if self.__encrypt_pool is None else self.__download_for_encrypt_pool
+                try:
+                    list_tmp_path_file, list_encrypted, digest, size = self.__retry.call(functools.partial(download, id_request, id_export, destinations),
+                                                                                         self.__is_interrupted_download, 'broker_retries')
+                except Exception as err:
+                    self.__record_failure(id_request, destinations, err)
+                    continue
+                for i, ((target, digest_uploaded), tmp_path_file, encrypted) in enumerate(zip(destinations, list_tmp_path_file, list_encrypted)):
+                    if digest_uploaded == digest:
+                        logging.info('Results of %s are unchanged for %s, skipping upload', id_request, target.name)
+                        if tmp_path_file is not None:
+                            SftpFileManager.remove_tmp_file(tmp_path_file)
+                        queue_done.put((target, id_request, digest, size, None))
+                    elif not self.__put(queue_upload, (target, id_request, tmp_path_file, digest, size, encrypted)):
+                        self.__discarded.extend(path for path in list_tmp_path_file[i:] if path is not None)
+                        return
+        except Exception as err:
+            self.__fail(queue_done, err)
+        finally:
+            self.__finish_stage('download', queue_upload)
+
+    def __download(self, id_request: str, id_export: str) -> requests.models.Response:
+        """
+        Download the exported result. If the export has expired on the broker, the result is exported again.
+        """
+        try:
+            return self.__broker.download_exported_result(id_export)
+        except requests.exceptions.HTTPError as err:
+            if err.response is None or err.response.status_code != 404:
+                raise
+            logging.info('Export of %s has expired, exporting again', id_request)
+            return self.__broker.download_exported_result(self.__broker.export_request_result(id_request, use_cache=False))
+
+    def __iter_body(self, id_request: str, response: requests.models.Response) -> Iterator[bytes]:
+        """
+        Iterate over the body of a streamed download. A connection that breaks while reading the body is raised as an IOError.
+        """
+        try:
+            yield from metrics.time_chunks('broker_download_body', response.iter_content(chunk_size=self.__chunk_size))
+        except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError) as err:
+            raise IOError(f'download of {id_request} was interrupted: {err}') from err
+
+    @staticmethod
+    def __is_interrupted_download(err: Exception) -> bool:
+        """
+        Whether the download failed while reading the body. Only then is the whole download repeated, as the calls to the broker
+        retry transient errors themselves and error responses are not retried.
+        """
+        return isinstance(err.__cause__, (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError))
+
+    def __download_and_encrypt(self, id_request: str, id_export: str, destinations: list) -> (list, list, str, int):
+        """
+        Download the exported result once and write it encrypted for each target into the target's working directory while streaming.
+        Returns the paths to the temporary files, no pending encryptions, and the SHA-256 digest and byte size of the unencrypted content.
+        """
+        response = self.__download(id_request, id_export)
+        content_digest = ContentDigest()
+        writers = []
+        seconds_encrypt = 0.0
+        try:
+            filename = SftpFileManager.extract_filename_from_broker_response(response)
+            for target, _ in destinations:
+                writers.append(target.sftp.open_encrypted_tmp_file(filename))
+            for chunk in content_digest.feed(self.__iter_body(id_request, response)):
+                start = time.perf_counter()
+                for writer in writers:
+                    writer.write(chunk)
+                seconds_encrypt += time.perf_counter() - start
+            start = time.perf_counter()
+            for writer in writers:
+                writer.close()
+            seconds_encrypt += time.perf_counter() - start
+        except Exception:
+            for writer in writers:
+                writer.discard()
+            raise
+        finally:
+            response.close()
+        metrics.record('encrypt', seconds_encrypt)
+        metrics.increment('bytes_downloaded', content_digest.size)
+        return [writer.path for writer in writers], [None] * len(writers), content_digest.hexdigest, content_digest.size
+
+    def __download_for_encrypt_pool(self, id_request: str, id_export: str, destinations: list) -> (list, list, str, int):
+        """
+        Download the exported result unencrypted into the working directory and hand it over to the encryption processes by its path,
+        once for each target whose last upload has a different content digest. The unencrypted file is removed once all its encryptions are done.
+        Returns the paths to the temporary files, the futures of their encryption, and the SHA-256 digest and byte size of the unencrypted content.
+        """
+        response = self.__download(id_request, id_export)
+        content_digest = ContentDigest()
+        path_plain = None
+        try:
+            filename = SftpFileManager.extract_filename_from_broker_response(response)
+            path_plain = os.path.join(self.__working_dir, f'{filename}.plain')
+            seconds_write = 0.0
+            with open(path_plain, 'wb') as file:
+                for chunk in content_digest.feed(self.__iter_body(id_request, response)):
+                    start = time.perf_counter()
+                    file.write(chunk)
+                    seconds_write += time.perf_counter() - start
+            metrics.record('write_plain', seconds_write)
+        except Exception:
+            if path_plain is not None:
+                SftpFileManager.remove_tmp_file(path_plain)
+            raise
+        finally:
+            response.close()
+        metrics.increment('bytes_downloaded', content_digest.size)
+        list_tmp_path_file, list_encrypted = [], []
+        try:
+            for target, digest_uploaded in destinations:
+                if digest_uploaded == content_digest.hexdigest:
+                    list_tmp_path_file.append(None)
+                    list_encrypted.append(None)
+                    continue
+                tmp_path_file, encrypted = self.__submit_encryption(target, path_plain, filename)
+                list_tmp_path_file.append(tmp_path_file)
+                list_encrypted.append(encrypted)
+        except Exception:
+            wait([encrypted for encrypted in list_encrypted if encrypted is not None])
+            for tmp_path_file in filter(None, list_tmp_path_file + [path_plain]):
+                SftpFileManager.remove_tmp_file(tmp_path_file)
+            raise
+        pending = [encrypted for encrypted in list_encrypted if encrypted is not None]
+
+        def remove_plain(_):
+            if all(encrypted.done() for encrypted in pending):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path_plain)
+
+        if not pending:
+            remove_plain(None)
+        for encrypted in pending:
+            encrypted.add_done_callback(remove_plain)
+        return list_tmp_path_file, list_encrypted, content_digest.hexdigest, content_digest.size
+
+    def __create_encrypt_pool(self) -> ProcessPoolExecutor:
+        """
+        Start `PIPELINE.ENCRYPT_PROCESSES` worker processes, or one per CPU core with `auto`.
+        """
+        return ProcessPoolExecutor(max_workers=self.__num_encrypt_processes, mp_context=multiprocessing.get_context('spawn'))
+
+    def __submit_encryption(self, target: ExportTarget, path_plain: str, filename: str) -> (str, Future):
+        """
+        Submit the encryption of a downloaded result for a target to the pool of encryption processes.
+        If the pool is broken, it is replaced by a new pool and the encryption is submitted once more.
+        """
+        with self.__lock:
+            try:
+                return target.sftp.submit_encryption(self.__encrypt_pool, path_plain, filename)
+            except BrokenProcessPool:
+                logging.warning('Pool of encryption processes is broken, starting a new one')
+                self.__encrypt_pool.shutdown(wait=False)
+                self.__encrypt_pool = self.__create_encrypt_pool()
+                return target.sftp.submit_encryption(self.__encrypt_pool, path_plain, filename)
+
+    def __upload_stage(self, queue_upload: queue.Queue, queue_done: queue.Queue):
+        """
+        Run by one thread per channel of the SFTP connection pools of all targets.
+        """
+        try:
+            while True:
+                item = self.__get(queue_upload)
+                if item is None:
+                    return
+                if item is self.__sentinel:
+                    self.__put(queue_upload, self.__sentinel)
+                    return
+                target, id_request, tmp_path_file, digest, size, encrypted = item
+                try:
+                    if encrypted is not None:
+                        encrypted.result()
+                    target.sftp.stage_file(tmp_path_file)
+                except Exception as err:
+                    SftpFileManager.remove_tmp_file(tmp_path_file)
+                    self.__record_failure(id_request, [(target, digest)], err)
+                    continue
+                target.cache.put(id_request, digest, tmp_path_file)
+                queue_done.put((target, id_request, digest, size, os.path.basename(tmp_path_file)))
+        except Exception as err:
+            self.__fail(queue_done, err)
+        finally:
+            queue_done.put(self.__sentinel)
+
+    def __finish_stage(self, stage: str, destination: queue.Queue):
+        """
+        Signal the end of a stage to the workers of the next stage, once the last worker of the stage is finished.
+        """
+        with self.__lock:
+            self.__num_running[stage] -= 1
+            is_last = self.__num_running[stage] == 0
+        if is_last:
+            self.__put(destination, self.__sentinel)
+
+    def __put(self, destination: queue.Queue, item) -> bool:
+        """
+        Put an item into a bounded queue. Gives up and returns False once the pipeline is stopped.
+        """
+        while not self.__stop.is_set():
+            try:
+                destination.put(item, timeout=self.__poll_interval)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __get(self, source: queue.Queue):
+        """
+        Get an item from a queue. Returns None once the pipeline is stopped.
+        """
+        while not self.__stop.is_set():
+            try:
+                return source.get(timeout=self.__poll_interval)
+            except queue.Empty:
+                continue
+        return None
+
+    def __publish(self, dict_staged: dict):
+        """
+        Rename a batch of staged files of each target into place, so the folder only ever shows complete files.
+        Called each time no further upload is waiting or `PIPELINE.PUBLISH_BATCH` results are staged, so consumers see results
+        in the order of their upload and a failed run keeps the progress of the published batches.
+        """
+        for target, list_staged in dict_staged.items():
+            failures = target.sftp.publish_files([filename for *_, filename in list_staged])
+            for _, id_request, digest, size, filename in list_staged:
+                if filename in failures:
+                    self.__record_failure(id_request, [(target, digest)], failures[filename])
+                else:
+                    yield target, id_request, digest, size, True
+
+    def __record_failure(self, id_request: str, destinations: list, err: Exception):
+        for target, _ in destinations:
+            logging.error('Transfer of %s to %s failed: %s', id_request, target.name, err)
+            metrics.increment('requests_failed')
+            self.failures.append((target, id_request))
+
+    def __fail(self, queue_done: queue.Queue, err: Exception):
+        queue_done.put(err)
+        self.__stop.set()
+
+    def __discard_pending_uploads(self, queue_upload: queue.Queue):
+        """
+        Remove the temporary files of results that were not uploaded because the pipeline was stopped.
+        Called once all stages and encryption processes are finished, so no file is written anymore.
+        """
+        while not queue_upload.empty():
+            item = queue_upload.get_nowait()
+            if item is not self.__sentinel:
+                self.__discarded.append(item[2])
+        for path in self.__discarded:
+            SftpFileManager.remove_tmp_file(path)
+
+
+class Manager:
+    """
+    A manager class that coordinates the uploading of tagged results to the SFTP servers of all export targets.
+    """
+    __priority_criteria = {'new', 'smallest', 'oldest'}
+
+    def __init__(self, path_toml: str):
+        dict_target_config = self.__verify_and_load_toml(path_toml)
+        self.__targets = [ExportTarget(name, config) for name, config in dict_target_config.items()]
+        self.__broker = None
+        self.__pipeline = None
+        self.__priority = [criterion.strip() for criterion in os.environ.get('PIPELINE.PRIORITY', '').split(',') if criterion.strip()]
+        if not set(self.__priority) <= self.__priority_criteria:
+            raise SystemExit(f'unknown priority criteria {set(self.__priority) - self.__priority_criteria}')
+        self.__freeze_completed = os.environ.get('REQUESTS.FREEZE_COMPLETED', 'false').lower() == 'true'
+        self.__freeze_age = float(os.environ.get('REQUESTS.FREEZE_AGE', 0))
+        self.__full_sweep_interval = float(os.environ.get('REQUESTS.FULL_SWEEP_INTERVAL', 24))
+        self.__path_full_sweep = os.path.join(os.environ['MISC.WORKING_DIR'], 'full_sweep.json')
+
+    def __connect_to_broker(self):
+        """
+        Connect to the AKTIN Broker on first use, as a resync from the cache does not need the broker.
+        """
+        if self.__broker is None:
+            self.__broker = BrokerRequestResultManager()
+            self.__pipeline = ResultUploadPipeline(self.__broker, self.__targets)
+
+    def close(self):
+        """
+        Close the connections to the AKTIN Broker and the SFTP servers and release the status stores.
+        """
+        if self.__broker is not None:
+            self.__broker.close()
+        for target in self.__targets:
+            target.close()
+
+    def __flatten_dict(self, d, parent_key='', sep='.'):
+        items = []
+        for k, v in d.items():
+            new_key = f'{parent_key}{sep}{k}' if parent_key else k
+            if isinstance(v, dict):
+                items.extend(self.__flatten_dict(v, new_key, sep=sep).items())
+            else:
+                items.append((new_key, v))
+        return dict(items)
+
+    def __verify_and_load_toml(self, path_toml: str) -> dict:
+        """
+        This method verifies the TOML file path, loads the configuration, flattens it into a dictionary,
+        and sets the environment variables based on the loaded configuration.
+        Returns the configuration of each export target. Without a TARGETS scope, the environment variables
+        configure the only target. Otherwise, each target inherits all keys not set in its own scope.
+        """
+        required_keys_target = {'REQUESTS.TAG', 'SFTP.HOST', 'SFTP.USERNAME', 'SFTP.PASSWORD', 'SFTP.TIMEOUT',
+                                'SFTP.FOLDERNAME', 'SECURITY.PATH_ENCRYPTION_KEY'}
+        optional_keys_target = {'SFTP.PORT', 'SFTP.POOL_SIZE', 'SFTP.KEEPALIVE', 'SFTP.RETRIES', 'SFTP.RETRY_BACKOFF',
+                                'SFTP.VERIFY', 'SFTP.BANDWIDTH_LIMIT', 'SECURITY.ENCRYPTION_MODE', 'MISC.STATUS_BACKEND', 'MISC.STATUS_FLUSH_COUNT',
+                                'MISC.STATUS_FLUSH_INTERVAL', 'MISC.STATUS_VARIANT', 'MISC.STATUS_CHANGELOG', 'MISC.BUNDLE_CACHE_SIZE'}
+        required_keys = {'BROKER.URL', 'BROKER.API_KEY', 'MISC.WORKING_DIR'}
+        optional_keys = {'REQUESTS_CA_BUNDLE', 'REQUESTS.FREEZE_COMPLETED', 'REQUESTS.FREEZE_AGE', 'REQUESTS.FULL_SWEEP_INTERVAL',
+                         'BROKER.MAX_WORKERS', 'BROKER.RETRIES', 'BROKER.RETRY_BACKOFF', 'BROKER.EXPORT_TTL',
+                         'PIPELINE.QUEUE_SIZE', 'PIPELINE.EXPORT_WORKERS', 'PIPELINE.DOWNLOAD_WORKERS', 'PIPELINE.ENCRYPT_PROCESSES',
+                         'PIPELINE.PRIORITY', 'PIPELINE.PUBLISH_BATCH',
+                         'MISC.CHUNK_SIZE', 'MISC.METRICS_TEXTFILE', 'MISC.METRICS_SUMMARY',
+                         'DAEMON.INTERVAL', 'DAEMON.JITTER', 'DAEMON.RETRY_DELAY', 'DAEMON.MAX_FAILURES'}
+        optional_keys |= required_keys_target | optional_keys_target
+        if not os.path.isfile(path_toml):
+            raise SystemExit('invalid TOML file path')
+        with open(path_toml, encoding='utf-8') as file:
+            dict_config = toml.load(file)
+        flattened_config = self.__flatten_dict(dict_config)
+        dict_target_overrides = self.__split_target_configs(flattened_config, required_keys_target | optional_keys_target)
+        if not dict_target_overrides:
+            required_keys |= required_keys_target
+        loaded_keys = set(flattened_config.keys())
+        missing_keys = required_keys - loaded_keys
+        if missing_keys:
+            raise SystemExit(f'following keys are missing in config file: {missing_keys}')
+        for key in required_keys | optional_keys:
+            if key in flattened_config:
+                value = flattened_config[key]
+                os.environ[key] = str(value)
+        if not dict_target_overrides:
+            return {'default': os.environ}
+        dict_target_config = {}
+        for name, overrides in dict_target_overrides.items():
+            working_dir = {'MISC.WORKING_DIR': os.path.join(os.environ['MISC.WORKING_DIR'], name)}
+            config = ChainMap(overrides, working_dir, os.environ)
+            missing_keys = {key for key in required_keys_target if key not in config}
+            if missing_keys:
+                raise SystemExit(f'following keys are missing for target {name} in config file: {missing_keys}')
+            dict_target_config[name] = config
+        return dict_target_config
+
+    @staticmethod
+    def __split_target_configs(flattened_config: dict, target_keys: set) -> dict:
+        """
+        Collect the keys in the scopes `TARGETS.<name>` of the flattened configuration by target name.
+        """
+        dict_target_overrides = {}
+        for key, value in flattened_config.items():
+            if not key.startswith('TARGETS.'):
+                continue
+            parts = key.split('.', 2)
+            if len(parts) != 3 or len(parts[2].split('.')) != 2:
+                raise SystemExit(f'invalid key {key} in config file, expected TARGETS.<name>.<scope>.<key>')
+            _, name, key_target = parts
+            if key_target not in target_keys:
+                raise SystemExit(f'unknown key {key_target} for target {name} in config file')
+            dict_target_overrides.setdefault(name, {})[key_target] = str(value)
+        return dict_target_overrides
+
+    def upload_tagged_results_to_sftp(self):
+        """
+        Upload tagged results to the SFTP servers of all export targets.
+
+        This method performs the following actions:
+        - Retrieves the completion status of the requests tagged with the tag of any target from the broker.
+        - Compares the completion status between the broker and the status store of each target.
+        - Stops if neither the broker responses nor the completion status changed since the last successful run.
+        - Deletes results from the SFTP servers for requests that have been deleted from the broker or lost the tag of the target.
+        - Uploads new and updated results to the SFTP servers. Export, download and encryption, and upload run as concurrent stages.
+          Each result is downloaded once for all targets.
+        - Skips the upload of updated results whose content did not change since their last upload to the target.
+        - Updates the completion status in the status store of the target once the upload of a result is committed.
+        - Uploads the status XML file exported by the status store of each target to its SFTP server, unless it is unchanged since its
+          last upload, together with its compressed variant and change log if configured.
+
+        Failed broker and SFTP operations are retried with exponential backoff. A request that still fails is skipped,
+        so the other requests are still transferred, and an exception listing all failed requests is raised at the end of the run.
+        If the connection to the broker or a status store fails as a whole, the process is discontinued at once.
+        Every modification of the status stores is persisted to ensure the most up-to-date state in case of failure.
+        The status XML files themselves are rewritten in batches and at the end of the run.
+        Timings and counters of the run are reported at its end, even if it failed.
+        """
+        metrics.reset()
+        success = False
+        try:
+            with metrics.span('run'):
+                self.__upload_tagged_results_to_sftp()
+            success = True
+        finally:
+            self.__report_metrics(success)
+
+    @staticmethod
+    def __report_metrics(success: bool):
+        """
+        Log the summary of the run as JSON. If configured, write the summary to `MISC.METRICS_SUMMARY` and the metrics
+        in the Prometheus text format to `MISC.METRICS_TEXTFILE`, e.g. for the textfile collector of the node exporter.
+        Both files are replaced atomically.
+        """
+        summary = json.dumps(metrics.summary(success))
+        logging.info('Run summary: %s', summary)
+        for key, content in (('MISC.METRICS_SUMMARY', summary), ('MISC.METRICS_TEXTFILE', metrics.to_prometheus_text(success))):
+            path = os.environ.get(key)
+            if not path:
+                continue
+            try:
+                with open(f'{path}.tmp', 'w', encoding='utf-8') as file:
+                    file.write(content)
+                os.replace(f'{path}.tmp', path)
+            except OSError as err:
+                logging.warning('Writing metrics to %s failed: %s', path, err)
+
+    def __upload_tagged_results_to_sftp(self):
+        self.__connect_to_broker()
+        dict_frozen = self.__collect_frozen_requests()
+        dict_tags = self.__broker.get_tagged_requests_completion_by_tag({target.tag for target in self.__targets}, dict_frozen)
+        dict_changes = {}
+        for target in self.__targets:
+            dict_status = target.status.get_request_completion_as_dict()
+            dict_changes[target] = target.status.compare_request_completion_between_broker_and_sftp(dict_tags[target.tag], dict_status)
+        if not (any(any(sets) for sets in dict_changes.values()) or self.__broker.has_changed_since_last_sync()):
+            logging.info('Nothing changed on AKTIN Broker since last run')
+            self.__note_full_sweep(dict_frozen)
+            return
+
+        try:
+            failures = self.__delete_request_results(dict_changes)
+            for target, id_request, digest, size, uploaded in self.__pipeline.run(self.__create_upload_jobs(dict_changes)):
+                completion = dict_tags[target.tag].get(id_request)
+                if uploaded:
+                    target.status.update_or_add_element(id_request, completion, digest, size)
+                    metrics.increment('requests_uploaded')
+                else:
+                    target.status.update_completion_of_element(id_request, completion)
+                    metrics.increment('requests_unchanged')
+            failures.extend(self.__pipeline.failures)
+        finally:
+            for target in self.__targets:
+                target.status.flush()
+        for target in self.__targets:
+            target.manifest.publish()
+        self.__broker.save_cache()
+        self.__note_full_sweep(dict_frozen)
+        if failures:
+            raise RuntimeError(f'transfer of {len(failures)} requests failed: {[f"{target.name}/{id_request}" for target, id_request in failures]}')
+
+    def plan_tagged_results(self) -> dict:
+        """
+        Compute the changes of the next run without transferring anything: the requests to upload as new or updated and to delete
+        for each target, with an estimate of the bytes to upload and the time needed. Only the broker is contacted, and neither
+        the broker cache nor the status stores are modified.
+        Updated results are estimated by their size in the status store and new results by the average size of all known results
+        of the target. As updated results whose content did not change are skipped, the estimate is an upper bound. The time is
+        estimated by the upload throughput of the last run, if its summary is written to `MISC.METRICS_SUMMARY`.
+        """
+        self.__connect_to_broker()
+        dict_frozen = self.__collect_frozen_requests()
+        dict_tags = self.__broker.get_tagged_requests_completion_by_tag({target.tag for target in self.__targets}, dict_frozen)
+        dict_plan = {}
+        for target in self.__targets:
+            dict_status = target.status.get_request_completion_as_dict()
+            set_new, set_update, set_delete = target.status.compare_request_completion_between_broker_and_sftp(dict_tags[target.tag], dict_status)
+            dict_size = self.__estimate_result_sizes(target, set_new | set_update)
+            num_bytes = sum(target.sftp.calculate_encrypted_size(size) for size in dict_size.values())
+            dict_plan[target.name] = {'new': sorted(set_new), 'update': sorted(set_update), 'delete': sorted(set_delete),
+                                      'estimated_bytes': num_bytes}
+        num_bytes = sum(plan['estimated_bytes'] for plan in dict_plan.values())
+        throughput = self.__read_last_upload_throughput()
+        return {'targets': dict_plan, 'estimated_bytes': num_bytes, 'estimated_seconds': round(num_bytes / throughput, 1) if throughput else None}
+
+    @staticmethod
+    def __read_last_upload_throughput() -> float:
+        """
+        Read the uploaded bytes per second of the last run from its summary. Returns 0 if unknown.
+        """
+        path = os.environ.get('MISC.METRICS_SUMMARY')
+        if not path or not os.path.isfile(path):
+            return 0.0
+        try:
+            with open(path, encoding='utf-8') as file:
+                summary = json.load(file)
+        except (OSError, json.JSONDecodeError):
+            return 0.0
+        duration = summary.get('duration_seconds', 0.0)
+        return summary.get('counters', {}).get('bytes_uploaded', 0) / duration if duration else 0.0
+
+    def __collect_frozen_requests(self) -> dict:
+        """
+        Collect the requests that can no longer change and are therefore not polled on the broker, with their completion for each tag.
+        With `REQUESTS.FREEZE_COMPLETED`, requests completed by all nodes are frozen. With `REQUESTS.FREEZE_AGE`, requests first uploaded
+        more than the given number of days ago are frozen. Nothing is frozen if a full sweep is due every `REQUESTS.FULL_SWEEP_INTERVAL` hours.
+        A request shared by several targets with the same tag is only frozen if it is frozen in all of them.
+        """
+        if not (self.__freeze_completed or self.__freeze_age > 0) or self.__is_full_sweep_due():
+            return {}
+        time_frozen = datetime.utcnow() - timedelta(days=self.__freeze_age)
+        dict_frozen = {}
+        for target in self.__targets:
+            dict_completion = target.status.get_request_completion_as_dict()
+            dict_upload_time = target.status.get_request_upload_time_as_dict()
+            dict_frozen_target = {id_request: completion for id_request, completion in dict_completion.items()
+                                  if not target.status.is_request_tagged_as_deleted(id_request)
+                                  and (self.__freeze_completed and float(completion) >= 1.0
+                                       or self.__freeze_age > 0 and dict_upload_time[id_request] < time_frozen)}
+            if target.tag in dict_frozen:
+                dict_frozen_target = dict(dict_frozen[target.tag].items() & dict_frozen_target.items())
+            dict_frozen[target.tag] = dict_frozen_target
+        return dict_frozen
+
+    def __is_full_sweep_due(self) -> bool:
+        if not os.path.isfile(self.__path_full_sweep):
+            return True
+        try:
+            with open(self.__path_full_sweep, encoding='utf-8') as file:
+                time_full_sweep = json.load(file)['time']
+        except (OSError, json.JSONDecodeError, KeyError):
+            return True
+        return time.time() - time_full_sweep >= self.__full_sweep_interval * 3600
+
+    def __note_full_sweep(self, dict_frozen: dict):
+        """
+        Note the time of a successful run that polled all requests, if requests are frozen at all.
+        """
+        if dict_frozen or not (self.__freeze_completed or self.__freeze_age > 0):
+            return
+        path_tmp = f'{self.__path_full_sweep}.tmp'
+        with open(path_tmp, 'w', encoding='utf-8') as file:
+            json.dump({'time': time.time()}, file)
+        os.replace(path_tmp, self.__path_full_sweep)
+
+    def __delete_request_results(self, dict_changes: dict) -> list:
+        """
+        Delete the results of all targets concurrently, using one worker per channel of the SFTP connection pools.
+        Returns the failed deletions as tuples (target, id).
+        """
+        failures = []
+        with ThreadPoolExecutor(max_workers=sum(target.sftp.pool_size for target in self.__targets)) as executor:
+            futures = {executor.submit(target.sftp.delete_request_result, id_request): (target, id_request)
+                       for target, (_, _, set_delete) in dict_changes.items() for id_request in set_delete}
+            for future in as_completed(futures):
+                target, id_request = futures[future]
+                try:
+                    future.result()
+                except Exception as err:
+                    logging.error('Deletion of %s from %s failed: %s', id_request, target.name, err)
+                    metrics.increment('requests_failed')
+                    failures.append((target, id_request))
+                    continue
+                target.status.add_delete_tag_to_element(id_request)
+                target.cache.remove(id_request)
+                metrics.increment('requests_deleted')
+        return failures
+
+    def resync_from_cache(self):
+        """
+        Upload the cached encrypted results of all requests listed in the status store of each target, followed by
+        the status XML file, e.g. to refill an emptied SFTP folder. Neither the broker nor the status stores are used
+        beyond reading, so no request is exported, downloaded or encrypted again.
+        Requests whose cached result is missing or damaged are skipped, as are requests uploaded before content digests were recorded,
+        whose cached result cannot be verified. An exception listing them is raised at the end.
+        """
+        failures = []
+        for target in self.__targets:
+            dict_digest = target.status.get_request_digest_as_dict()
+            dict_paths = {}
+            for id_request in target.status.get_request_completion_as_dict():
+                if target.status.is_request_tagged_as_deleted(id_request):
+                    continue
+                if id_request not in dict_digest:
+                    logging.error('Result of %s for %s has no recorded digest and cannot be taken from the cache', id_request, target.name)
+                    failures.append((target, id_request))
+                    continue
+                path_file = target.cache.get(id_request, dict_digest[id_request])
+                if path_file is None:
+                    logging.error('Result of %s for %s is not cached', id_request, target.name)
+                    failures.append((target, id_request))
+                    continue
+                dict_paths[id_request] = path_file
+            failures.extend(self.__stage_cached_results(target, dict_paths))
+            target.manifest.publish(force=True)
+        if failures:
+            raise RuntimeError(f'resync of {len(failures)} requests failed: {[f"{target.name}/{id_request}" for target, id_request in failures]}')
+
+    def reconcile_sftp_folders(self):
+        """
+        Bring the folder on the SFTP server of each target in line with its status store, e.g. after files were removed or
+        modified on the server. The folder is listed once and compared with the status store by filename and size:
+        - Results that are missing or whose size does not match their encryption are uploaded again, from the cache if possible
+          and otherwise from the broker. Their completion in the status store is kept.
+        - Results of requests that are not in the status store or are tagged as deleted are deleted in one batch,
+          as are temporary files of aborted uploads that were not modified for an hour.
+        - The status XML file is uploaded if it is missing or its size differs.
+        An exception listing all requests that could not be reconciled is raised at the end.
+        """
+        failures = []
+        dict_jobs = {}
+        set_status_upload = set()
+        for target in self.__targets:
+            set_upload, list_delete, upload_status = self.__compare_folder_with_status(target)
+            if upload_status:
+                set_status_upload.add(target)
+            for filename, err in target.sftp.delete_files(list_delete).items():
+                logging.error('Deletion of %s from %s failed: %s', filename, target.name, err)
+                failures.append((target, filename))
+            dict_digest = target.status.get_request_digest_as_dict()
+            dict_paths = {}
+            for id_request in set_upload:
+                path_file = target.cache.get(id_request, dict_digest.get(id_request))
+                if path_file is None:
+                    dict_jobs.setdefault(id_request, []).append((target, None))
+                    set_status_upload.add(target)
+                else:
+                    dict_paths[id_request] = path_file
+            failures.extend(self.__stage_cached_results(target, dict_paths))
+        if dict_jobs:
+            self.__connect_to_broker()
+            dict_completion = {target: target.status.get_request_completion_as_dict() for target in set_status_upload}
+            try:
+                for target, id_request, digest, size, _ in self.__pipeline.run(list(dict_jobs.items())):
+                    target.status.update_or_add_element(id_request, dict_completion[target][id_request], digest, size)
+                failures.extend(self.__pipeline.failures)
+            finally:
+                for target in self.__targets:
+                    target.status.flush()
+        for target in set_status_upload:
+            target.manifest.publish(force=True)
+        if failures:
+            raise RuntimeError(f'reconciliation of {len(failures)} requests failed: {[f"{target.name}/{id_request}" for target, id_request in failures]}')
+
+    @staticmethod
+    def __compare_folder_with_status(target: ExportTarget) -> (set, list, bool):
+        """
+        Compare the listing of the folder on the SFTP server of a target with its status store.
+        Returns the requests whose result has to be uploaded again, the files to delete and whether the status XML file has to be uploaded.
+        """
+        dict_remote = target.sftp.list_files()
+        dict_size = target.status.get_request_size_as_dict()
+        dict_expected = {SftpFileManager.create_results_file_name(id_request): id_request
+                         for id_request in target.status.get_request_completion_as_dict()
+                         if not target.status.is_request_tagged_as_deleted(id_request)}
+        set_upload = set()
+        for filename, id_request in dict_expected.items():
+            attr = dict_remote.get(filename)
+            if attr is None:
+                logging.info('%s is missing on %s', filename, target.name)
+                set_upload.add(id_request)
+            elif id_request in dict_size and attr.st_size != target.sftp.calculate_encrypted_size(dict_size[id_request]):
+                logging.info('%s on %s has an unexpected size', filename, target.name)
+                set_upload.add(id_request)
+        time_stale = time.time() - 3600
+        list_delete = [filename for filename, attr in dict_remote.items()
+                       if filename not in dict_expected and SftpFileManager.is_results_file_name(filename)
+                       or SftpFileManager.is_tmp_file_name(filename) and attr.st_mtime is not None and attr.st_mtime < time_stale]
+        attr_status = dict_remote.get(os.path.basename(target.status.path_status_xml))
+        upload_status = attr_status is None or attr_status.st_size != os.path.getsize(target.status.path_status_xml)
+        logging.info('%d results to upload again and %d files to delete on %s', len(set_upload), len(list_delete), target.name)
+        return set_upload, list_delete, upload_status
+
+    @staticmethod
+    def __stage_cached_results(target: ExportTarget, dict_paths: dict) -> list:
+        """
+        Stage the cached results of a target concurrently on all channels and publish them in one batch.
+        Returns the failed requests as tuples (target, id).
+        """
+        failures, dict_staged = [], {}
+        with ThreadPoolExecutor(max_workers=target.sftp.pool_size) as executor:
+            futures = {executor.submit(target.sftp.stage_file, path_file): id_request for id_request, path_file in dict_paths.items()}
+            for future in as_completed(futures):
+                id_request = futures[future]
+                try:
+                    future.result()
+                except Exception as err:
+                    logging.error('Resync of %s to %s failed: %s', id_request, target.name, err)
+                    failures.append((target, id_request))
+                    continue
+                dict_staged[os.path.basename(dict_paths[id_request])] = id_request
+        for filename, err in target.sftp.publish_files(list(dict_staged)).items():
+            logging.error('Resync of %s to %s failed: %s', dict_staged[filename], target.name, err)
+            failures.append((target, dict_staged[filename]))
+        return failures
+
+    def __create_upload_jobs(self, dict_changes: dict) -> list:
+        """
+        Group the results to upload by request, so that each result is downloaded only once for all targets.
+        The jobs are ordered by the criteria of `PIPELINE.PRIORITY`, each one breaking the ties of the previous one:
+        `new` puts requests that are new to any target first, `smallest` puts small results first by their estimated size
+        and `oldest` puts requests with lower IDs first, as the broker assigns the IDs in ascending order.
+        """
+        dict_jobs = {}
+        set_new_any = set()
+        dict_size = {}
+        for target, (set_new, set_update, _) in dict_changes.items():
+            dict_digest = target.status.get_request_digest_as_dict()
+            set_new_any |= set_new
+            for id_request, size in self.__estimate_result_sizes(target, set_new | set_update).items():
+                dict_jobs.setdefault(id_request, []).append((target, dict_digest.get(id_request)))
+                dict_size[id_request] = max(dict_size.get(id_request, 0), size)
+        dict_keys = {'new': lambda id_request: id_request not in set_new_any,
+                     'smallest': lambda id_request: dict_size[id_request],
+                     'oldest': lambda id_request: (len(id_request), id_request)}
+        return sorted(dict_jobs.items(), key=lambda job: tuple(dict_keys[criterion](job[0]) for criterion in self.__priority))
+
+    @staticmethod
+    def __estimate_result_sizes(target: ExportTarget, set_requests: set) -> dict:
+        """
+        Estimate the unencrypted size of the results of the given requests by their size in the status store of the target.
+        Results of unknown size are estimated by the average size of all known results of the target.
+        """
+        dict_size = target.status.get_request_size_as_dict()
+        size_default = sum(dict_size.values()) // len(dict_size) if dict_size else 0
+        return {id_request: dict_size.get(id_request, size_default) for id_request in set_requests}
+
+
+class Daemon:
+    """
+    A class for running the upload of tagged results repeatedly in one long-running process.
+    The manager, and with it the broker session, the SFTP connection and the status store, is kept between cycles.
+    Cycles are started every `DAEMON.INTERVAL` seconds, shifted by a random jitter of up to `DAEMON.JITTER` seconds.
+    A failed cycle is retried after `DAEMON.RETRY_DELAY` seconds. After `DAEMON.MAX_FAILURES` consecutive failures,
+    all connections are recreated. SIGTERM and SIGINT stop the daemon once the current cycle is finished.
+    """
+
+    def __init__(self, path_toml: str):
+        self.__path_toml = path_toml
+        self.__manager = Manager(path_toml)
+        self.__interval = float(os.environ.get('DAEMON.INTERVAL', 300))
+        self.__jitter = float(os.environ.get('DAEMON.JITTER', 30))
+        self.__retry_delay = float(os.environ.get('DAEMON.RETRY_DELAY', 60))
+        self.__max_failures = int(os.environ.get('DAEMON.MAX_FAILURES', 3))
+        self.__stop = threading.Event()
+
+    def stop(self, *_):
+        logging.info('Stopping daemon after current cycle')
+        self.__stop.set()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        num_failures = 0
+        try:
+            while not self.__stop.is_set():
+                try:
+                    if self.__manager is None:
+                        self.__manager = Manager(self.__path_toml)
+                    self.__manager.upload_tagged_results_to_sftp()
+                    num_failures = 0
+                    delay = self.__interval + random.uniform(-self.__jitter, self.__jitter)
+                except (Exception, SystemExit) as err:
+                    logging.exception(err)
+                    num_failures += 1
+                    if num_failures >= self.__max_failures:
+                        logging.warning('%d consecutive cycles failed, recreating all connections', num_failures)
+                        self.__close_manager()
+                    delay = self.__retry_delay
+                self.__stop.wait(max(delay, 0))
+        finally:
+            self.__close_manager()
+
+    def __close_manager(self):
+        if self.__manager is not None:
+            try:
+                self.__manager.close()
+            except Exception as err:
+                logging.warning('Closing connections failed: %s', err)
+            self.__manager = None
+
+
+def main(path_toml: str, daemon: bool = False, resync: bool = False, reconcile: bool = False, plan: bool = False):
+    try:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s', handlers=[logging.StreamHandler()])
+        if daemon:
+            Daemon(path_toml).run()
+        elif resync:
+            manager = Manager(path_toml)
+            manager.resync_from_cache()
+        elif reconcile:
+            manager = Manager(path_toml)
+            manager.reconcile_sftp_folders()
+        elif plan:
+            manager = Manager(path_toml)
+            print(json.dumps(manager.plan_tagged_results(), indent=2))
+        else:
+            manager = Manager(path_toml)
+            manager.upload_tagged_results_to_sftp()
     except Exception as e:
         logging.exception(e)
     finally:
@@ -405,6 +2704,12 @@ def main(path_toml: str):
 
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        raise SystemExit('path to config TOML is missing!')
-    main(sys.argv[1])
+    parser = argparse.ArgumentParser(description='Upload results of tagged AKTIN Broker requests to an SFTP server')
+    parser.add_argument('path_toml', help='path to config TOML')
+    group_mode = parser.add_mutually_exclusive_group()
+    group_mode.add_argument('--daemon', action='store_true', help='keep running and upload in regular intervals')
+    group_mode.add_argument('--resync', action='store_true', help='upload all results again from the local cache without the broker')
+    group_mode.add_argument('--reconcile', action='store_true', help='upload missing results and delete orphaned files on the SFTP server')
+    group_mode.add_argument('--plan', action='store_true', help='print the changes of the next run and their estimated size without transferring anything')
+    args = parser.parse_args()
+    main(args.path_toml, args.daemon, args.resync, args.reconcile, args.plan)
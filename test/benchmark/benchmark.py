@@ -0,0 +1,491 @@
+"""
+Benchmark of a full run of `Manager.upload_tagged_results_to_sftp` against an in-process fake AKTIN Broker
+and an in-process paramiko SFTP server. Prints the results as JSON, so that runs of different versions can be compared.
+
+    python3 benchmark.py --requests 200 --bundle-size 1048576 --broker-latency 0.01 --sftp-latency 0.005 --output result.json
+"""
+import argparse
+import collections
+import functools
+import hashlib
+import json
+import logging
+import os
+import platform
+import re
+import resource
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import paramiko
+import toml
+from cryptography.fernet import Fernet
+
+this_path = Path(os.path.realpath(__file__))
+path_src = os.path.join(this_path.parent.parent.parent, 'src')
+sys.path.insert(0, path_src)
+
+import sftp_export
+
+
+class FakeBroker:
+    """
+    An in-process stand-in for the AKTIN Broker. All requests carry the benchmarked tag and are completed by every node,
+    unless they are marked as incomplete. Each response is delayed by the given latency in seconds.
+    The request list and status carry an ETag and are answered with 304 Not Modified if it matches. Exports can be downloaded
+    until they are expired. The calls are counted by kind in `counts`, and the exported requests are listed in `exported` in order.
+    For testing the handling of faults, downloads are answered with `download_status` if set, and the next `interrupted_downloads`
+    downloads break off after half of the body.
+    """
+
+    def __init__(self, num_requests: int, bundle_size: int, latency: float, tag: str):
+        self.__ids_request = [str(i) for i in range(num_requests)]
+        self.__bundle = os.urandom(bundle_size)
+        self.__latency = latency
+        self.__tag = tag
+        self.__exports = {}
+        self.__incomplete = set()
+        self.__lock = threading.Lock()
+        self.counts = collections.Counter()
+        self.exported = []
+        self.download_status = None
+        self.interrupted_downloads = 0
+        self.__server = ThreadingHTTPServer(('127.0.0.1', 0), self.__create_handler())
+        self.__server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.__server.server_port}'
+
+    def start(self):
+        threading.Thread(target=self.__server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    def add_request(self, id_request: str):
+        self.__ids_request.append(id_request)
+
+    def set_completed(self, id_request: str, completed: bool):
+        if completed:
+            self.__incomplete.discard(id_request)
+        else:
+            self.__incomplete.add(id_request)
+
+    def expire_exports(self):
+        with self.__lock:
+            self.__exports.clear()
+
+    def __count(self, kind: str):
+        with self.__lock:
+            self.counts[kind] += 1
+
+    def __respond_conditional(self, handler: BaseHTTPRequestHandler, body: bytes):
+        etag = f'"{hashlib.sha256(body).hexdigest()}"'
+        if handler.headers.get('If-None-Match') == etag:
+            self.__count('not_modified')
+            return self.respond(handler, 304, b'', {'ETag': etag})
+        self.respond(handler, 200, body, {'ETag': etag})
+
+    def __create_handler(self):
+        broker = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *_):
+                pass
+
+            def do_HEAD(self):
+                broker.respond(self, 200, b'')
+
+            def do_GET(self):
+                broker.handle_get(self)
+
+            def do_POST(self):
+                broker.handle_post(self)
+
+        return Handler
+
+    def respond(self, handler: BaseHTTPRequestHandler, status: int, body: bytes, headers: dict = None):
+        time.sleep(self.__latency)
+        handler.send_response(status)
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        if handler.command != 'HEAD':
+            handler.wfile.write(body)
+
+    def handle_get(self, handler: BaseHTTPRequestHandler):
+        if handler.path.startswith('/broker/request/filtered'):
+            self.__count('list')
+            if f"//tag='{self.__tag}'" not in urllib.parse.unquote_plus(handler.path):
+                return self.__respond_conditional(handler, b'<requests/>')
+            body = ''.join(f'<request id="{id_request}"/>' for id_request in self.__ids_request)
+            return self.__respond_conditional(handler, f'<requests>{body}</requests>'.encode())
+        match = re.fullmatch('/broker/request/(\\w+)/status', handler.path)
+        if match:
+            self.__count('status')
+            completed = '' if match.group(1) in self.__incomplete else '<completed/>'
+            body = completed.join(['<request-status-list xmlns="http://aktin.org/ns/exchange"><node>', '</node></request-status-list>'])
+            return self.__respond_conditional(handler, body.encode())
+        match = re.fullmatch('/broker/download/([\\w-]+)', handler.path)
+        if match:
+            self.__count('download')
+            with self.__lock:
+                id_request = self.__exports.get(match.group(1))
+                interrupted = id_request is not None and self.download_status is None and self.interrupted_downloads > 0
+                self.interrupted_downloads -= interrupted
+            if self.download_status is not None:
+                return self.respond(handler, self.download_status, b'')
+            if id_request is not None:
+                headers = {'Content-Disposition': f'attachment; filename="export_{id_request}.zip"', 'Content-Type': 'application/zip'}
+                if interrupted:
+                    return self.__respond_interrupted(handler, headers)
+                return self.respond(handler, 200, self.__bundle, headers)
+        self.respond(handler, 404, b'')
+
+    def __respond_interrupted(self, handler: BaseHTTPRequestHandler, headers: dict):
+        handler.send_response(200)
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.send_header('Content-Length', str(len(self.__bundle)))
+        handler.end_headers()
+        handler.wfile.write(self.__bundle[:len(self.__bundle) // 2])
+        handler.close_connection = True
+
+    def handle_post(self, handler: BaseHTTPRequestHandler):
+        match = re.fullmatch('/broker/export/request-bundle/(\\w+)', handler.path)
+        if not match:
+            return self.respond(handler, 404, b'')
+        self.__count('export')
+        id_export = str(uuid.uuid4())
+        with self.__lock:
+            self.__exports[id_export] = match.group(1)
+            self.exported.append(match.group(1))
+        self.respond(handler, 200, id_export.encode(), {'Content-Type': 'text/plain'})
+
+
+class AnyPasswordServer(paramiko.ServerInterface):
+    """
+    An SSH server interface that accepts any username and password.
+    """
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+
+class FakeSftpServer:
+    """
+    An in-process SFTP server backed by a local folder.
+    Opening, renaming and removing a file are delayed by the given latency in seconds.
+    Without `posix_rename`, the posix-rename extension is answered as unsupported. For testing the handling of faults,
+    renaming a file whose name is in `failing_renames` fails, and the connection is dropped once an upload reaches `drop_upload_at` bytes.
+    """
+
+    def __init__(self, path_root: str, latency: float, posix_rename: bool = True):
+        self.__path_root = path_root
+        self.__latency = latency
+        self.__posix_rename = posix_rename
+        self.failing_renames = set()
+        self.drop_upload_at = None
+        self.__host_key = paramiko.RSAKey.generate(2048)
+        self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.__socket.bind(('127.0.0.1', 0))
+        self.__transports = []
+
+    @property
+    def port(self) -> int:
+        return self.__socket.getsockname()[1]
+
+    def start(self):
+        self.__socket.listen(16)
+        threading.Thread(target=self.__accept, daemon=True).start()
+
+    def stop(self):
+        self.__socket.close()
+        self.drop_connections()
+
+    def drop_connections(self):
+        for transport in self.__transports:
+            transport.close()
+
+    def __accept(self):
+        while True:
+            try:
+                connection, _ = self.__socket.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(connection)
+            transport.add_server_key(self.__host_key)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer, self.__create_interface())
+            transport.start_server(server=AnyPasswordServer())
+            self.__transports.append(transport)
+
+    def __create_interface(self):
+        server = self
+        path_root = self.__path_root
+        latency = self.__latency
+        supports_posix_rename = self.__posix_rename
+
+        class Handle(paramiko.SFTPHandle):
+            dropped = False
+
+            def write(self, offset, data):
+                if not self.dropped and server.drop_upload_at is not None and offset + len(data) > server.drop_upload_at:
+                    server.drop_upload_at = None
+                    self.dropped = True
+                    server.drop_connections()
+                if self.dropped:
+                    return paramiko.SFTP_FAILURE
+                return super().write(offset, data)
+
+            def stat(self):
+                return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+        class Interface(paramiko.SFTPServerInterface):
+
+            @staticmethod
+            def __to_local_path(path: str) -> str:
+                return os.path.join(path_root, path.lstrip('/'))
+
+            def open(self, path, flags, attr):
+                time.sleep(latency)
+                try:
+                    fd = os.open(self.__to_local_path(path), flags, 0o644)
+                except OSError as err:
+                    return paramiko.SFTPServer.convert_errno(err.errno)
+                handle = Handle(flags)
+                handle.readfile = handle.writefile = os.fdopen(fd, 'r+b' if flags & os.O_RDWR else 'wb' if flags & os.O_WRONLY else 'rb')
+                return handle
+
+            def stat(self, path):
+                try:
+                    return paramiko.SFTPAttributes.from_stat(os.stat(self.__to_local_path(path)))
+                except OSError as err:
+                    return paramiko.SFTPServer.convert_errno(err.errno)
+
+            lstat = stat
+
+            def list_folder(self, path):
+                try:
+                    list_attr = []
+                    for filename in os.listdir(self.__to_local_path(path)):
+                        attr = paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(self.__to_local_path(path), filename)))
+                        attr.filename = filename
+                        list_attr.append(attr)
+                    return list_attr
+                except OSError as err:
+                    return paramiko.SFTPServer.convert_errno(err.errno)
+
+            def remove(self, path):
+                time.sleep(latency)
+                try:
+                    os.remove(self.__to_local_path(path))
+                except OSError as err:
+                    return paramiko.SFTPServer.convert_errno(err.errno)
+                return paramiko.SFTP_OK
+
+            def rename(self, oldpath, newpath):
+                time.sleep(latency)
+                if os.path.exists(self.__to_local_path(newpath)) or os.path.basename(oldpath) in server.failing_renames:
+                    return paramiko.SFTP_FAILURE
+                try:
+                    os.rename(self.__to_local_path(oldpath), self.__to_local_path(newpath))
+                except OSError as err:
+                    return paramiko.SFTPServer.convert_errno(err.errno)
+                return paramiko.SFTP_OK
+
+            def posix_rename(self, oldpath, newpath):
+                time.sleep(latency)
+                if not supports_posix_rename:
+                    return paramiko.SFTP_OP_UNSUPPORTED
+                if os.path.basename(oldpath) in server.failing_renames:
+                    return paramiko.SFTP_FAILURE
+                try:
+                    os.replace(self.__to_local_path(oldpath), self.__to_local_path(newpath))
+                except OSError as err:
+                    return paramiko.SFTPServer.convert_errno(err.errno)
+                return paramiko.SFTP_OK
+
+            def chattr(self, path, attr):
+                return paramiko.SFTP_OK
+
+        return Interface
+
+
+class StageTimer:
+    """
+    Collects the latencies of the stages of a run by wrapping the methods that implement them.
+    """
+
+    def __init__(self):
+        self.__latencies = {}
+        self.__lock = threading.Lock()
+        self.__patches = []
+
+    def wrap(self, owner: type, name_method: str, name_stage: str):
+        method = getattr(owner, name_method)
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.record(name_stage, time.perf_counter() - start)
+
+        self.patch(owner, name_method, timed)
+
+    def patch(self, owner: type, name_method: str, replacement):
+        self.__patches.append((owner, name_method, getattr(owner, name_method)))
+        setattr(owner, name_method, replacement)
+
+    def record(self, name_stage: str, seconds: float):
+        with self.__lock:
+            self.__latencies.setdefault(name_stage, []).append(seconds)
+
+    def restore(self):
+        for owner, name_method, method in reversed(self.__patches):
+            setattr(owner, name_method, method)
+        self.__patches = []
+
+    def summarize(self) -> dict:
+        return {name_stage: self.__summarize_latencies(latencies) for name_stage, latencies in self.__latencies.items()}
+
+    @staticmethod
+    def __summarize_latencies(latencies: list) -> dict:
+        latencies = sorted(latencies)
+        return {'count': len(latencies),
+                'total_s': round(sum(latencies), 6),
+                'mean_s': round(statistics.mean(latencies), 6),
+                'p50_s': round(latencies[len(latencies) // 2], 6),
+                'p95_s': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 6),
+                'max_s': round(latencies[-1], 6)}
+
+
+def wrap_stages(timer: StageTimer):
+    """
+    Time polling the broker, exporting, downloading and encrypting a result, uploading and publishing files and flushing the status store.
+    Downloading and encrypting are measured together from opening to closing the encrypted temporary file, as both consume one stream.
+    The metrics of the run itself report them separately and are part of the result as well.
+    """
+    timer.wrap(sftp_export.BrokerRequestResultManager, 'get_tagged_requests_completion_by_tag', 'poll')
+    timer.wrap(sftp_export.BrokerRequestResultManager, 'export_request_result', 'export')
+    timer.wrap(sftp_export.SftpFileManager, 'stage_file', 'upload')
+    timer.wrap(sftp_export.SftpFileManager, 'publish_files', 'publish')
+    timer.wrap(sftp_export.SftpFileManager, 'delete_request_result', 'delete')
+    timer.wrap(sftp_export.StatusXmlManager, 'flush', 'flush_status')
+    timer.wrap(sftp_export.StatusSqliteManager, 'flush', 'flush_status')
+    init_writer = sftp_export.EncryptedFileWriter.__init__
+    close_writer = sftp_export.EncryptedFileWriter.close
+
+    def init_timed(writer, *args, **kwargs):
+        writer.benchmark_start = time.perf_counter()
+        init_writer(writer, *args, **kwargs)
+
+    def close_timed(writer):
+        close_writer(writer)
+        timer.record('download_encrypt', time.perf_counter() - writer.benchmark_start)
+
+    timer.patch(sftp_export.EncryptedFileWriter, '__init__', init_timed)
+    timer.patch(sftp_export.EncryptedFileWriter, 'close', close_timed)
+
+
+def write_settings(path_toml: str, broker: FakeBroker, sftp: FakeSftpServer, path_key: str, working_dir: str, args: argparse.Namespace):
+    settings = {'BROKER': {'URL': broker.url, 'API_KEY': 'benchmark'},
+                'REQUESTS': {'TAG': 'benchmark'},
+                'SFTP': {'HOST': '127.0.0.1', 'PORT': sftp.port, 'USERNAME': 'benchmark', 'PASSWORD': 'benchmark',
+                         'TIMEOUT': 25, 'FOLDERNAME': 'benchmark'},
+                'SECURITY': {'PATH_ENCRYPTION_KEY': path_key, 'ENCRYPTION_MODE': args.encryption_mode},
+                'MISC': {'WORKING_DIR': working_dir, 'STATUS_BACKEND': args.status_backend}}
+    with open(path_toml, 'w', encoding='utf-8') as file:
+        toml.dump(settings, file)
+
+
+def run_benchmark(args: argparse.Namespace) -> dict:
+    dir_benchmark = tempfile.mkdtemp(prefix='sftp-export-benchmark-')
+    path_sftp_root = os.path.join(dir_benchmark, 'sftp')
+    working_dir = os.path.join(dir_benchmark, 'work')
+    os.makedirs(os.path.join(path_sftp_root, 'benchmark'))
+    os.makedirs(working_dir)
+    path_key = os.path.join(dir_benchmark, 'benchmark.key')
+    with open(path_key, 'wb') as key:
+        key.write(Fernet.generate_key())
+    broker = FakeBroker(args.requests, args.bundle_size, args.broker_latency, 'benchmark')
+    sftp = FakeSftpServer(path_sftp_root, args.sftp_latency)
+    timer = StageTimer()
+    broker.start()
+    sftp.start()
+    try:
+        path_toml = os.path.join(dir_benchmark, 'settings.toml')
+        write_settings(path_toml, broker, sftp, path_key, working_dir, args)
+        wrap_stages(timer)
+        start = time.perf_counter()
+        manager = sftp_export.Manager(path_toml)
+        try:
+            manager.upload_tagged_results_to_sftp()
+        finally:
+            manager.close()
+        duration = time.perf_counter() - start
+        run_stages = sftp_export.metrics.summary(True)['stages']
+        num_uploaded = sum(1 for filename in os.listdir(os.path.join(path_sftp_root, 'benchmark')) if filename.startswith('export_'))
+    finally:
+        timer.restore()
+        sftp.stop()
+        broker.stop()
+        shutil.rmtree(dir_benchmark, ignore_errors=True)
+    num_bytes = num_uploaded * args.bundle_size
+    return {'label': args.label,
+            'python': platform.python_version(),
+            'parameters': {'requests': args.requests, 'bundle_size': args.bundle_size, 'broker_latency': args.broker_latency,
+                           'sftp_latency': args.sftp_latency, 'encryption_mode': args.encryption_mode, 'status_backend': args.status_backend},
+            'uploaded': num_uploaded,
+            'duration_s': round(duration, 6),
+            'requests_per_s': round(num_uploaded / duration, 3),
+            'mb_per_s': round(num_bytes / duration / 1e6, 3),
+            'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024),
+            'stages': timer.summarize(),
+            'run_stages': run_stages}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark a full upload run against a local fake broker and SFTP server')
+    parser.add_argument('--requests', type=int, default=100, help='number of tagged requests on the broker')
+    parser.add_argument('--bundle-size', type=int, default=1048576, help='size of each request result in bytes')
+    parser.add_argument('--broker-latency', type=float, default=0.0, help='delay of each broker response in seconds')
+    parser.add_argument('--sftp-latency', type=float, default=0.0, help='delay of opening, renaming and removing files on the SFTP server in seconds')
+    parser.add_argument('--encryption-mode', default='fernet', choices=['fernet', 'aes-gcm-stream'])
+    parser.add_argument('--status-backend', default='xml', choices=['xml', 'sqlite'])
+    parser.add_argument('--label', default='', help='free text to tell the compared versions apart')
+    parser.add_argument('--output', help='path to write the JSON result to instead of stdout')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    result = json.dumps(run_benchmark(args), indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(result)
+    else:
+        print(result)
@@ -0,0 +1,75 @@
+"""
+Base class of the tests that run against the in-process fake AKTIN Broker and fake SFTP server of the benchmark.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import toml
+from benchmark import FakeBroker, FakeSftpServer
+from cryptography.fernet import Fernet
+from sftp_export import metrics
+
+
+class FakeServerTestCase(unittest.TestCase):
+    """
+    A test case with a temporary folder holding the working directory, the Fernet key and the folder `rki` served by a FakeSftpServer,
+    and a FakeBroker with four requests tagged `rki`. The environment points to the broker and is restored after each test.
+    `config` holds the configuration of an export target uploading to the fake SFTP server, and `write_settings()` writes a config file
+    for a Manager using both fake servers.
+    """
+    bundle_size = 10000
+
+    def setUp(self):
+        self.dir_tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir_tmp)
+        self.dir_remote = os.path.join(self.dir_tmp, 'sftp', 'rki')
+        self.dir_working = os.path.join(self.dir_tmp, 'work')
+        os.makedirs(self.dir_remote)
+        os.makedirs(self.dir_working)
+        self.path_key = os.path.join(self.dir_tmp, 'rki.key')
+        with open(self.path_key, 'wb') as key:
+            key.write(Fernet.generate_key())
+        self.fake_broker = FakeBroker(4, self.bundle_size, 0, 'rki')
+        self.fake_broker.start()
+        self.addCleanup(self.fake_broker.stop)
+        self.fake_sftp = self.start_fake_sftp()
+        environ = mock.patch.dict(os.environ, {'BROKER.URL': self.fake_broker.url, 'BROKER.API_KEY': 'key', 'BROKER.RETRY_BACKOFF': '0.01',
+                                               'MISC.WORKING_DIR': self.dir_working})
+        environ.start()
+        self.addCleanup(environ.stop)
+        metrics.reset()
+        self.config = self.create_target_config(self.fake_sftp)
+
+    def start_fake_sftp(self, posix_rename: bool = True) -> FakeSftpServer:
+        fake_sftp = FakeSftpServer(os.path.dirname(self.dir_remote), 0, posix_rename)
+        fake_sftp.start()
+        self.addCleanup(fake_sftp.stop)
+        return fake_sftp
+
+    def create_target_config(self, fake_sftp: FakeSftpServer) -> dict:
+        return {'REQUESTS.TAG': 'rki', 'SFTP.HOST': '127.0.0.1', 'SFTP.PORT': str(fake_sftp.port), 'SFTP.USERNAME': 'user',
+                'SFTP.PASSWORD': 'password', 'SFTP.TIMEOUT': '10', 'SFTP.FOLDERNAME': 'rki', 'SFTP.POOL_SIZE': '2', 'SFTP.RETRY_BACKOFF': '0.01',
+                'SECURITY.PATH_ENCRYPTION_KEY': self.path_key, 'MISC.WORKING_DIR': self.dir_working}
+
+    def write_settings(self, remove: set = frozenset(), **sections) -> str:
+        """
+        Write a config file with the given scopes merged into the settings for both fake servers, without the keys in `remove`.
+        """
+        settings = {'BROKER': {'URL': self.fake_broker.url, 'API_KEY': 'key', 'RETRY_BACKOFF': 0.01},
+                    'REQUESTS': {'TAG': 'rki'},
+                    'SFTP': {'HOST': '127.0.0.1', 'PORT': self.fake_sftp.port, 'USERNAME': 'user', 'PASSWORD': 'password',
+                             'TIMEOUT': 10, 'FOLDERNAME': 'rki'},
+                    'SECURITY': {'PATH_ENCRYPTION_KEY': self.path_key},
+                    'MISC': {'WORKING_DIR': self.dir_working}}
+        for scope, keys in sections.items():
+            settings.setdefault(scope, {}).update(keys)
+        for key in remove:
+            scope, name = key.split('.')
+            del settings[scope][name]
+        path_toml = os.path.join(self.dir_tmp, 'settings.toml')
+        with open(path_toml, 'w', encoding='utf-8') as file:
+            toml.dump(settings, file)
+        return path_toml
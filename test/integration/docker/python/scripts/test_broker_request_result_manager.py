@@ -0,0 +1,101 @@
+import json
+import os
+import time
+import unittest
+from unittest import mock
+
+from fake_server_test_case import FakeServerTestCase
+from sftp_export import BrokerRequestResultManager, metrics
+
+
+class TestBrokerRequestResultManager(FakeServerTestCase):
+    bundle_size = 100
+
+    def __create_broker(self) -> BrokerRequestResultManager:
+        broker = BrokerRequestResultManager()
+        self.addCleanup(broker.close)
+        return broker
+
+    def test_conditional_polling(self):
+        broker = self.__create_broker()
+        dict_tags = broker.get_tagged_requests_completion_by_tag(['rki'])
+        self.assertEqual({'rki': {'0': '1.0', '1': '1.0', '2': '1.0', '3': '1.0'}}, dict_tags)
+        self.assertTrue(broker.has_changed_since_last_sync())
+        broker.save_cache()
+        broker = self.__create_broker()
+        self.assertEqual(dict_tags, broker.get_tagged_requests_completion_by_tag(['rki']))
+        self.assertEqual(5, self.fake_broker.counts['not_modified'])
+        self.assertEqual(5, metrics.summary(True)['counters']['broker_not_modified'])
+        self.assertFalse(broker.has_changed_since_last_sync())
+
+    def test_changes_are_not_answered_from_cache(self):
+        broker = self.__create_broker()
+        broker.get_tagged_requests_completion_by_tag(['rki'])
+        broker.save_cache()
+        self.fake_broker.set_completed('1', False)
+        self.assertEqual('0.0', broker.get_tagged_requests_completion_by_tag(['rki'])['rki']['1'])
+        self.assertTrue(broker.has_changed_since_last_sync())
+        broker.save_cache()
+        self.fake_broker.add_request('4')
+        self.assertIn('4', broker.get_tagged_requests_completion_by_tag(['rki'])['rki'])
+        self.assertTrue(broker.has_changed_since_last_sync())
+
+    def test_unsaved_poll_is_not_cached(self):
+        broker = self.__create_broker()
+        broker.get_tagged_requests_completion_by_tag(['rki'])
+        broker.get_tagged_requests_completion_by_tag(['rki'])
+        self.assertEqual(0, self.fake_broker.counts['not_modified'])
+        self.assertTrue(broker.has_changed_since_last_sync())
+
+    def test_reuse_export(self):
+        broker = self.__create_broker()
+        broker.get_tagged_requests_completion_by_tag(['rki'])
+        id_export = broker.export_request_result('1')
+        self.assertEqual(id_export, broker.export_request_result('1'))
+        broker = self.__create_broker()
+        broker.get_tagged_requests_completion_by_tag(['rki'])
+        self.assertEqual(id_export, broker.export_request_result('1'))
+        self.assertEqual(1, self.fake_broker.counts['export'])
+        self.assertEqual(2, metrics.summary(True)['counters']['broker_exports_reused'])
+        self.assertNotEqual(id_export, broker.export_request_result('1', use_cache=False))
+        self.assertEqual(2, self.fake_broker.counts['export'])
+
+    def test_export_again_after_completion_changed(self):
+        broker = self.__create_broker()
+        broker.get_tagged_requests_completion_by_tag(['rki'])
+        id_export = broker.export_request_result('1')
+        self.fake_broker.set_completed('1', False)
+        broker.get_tagged_requests_completion_by_tag(['rki'])
+        self.assertNotEqual(id_export, broker.export_request_result('1'))
+        self.assertEqual(2, self.fake_broker.counts['export'])
+
+    def test_export_again_after_ttl(self):
+        broker = self.__create_broker()
+        broker.get_tagged_requests_completion_by_tag(['rki'])
+        id_export = broker.export_request_result('1')
+        with self.__shift_clock(301):
+            self.assertNotEqual(id_export, broker.export_request_result('1'))
+        self.assertEqual(2, self.fake_broker.counts['export'])
+        with self.__shift_clock(602):
+            broker = self.__create_broker()
+            broker.get_tagged_requests_completion_by_tag(['rki'])
+            broker.export_request_result('1')
+        self.assertEqual(3, self.fake_broker.counts['export'])
+
+    def test_evict_expired_exports(self):
+        broker = self.__create_broker()
+        broker.get_tagged_requests_completion_by_tag(['rki'])
+        broker.export_request_result('1')
+        broker.export_request_result('2')
+        with self.__shift_clock(301):
+            broker.export_request_result('3')
+        with open(os.path.join(self.dir_working, 'broker_exports.json'), encoding='utf-8') as file:
+            self.assertEqual(['3'], list(json.load(file)))
+
+    @staticmethod
+    def __shift_clock(seconds: float):
+        time_real = time.time
+        return mock.patch.object(time, 'time', lambda: time_real() + seconds)
+
+if __name__ == '__main__':
+    unittest.main()
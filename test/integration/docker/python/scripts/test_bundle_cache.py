@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sftp_export import BundleCache
+
+
+class TestBundleCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir_tmp)
+        self.dir_cache = os.path.join(self.dir_tmp, 'cache')
+
+    def test_put_and_get(self):
+        cache = BundleCache(self.dir_cache, 100)
+        cache.put('1', 'abc', self.__create_file('export_1.zip', 10))
+        path = cache.get('1', 'abc')
+        self.assertEqual('export_1.zip', os.path.basename(path))
+        self.assertFalse(os.path.isfile(os.path.join(self.dir_tmp, 'export_1.zip')))
+        self.assertIsNone(cache.get('1', 'def'))
+        self.assertIsNone(cache.get('2', 'abc'))
+
+    def test_persist_between_runs(self):
+        BundleCache(self.dir_cache, 100).put('1', 'abc', self.__create_file('export_1.zip', 10))
+        self.assertIsNotNone(BundleCache(self.dir_cache, 100).get('1', 'abc'))
+
+    def test_evict_least_recently_used(self):
+        cache = BundleCache(self.dir_cache, 25)
+        cache.put('1', 'a', self.__create_file('export_1.zip', 10))
+        cache.put('2', 'b', self.__create_file('export_2.zip', 10))
+        cache.get('1', 'a')
+        cache.put('3', 'c', self.__create_file('export_3.zip', 10))
+        self.assertIsNotNone(cache.get('1', 'a'))
+        self.assertIsNone(cache.get('2', 'b'))
+        self.assertIsNotNone(cache.get('3', 'c'))
+
+    def test_evict_damaged(self):
+        cache = BundleCache(self.dir_cache, 100)
+        cache.put('1', 'abc', self.__create_file('export_1.zip', 10))
+        with open(cache.get('1', 'abc'), 'r+b') as file:
+            file.write(b'x')
+        self.assertIsNone(cache.get('1', 'abc'))
+        self.assertFalse(os.path.isfile(os.path.join(self.dir_cache, '1', 'export_1.zip')))
+
+    def test_remove(self):
+        cache = BundleCache(self.dir_cache, 100)
+        cache.put('1', 'abc', self.__create_file('export_1.zip', 10))
+        cache.remove('1')
+        self.assertIsNone(cache.get('1', 'abc'))
+
+    def test_disabled(self):
+        cache = BundleCache(self.dir_cache, 0)
+        path = self.__create_file('export_1.zip', 10)
+        cache.put('1', 'abc', path)
+        self.assertFalse(os.path.isfile(path))
+        self.assertIsNone(cache.get('1', 'abc'))
+
+    def __create_file(self, filename: str, size: int) -> str:
+        path = os.path.join(self.dir_tmp, filename)
+        with open(path, 'wb') as file:
+            file.write(os.urandom(size))
+        return path
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import signal
+import threading
+import unittest
+from unittest import mock
+
+import sftp_export
+from fake_server_test_case import FakeServerTestCase
+from sftp_export import Daemon, Manager
+
+
+class FakeClock(threading.Event):
+    """
+    A stop event of the daemon that records each wait instead of sleeping and calls `on_wait` with the number of waits so far.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.waits = []
+        self.on_wait = lambda num_waits: None
+
+    def wait(self, timeout=None) -> bool:
+        self.waits.append(timeout)
+        self.on_wait(len(self.waits))
+        return self.is_set()
+
+
+class TestDaemon(FakeServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for signalnum in (signal.SIGTERM, signal.SIGINT):
+            self.addCleanup(signal.signal, signalnum, signal.getsignal(signalnum))
+        self.clock = FakeClock()
+
+    def __create_daemon(self, **daemon_config) -> Daemon:
+        path_toml = self.write_settings(DAEMON=daemon_config)
+        with mock.patch.object(sftp_export.threading, 'Event', lambda: self.clock):
+            return Daemon(path_toml)
+
+    def __stop_after(self, num_cycles: int, signalnum: int = signal.SIGTERM):
+        def on_wait(num_waits: int):
+            if num_waits == num_cycles:
+                signal.raise_signal(signalnum)
+        self.clock.on_wait = on_wait
+
+    def test_run_cycles_until_sigterm(self):
+        daemon = self.__create_daemon(INTERVAL=100, JITTER=10)
+        self.__stop_after(3)
+        daemon.run()
+        self.assertEqual(3, len(self.clock.waits))
+        self.assertTrue(all(90 <= delay <= 110 for delay in self.clock.waits))
+        self.assertEqual(3, self.fake_broker.counts['list'])
+        self.assertEqual(4, self.fake_broker.counts['export'])
+        self.assertEqual(['export_0.zip', 'export_1.zip', 'export_2.zip', 'export_3.zip', 'status.xml'], sorted(os.listdir(self.dir_remote)))
+
+    def test_stop_on_sigint(self):
+        daemon = self.__create_daemon(INTERVAL=100, JITTER=0)
+        self.__stop_after(1, signal.SIGINT)
+        daemon.run()
+        self.assertEqual([100], self.clock.waits)
+        self.assertEqual(1, self.fake_broker.counts['list'])
+
+    def test_reconnect_after_max_failures(self):
+        self.fake_broker.download_status = 500
+
+        def on_wait(num_waits: int):
+            if num_waits == 2:
+                self.fake_broker.download_status = None
+            elif num_waits == 3:
+                signal.raise_signal(signal.SIGTERM)
+
+        with mock.patch('sftp_export.Manager', wraps=Manager) as manager:
+            daemon = self.__create_daemon(INTERVAL=100, JITTER=0, RETRY_DELAY=5, MAX_FAILURES=2)
+            self.clock.on_wait = on_wait
+            daemon.run()
+        self.assertEqual([5, 5, 100], self.clock.waits)
+        self.assertEqual(2, manager.call_count)
+        self.assertEqual(['export_0.zip', 'export_1.zip', 'export_2.zip', 'export_3.zip', 'status.xml'], sorted(os.listdir(self.dir_remote)))
+
+    def test_keep_connections_below_max_failures(self):
+        self.fake_broker.download_status = 500
+        self.__stop_after(2)
+        with mock.patch('sftp_export.Manager', wraps=Manager) as manager:
+            daemon = self.__create_daemon(INTERVAL=100, JITTER=0, RETRY_DELAY=5, MAX_FAILURES=3)
+            daemon.run()
+        self.assertEqual([5, 5], self.clock.waits)
+        self.assertEqual(1, manager.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
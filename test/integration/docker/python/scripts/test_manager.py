@@ -0,0 +1,181 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from fake_server_test_case import FakeServerTestCase
+from sftp_export import BundleCache, Manager, StatusXmlManager, StreamingFernet, main, metrics
+
+
+class TestManager(FakeServerTestCase):
+
+    def __create_manager(self, remove: set = frozenset(), **sections) -> Manager:
+        manager = Manager(self.write_settings(remove, **sections))
+        self.addCleanup(manager.close)
+        return manager
+
+    def test_resync_reports_requests_without_digest(self):
+        status = StatusXmlManager({'MISC.WORKING_DIR': self.dir_working})
+        status.update_or_add_element('1', '1.0', 'digest1', 3)
+        status.update_or_add_element('2', '1.0')
+        path_file = os.path.join(self.dir_tmp, 'export_1.zip')
+        with open(path_file, 'wb') as file:
+            file.write(b'abc')
+        BundleCache(os.path.join(self.dir_working, 'cache'), 1000).put('1', 'digest1', path_file)
+        manager = self.__create_manager(MISC={'BUNDLE_CACHE_SIZE': 1000})
+        with self.assertRaisesRegex(RuntimeError, r"resync of 1 requests failed: \['default/2'\]"):
+            manager.resync_from_cache()
+        self.assertEqual(['export_1.zip', 'status.xml'], sorted(os.listdir(self.dir_remote)))
+
+    def __count_polled_status(self, manager: Manager) -> int:
+        num_polled = self.fake_broker.counts['status']
+        manager.upload_tagged_results_to_sftp()
+        return self.fake_broker.counts['status'] - num_polled
+
+    def test_freeze_completed_requests(self):
+        self.fake_broker.set_completed('2', False)
+        manager = self.__create_manager(REQUESTS={'FREEZE_COMPLETED': True})
+        self.assertEqual(4, self.__count_polled_status(manager))
+        self.assertTrue(os.path.isfile(os.path.join(self.dir_working, 'full_sweep.json')))
+        self.assertEqual(1, self.__count_polled_status(manager))
+        self.assertEqual(3, metrics.summary(True)['counters']['requests_frozen'])
+        self.fake_broker.add_request('4')
+        self.assertEqual(2, self.__count_polled_status(manager))
+        self.assertIn('export_4.zip', os.listdir(self.dir_remote))
+
+    def test_freeze_requests_by_age(self):
+        class Later(datetime):
+            @classmethod
+            def utcnow(cls):
+                return datetime.utcnow() + timedelta(days=2)
+
+        manager = self.__create_manager(REQUESTS={'FREEZE_AGE': 1})
+        self.assertEqual(4, self.__count_polled_status(manager))
+        self.assertEqual(4, self.__count_polled_status(manager))
+        with mock.patch('sftp_export.datetime', Later):
+            self.assertEqual(0, self.__count_polled_status(manager))
+
+    def test_full_sweep_polls_frozen_requests(self):
+        manager = self.__create_manager(REQUESTS={'FREEZE_COMPLETED': True, 'FULL_SWEEP_INTERVAL': 1})
+        self.assertEqual(4, self.__count_polled_status(manager))
+        self.assertEqual(0, self.__count_polled_status(manager))
+        path_full_sweep = os.path.join(self.dir_working, 'full_sweep.json')
+        with open(path_full_sweep, 'w', encoding='utf-8') as file:
+            json.dump({'time': time.time() - 3600}, file)
+        self.fake_broker.set_completed('1', False)
+        self.assertEqual(4, self.__count_polled_status(manager))
+        with open(path_full_sweep, encoding='utf-8') as file:
+            self.assertGreater(json.load(file)['time'], time.time() - 60)
+        self.assertEqual(1, self.__count_polled_status(manager))
+
+    def test_upload_order_by_priority(self):
+        for priority, order in (('smallest, oldest', ['2', '0', '3', '1']), ('new, smallest', ['0', '2', '3', '1']), ('oldest', ['0', '1', '2', '3'])):
+            with self.subTest(priority=priority):
+                dir_working = tempfile.mkdtemp(dir=self.dir_tmp)
+                status = StatusXmlManager({'MISC.WORKING_DIR': dir_working})
+                for id_request, size in (('1', 500), ('2', 100), ('3', 300)):
+                    status.update_or_add_element(id_request, '0.5', f'digest{id_request}', size)
+                manager = self.__create_manager(PIPELINE={'PRIORITY': priority, 'EXPORT_WORKERS': 1}, MISC={'WORKING_DIR': dir_working})
+                self.fake_broker.exported.clear()
+                manager.upload_tagged_results_to_sftp()
+                self.assertEqual(order, self.fake_broker.exported)
+
+    def test_targets_inherit_keys(self):
+        os.makedirs(os.path.join(self.dir_tmp, 'sftp', 'other'))
+        manager = self.__create_manager(TARGETS={'first': {'MISC': {'STATUS_BACKEND': 'sqlite'}},
+                                                 'second': {'REQUESTS': {'TAG': 'other'}, 'SFTP': {'FOLDERNAME': 'other'}}})
+        manager.upload_tagged_results_to_sftp()
+        self.assertEqual(['export_0.zip', 'export_1.zip', 'export_2.zip', 'export_3.zip', 'status.xml'], sorted(os.listdir(self.dir_remote)))
+        self.assertEqual(['status.xml'], os.listdir(os.path.join(self.dir_tmp, 'sftp', 'other')))
+        self.assertTrue(os.path.isfile(os.path.join(self.dir_working, 'first', 'status.db')))
+        self.assertFalse(os.path.isfile(os.path.join(self.dir_working, 'second', 'status.db')))
+        self.assertNotIn('TARGETS.second.REQUESTS.TAG', os.environ)
+
+    def test_reject_invalid_target_keys(self):
+        for targets, message in (({'first': {'SFTP': {'UNKNOWN': 'x'}}}, 'unknown key SFTP.UNKNOWN for target first'),
+                                 ({'first': {'BROKER': {'URL': 'x'}}}, 'unknown key BROKER.URL for target first'),
+                                 ({'first': 'x'}, 'invalid key TARGETS.first in config file'),
+                                 ({'first': {'TAG': 'x'}}, 'invalid key TARGETS.first.TAG in config file'),
+                                 ({'first': {'SFTP': {'OPTIONS': {'TIMEOUT': 10}}}}, 'invalid key TARGETS.first.SFTP.OPTIONS.TIMEOUT in config file')):
+            with self.subTest(message=message):
+                with self.assertRaisesRegex(SystemExit, message):
+                    self.__create_manager(TARGETS=targets)
+
+    def test_require_keys_per_target(self):
+        targets = {'first': {'REQUESTS': {'TAG': 'rki'}}, 'second': {'SFTP': {'FOLDERNAME': 'other'}}}
+        with self.assertRaisesRegex(SystemExit, "keys are missing for target second in config file: {'REQUESTS.TAG'}"):
+            self.__create_manager(remove={'REQUESTS.TAG'}, TARGETS=targets)
+
+    def test_reconcile_sftp_folder(self):
+        manager = self.__create_manager()
+        manager.upload_tagged_results_to_sftp()
+        dict_completion = StatusXmlManager({'MISC.WORKING_DIR': self.dir_working}).get_request_completion_as_dict()
+        size = os.path.getsize(os.path.join(self.dir_remote, 'export_1.zip'))
+        os.remove(os.path.join(self.dir_remote, 'export_0.zip'))
+        with open(os.path.join(self.dir_remote, 'export_1.zip'), 'r+b') as file:
+            file.truncate(size // 2)
+        for filename in ('export_9.zip', 'export_2.zip.part', 'export_3.zip.part'):
+            with open(os.path.join(self.dir_remote, filename), 'wb') as file:
+                file.write(b'abc')
+        time_stale = time.time() - 7200
+        os.utime(os.path.join(self.dir_remote, 'export_2.zip.part'), (time_stale, time_stale))
+        self.fake_broker.counts.clear()
+        manager.reconcile_sftp_folders()
+        self.assertEqual(2, self.fake_broker.counts['download'])
+        self.assertEqual(['export_0.zip', 'export_1.zip', 'export_2.zip', 'export_3.zip', 'export_3.zip.part', 'status.xml'],
+                         sorted(os.listdir(self.dir_remote)))
+        self.assertEqual(size, os.path.getsize(os.path.join(self.dir_remote, 'export_0.zip')))
+        self.assertEqual(size, os.path.getsize(os.path.join(self.dir_remote, 'export_1.zip')))
+        self.assertEqual(dict_completion, StatusXmlManager({'MISC.WORKING_DIR': self.dir_working}).get_request_completion_as_dict())
+
+    def test_reconcile_from_cache(self):
+        manager = self.__create_manager(MISC={'BUNDLE_CACHE_SIZE': 1000000})
+        manager.upload_tagged_results_to_sftp()
+        with open(os.path.join(self.dir_remote, 'export_2.zip'), 'rb') as file:
+            content = file.read()
+        os.remove(os.path.join(self.dir_remote, 'export_2.zip'))
+        os.remove(os.path.join(self.dir_remote, 'status.xml'))
+        self.fake_broker.counts.clear()
+        manager.reconcile_sftp_folders()
+        self.assertEqual(0, self.fake_broker.counts['download'])
+        with open(os.path.join(self.dir_remote, 'export_2.zip'), 'rb') as file:
+            self.assertEqual(content, file.read())
+        self.assertIn('status.xml', os.listdir(self.dir_remote))
+
+    def __snapshot_files(self) -> dict:
+        snapshot = {}
+        for path_dir in (self.dir_working, self.dir_remote):
+            for path, _, filenames in os.walk(path_dir):
+                for filename in filenames:
+                    with open(os.path.join(path, filename), 'rb') as file:
+                        snapshot[os.path.join(path, filename)] = file.read()
+        return snapshot
+
+    def test_plan_tagged_results(self):
+        path_summary = os.path.join(self.dir_tmp, 'summary.json')
+        with open(path_summary, 'w', encoding='utf-8') as file:
+            json.dump({'duration_seconds': 2.0, 'counters': {'bytes_uploaded': 1000}}, file)
+        status = StatusXmlManager({'MISC.WORKING_DIR': self.dir_working})
+        for id_request, completion, size in (('1', '0.5', 500), ('2', '0.5', 100), ('7', '1.0', 300)):
+            status.update_or_add_element(id_request, completion, f'digest{id_request}', size)
+        path_toml = self.write_settings(MISC={'METRICS_SUMMARY': path_summary})
+        snapshot = self.__snapshot_files()
+        num_bytes = sum(StreamingFernet.calculate_token_size(size) for size in (500, 100, 300, 300))
+        expected = {'targets': {'default': {'new': ['0', '3'], 'update': ['1', '2'], 'delete': ['7'], 'estimated_bytes': num_bytes}},
+                    'estimated_bytes': num_bytes, 'estimated_seconds': round(num_bytes / 500, 1)}
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            main(path_toml, plan=True)
+        self.assertEqual(expected, json.loads(output.getvalue()))
+        self.assertEqual(0, self.fake_broker.counts['export'])
+        self.assertEqual(0, self.fake_broker.counts['download'])
+        self.assertEqual(snapshot, self.__snapshot_files())
+
+
+if __name__ == '__main__':
+    unittest.main()
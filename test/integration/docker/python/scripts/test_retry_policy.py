@@ -0,0 +1,55 @@
+import unittest
+
+from sftp_export import RetryPolicy
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = RetryPolicy(retries=2, backoff=0.001)
+        self.num_calls = 0
+
+    def test_success(self):
+        self.assertEqual('done', self.policy.call(self.__fail_times(0), self.__is_transient, 'test_retries'))
+        self.assertEqual(1, self.num_calls)
+
+    def test_retry_transient_error(self):
+        self.assertEqual('done', self.policy.call(self.__fail_times(2), self.__is_transient, 'test_retries'))
+        self.assertEqual(3, self.num_calls)
+
+    def test_raise_after_last_retry(self):
+        with self.assertRaises(ConnectionError):
+            self.policy.call(self.__fail_times(3), self.__is_transient, 'test_retries')
+        self.assertEqual(3, self.num_calls)
+
+    def test_raise_permanent_error(self):
+        def fail():
+            self.num_calls += 1
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            self.policy.call(fail, self.__is_transient, 'test_retries')
+        self.assertEqual(1, self.num_calls)
+
+    def test_from_config(self):
+        policy = RetryPolicy.from_config({'SFTP.RETRIES': '0'}, 'SFTP')
+        with self.assertRaises(ConnectionError):
+            policy.call(self.__fail_times(1), self.__is_transient, 'test_retries')
+        self.assertEqual(1, self.num_calls)
+
+    def __fail_times(self, num_failures: int):
+        def operation():
+            self.num_calls += 1
+            if self.num_calls <= num_failures:
+                raise ConnectionError()
+            return 'done'
+
+        return operation
+
+    @staticmethod
+    def __is_transient(err: Exception) -> bool:
+        return isinstance(err, ConnectionError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import time
+import unittest
+
+from sftp_export import RunMetrics
+
+
+class TestRunMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = RunMetrics()
+
+    def test_span(self):
+        with self.metrics.span('upload'):
+            pass
+        with self.metrics.span('upload'):
+            pass
+        stages = self.metrics.summary(True)['stages']
+        self.assertEqual(2, stages['upload']['count'])
+        self.assertEqual(0, stages['upload']['errors'])
+        self.assertGreaterEqual(stages['upload']['seconds'], 0)
+
+    def test_span_counts_errors(self):
+        with self.assertRaises(ValueError):
+            with self.metrics.span('export'):
+                raise ValueError()
+        stages = self.metrics.summary(False)['stages']
+        self.assertEqual(1, stages['export']['count'])
+        self.assertEqual(1, stages['export']['errors'])
+
+    def test_time_chunks_excludes_consumer(self):
+        def read_slowly():
+            for chunk in (b'a', b'b'):
+                time.sleep(0.05)
+                yield chunk
+
+        for chunk in self.metrics.time_chunks('broker_download_body', read_slowly()):
+            time.sleep(0.2)
+        timing = self.metrics.summary(True)['stages']['broker_download_body']
+        self.assertEqual(1, timing['count'])
+        self.assertGreaterEqual(timing['seconds'], 0.1)
+        self.assertLess(timing['seconds'], 0.3)
+
+    def test_time_chunks_counts_errors(self):
+        def read_broken():
+            yield b'a'
+            raise ConnectionError()
+
+        with self.assertRaises(ConnectionError):
+            list(self.metrics.time_chunks('broker_download_body', read_broken()))
+        self.assertEqual(1, self.metrics.summary(False)['stages']['broker_download_body']['errors'])
+
+    def test_increment(self):
+        self.metrics.increment('bytes_uploaded', 100)
+        self.metrics.increment('bytes_uploaded', 50)
+        self.metrics.increment('sftp_retries')
+        self.assertEqual({'bytes_uploaded': 150, 'sftp_retries': 1}, self.metrics.summary(True)['counters'])
+
+    def test_reset(self):
+        self.metrics.increment('requests_uploaded')
+        with self.metrics.span('run'):
+            pass
+        self.metrics.reset()
+        summary = self.metrics.summary(True)
+        self.assertEqual({}, summary['stages'])
+        self.assertEqual({}, summary['counters'])
+
+    def test_prometheus_text(self):
+        with self.metrics.span('sftp_upload'):
+            pass
+        self.metrics.increment('bytes_uploaded', 100)
+        lines = self.metrics.to_prometheus_text(False).splitlines()
+        self.assertIn('sftp_export_last_run_success 0', lines)
+        self.assertIn('sftp_export_last_run_stage_count{stage="sftp_upload"} 1', lines)
+        self.assertIn('sftp_export_last_run_bytes_uploaded 100', lines)
+        self.assertIn('# TYPE sftp_export_last_run_bytes_uploaded gauge', lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
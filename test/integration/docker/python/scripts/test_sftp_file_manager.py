@@ -0,0 +1,71 @@
+import os
+import unittest
+
+from fake_server_test_case import FakeServerTestCase
+from sftp_export import SftpFileManager, metrics
+
+
+class TestSftpFileManager(FakeServerTestCase):
+
+    def __start_server(self, posix_rename: bool = True, **sftp_config) -> SftpFileManager:
+        self.server = self.start_fake_sftp(posix_rename)
+        config = self.create_target_config(self.server)
+        config.update({f'SFTP.{key.upper()}': str(value) for key, value in dict(sftp_config, pool_size=1).items()})
+        sftp = SftpFileManager(config)
+        self.addCleanup(sftp.close)
+        return sftp
+
+    def __write(self, path: str, content: bytes) -> str:
+        with open(path, 'wb') as file:
+            file.write(content)
+        return path
+
+    def __read_remote(self, filename: str) -> bytes:
+        with open(os.path.join(self.dir_remote, filename), 'rb') as file:
+            return file.read()
+
+    def test_publish_replaces_file(self):
+        for posix_rename in (True, False):
+            with self.subTest(posix_rename=posix_rename):
+                sftp = self.__start_server(posix_rename)
+                self.__write(os.path.join(self.dir_remote, 'export_1.zip'), b'old')
+                sftp.stage_file(self.__write(os.path.join(self.dir_working, 'export_1.zip'), b'new'))
+                self.assertEqual({}, sftp.publish_files(['export_1.zip']))
+                self.assertEqual(b'new', self.__read_remote('export_1.zip'))
+                self.assertEqual(['export_1.zip'], os.listdir(self.dir_remote))
+
+    def test_failed_rename_keeps_published_file(self):
+        for posix_rename in (True, False):
+            with self.subTest(posix_rename=posix_rename):
+                sftp = self.__start_server(posix_rename)
+                self.__write(os.path.join(self.dir_remote, 'export_1.zip'), b'old')
+                sftp.stage_file(self.__write(os.path.join(self.dir_working, 'export_1.zip'), b'new'))
+                self.server.failing_renames.add('export_1.zip.part')
+                failures = sftp.publish_files(['export_1.zip'])
+                self.assertEqual(['export_1.zip'], list(failures))
+                self.assertEqual(b'old', self.__read_remote('export_1.zip'))
+                self.assertEqual(['export_1.zip', 'export_1.zip.part'], sorted(os.listdir(self.dir_remote)))
+                self.server.failing_renames.clear()
+                self.assertEqual({}, sftp.publish_files(['export_1.zip']))
+                self.assertEqual(b'new', self.__read_remote('export_1.zip'))
+                os.remove(os.path.join(self.dir_remote, 'export_1.zip'))
+
+    def test_resume_upload_after_dropped_connection(self):
+        for verify in ('size', 'checksum'):
+            with self.subTest(verify=verify):
+                sftp = self.__start_server(verify=verify)
+                content = os.urandom(3 * 1048576 + 12345)
+                self.server.drop_upload_at = 1572864 + 100
+                metrics.reset()
+                with self.assertLogs(level='INFO') as logs:
+                    sftp.stage_file(self.__write(os.path.join(self.dir_working, 'export_1.zip'), content))
+                self.assertTrue(any('Resuming upload' in line for line in logs.output))
+                self.assertIsNone(self.server.drop_upload_at)
+                self.assertGreaterEqual(metrics.summary(True)['counters']['sftp_retries'], 1)
+                self.assertEqual({}, sftp.publish_files(['export_1.zip']))
+                self.assertEqual(content, self.__read_remote('export_1.zip'))
+                os.remove(os.path.join(self.dir_remote, 'export_1.zip'))
+
+
+if __name__ == '__main__':
+    unittest.main()
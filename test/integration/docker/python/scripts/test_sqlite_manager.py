@@ -0,0 +1,104 @@
+import os
+import unittest
+import xml.etree.ElementTree as et
+from datetime import datetime
+
+from sftp_export import StatusSqliteManager, StatusXmlManager
+
+
+class TestStatusSqliteManager(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_current = os.getcwd()
+        os.environ['MISC.WORKING_DIR'] = self.dir_current
+        self.path_db = os.path.join(self.dir_current, 'status.db')
+        self.path_xml = os.path.join(self.dir_current, 'status.xml')
+        self.addCleanup(self.__remove_file, self.path_db)
+        self.addCleanup(self.__remove_file, self.path_xml)
+
+    def test_init(self):
+        store = self.__create_store()
+        self.assertTrue(os.path.isfile(self.path_db))
+        self.assertEqual({}, store.get_request_completion_as_dict())
+
+    def test_add_and_update(self):
+        store = self.__create_store()
+        store.update_or_add_element('1', '10', 'abc', 100)
+        store.update_or_add_element('2', '20')
+        store.update_or_add_element('1', '100')
+        store.update_completion_of_element('2', '200')
+        self.assertEqual({'1': '100', '2': '200'}, store.get_request_completion_as_dict())
+        self.assertEqual({'1': 'abc'}, store.get_request_digest_as_dict())
+        self.assertEqual({'1': 100}, store.get_request_size_as_dict())
+
+    def test_upload_time(self):
+        store = self.__create_store()
+        store.update_or_add_element('1', '10')
+        dict_upload_time = store.get_request_upload_time_as_dict()
+        self.assertEqual({'1'}, dict_upload_time.keys())
+        self.assertLess(abs((datetime.utcnow() - dict_upload_time['1']).total_seconds()), 60)
+
+    def test_add_delete_tag(self):
+        store = self.__create_store()
+        store.update_or_add_element('1', '10')
+        store.update_or_add_element('2', '20')
+        store.add_delete_tag_to_element('1')
+        self.assertTrue(store.is_request_tagged_as_deleted('1'))
+        self.assertFalse(store.is_request_tagged_as_deleted('2'))
+        self.assertFalse(store.is_request_tagged_as_deleted('3'))
+
+    def test_persist_between_runs(self):
+        store = self.__create_store()
+        store.update_or_add_element('1', '10')
+        store.flush()
+        store.close()
+        store = self.__create_store()
+        self.assertEqual({'1': '10'}, store.get_request_completion_as_dict())
+
+    def test_export_status_xml(self):
+        store = self.__create_store()
+        store.update_or_add_element('1', '10', 'abc', 100)
+        store.update_or_add_element('2', '20')
+        store.update_or_add_element('2', '30')
+        store.add_delete_tag_to_element('1')
+        store.flush()
+        root = et.parse(self.path_xml).getroot()
+        self.assertEqual(2, len(root.findall('request-status')))
+        self.assertEqual(1, len(root.findall('.//deleted')))
+        self.assertEqual(1, len(root.findall('.//last-update')))
+        self.assertEqual('100', root.find('.//size').text)
+
+    def test_migrate_status_xml(self):
+        xml = StatusXmlManager()
+        xml.update_or_add_element('1', '10', 'abc', 100)
+        xml.update_or_add_element('2', '20')
+        xml.add_delete_tag_to_element('2')
+        store = self.__create_store()
+        self.assertEqual({'1': '10', '2': '20'}, store.get_request_completion_as_dict())
+        self.assertEqual({'1': 'abc'}, store.get_request_digest_as_dict())
+        self.assertTrue(store.is_request_tagged_as_deleted('2'))
+
+    def test_compare_completion(self):
+        store = self.__create_store()
+        store.update_or_add_element('1', '10')
+        store.update_or_add_element('2', '20')
+        store.update_or_add_element('3', '30')
+        store.add_delete_tag_to_element('3')
+        dict_broker = {'2': '25', '4': '40'}
+        dict_store = store.get_request_completion_as_dict()
+        set_new, set_update, set_delete = store.compare_request_completion_between_broker_and_sftp(dict_broker, dict_store)
+        self.assertEqual(({'4'}, {'2'}, {'1'}), (set_new, set_update, set_delete))
+
+    def __create_store(self) -> StatusSqliteManager:
+        store = StatusSqliteManager()
+        self.addCleanup(store.close)
+        return store
+
+    @staticmethod
+    def __remove_file(path: str):
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as et
+
+from sftp_export import StatusManifest, StatusXmlManager
+
+
+class RecordingSftp:
+
+    def __init__(self):
+        self.staged = []
+        self.published = []
+
+    def stage_file(self, path_file: str):
+        with open(path_file, 'rb') as file:
+            self.staged.append((os.path.basename(path_file), file.read()))
+
+    def publish_files(self, filenames: list) -> dict:
+        self.published.append(sorted(filenames))
+        return {}
+
+
+class TestStatusManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir_tmp)
+        self.config = {'MISC.WORKING_DIR': self.dir_tmp, 'MISC.STATUS_VARIANT': 'gzip', 'MISC.STATUS_CHANGELOG': '2'}
+        self.store = StatusXmlManager(self.config)
+        self.sftp = RecordingSftp()
+        self.manifest = StatusManifest(self.config, self.sftp, self.store.path_status_xml)
+
+    def test_skip_unchanged(self):
+        self.store.update_or_add_element('1', '10')
+        self.manifest.publish()
+        self.manifest.publish()
+        self.assertEqual(1, len(self.sftp.published))
+        self.manifest.publish(force=True)
+        self.assertEqual(2, len(self.sftp.published))
+
+    def test_compressed_variant(self):
+        self.store.update_or_add_element('1', '10')
+        self.manifest.publish()
+        self.assertEqual([['status.xml', 'status.xml.gz']], self.sftp.published)
+        dict_staged = dict(self.sftp.staged)
+        self.assertEqual(dict_staged['status.xml'], gzip.decompress(dict_staged['status.xml.gz']))
+        self.assertFalse(os.path.isfile(os.path.join(self.dir_tmp, 'status.xml.gz')))
+
+    def test_changelog(self):
+        self.store.update_or_add_element('1', '10')
+        self.store.update_or_add_element('2', '20')
+        self.manifest.publish()
+        for id_request, completion in (('1', '11'), ('2', '21'), ('3', '30')):
+            self.store.update_or_add_element(id_request, completion)
+            self.manifest.publish()
+        self.assertEqual(['status.xml', 'status.xml.gz', 'status_changes.xml'], self.sftp.published[-1])
+        root = et.fromstring(dict(self.sftp.staged)['status_changes.xml'])
+        runs = root.findall('run')
+        self.assertEqual(2, len(runs))
+        self.assertEqual([['2'], ['3']], [[element.findtext('id') for element in run] for run in runs])
+        self.assertEqual(runs[0].get('current'), runs[1].get('previous'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import io
+import multiprocessing
+import os
+import tempfile
+import unittest
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet
+from sftp_export import AesGcmStreamCipher, SftpFileManager
+
+
+class TestStreamDecryption(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.key = Fernet.generate_key()
+        self.chunk_size = 1024
+        self.cipher = AesGcmStreamCipher(self.key, self.chunk_size)
+
+    def test_decryption(self) -> None:
+        file_zip = self.__create_zip_file(10 * self.chunk_size)
+        file_encrypted = self.__encrypt(file_zip)
+        self.assertFalse(zipfile.is_zipfile(io.BytesIO(file_encrypted)))
+        file_decrypted = self.__decrypt(file_encrypted)
+        self.assertEqual(file_zip, file_decrypted)
+        self.assertTrue(zipfile.is_zipfile(io.BytesIO(file_decrypted)))
+
+    def test_decryption_chunk_boundaries(self) -> None:
+        for size in [0, 1, self.chunk_size - 1, self.chunk_size, self.chunk_size + 1, 3 * self.chunk_size]:
+            payload = os.urandom(size)
+            self.assertEqual(payload, self.__decrypt(self.__encrypt(payload), len_read=7))
+
+    def test_decryption_with_other_chunk_size(self) -> None:
+        payload = os.urandom(5 * self.chunk_size)
+        file_encrypted = self.__encrypt(payload)
+        other_cipher = AesGcmStreamCipher(self.key, 4 * self.chunk_size)
+        self.assertEqual(payload, b''.join(other_cipher.decrypt([file_encrypted])))
+
+    def test_decryption_with_wrong_key(self) -> None:
+        file_encrypted = self.__encrypt(os.urandom(self.chunk_size))
+        other_cipher = AesGcmStreamCipher(Fernet.generate_key(), self.chunk_size)
+        with self.assertRaises(InvalidTag):
+            b''.join(other_cipher.decrypt([file_encrypted]))
+
+    def test_decryption_of_file_encrypted_in_process(self) -> None:
+        payload = os.urandom(3 * self.chunk_size + 1)
+        with tempfile.TemporaryDirectory() as dir_tmp:
+            path_plain = os.path.join(dir_tmp, 'export_1.zip.plain')
+            path_encrypted = os.path.join(dir_tmp, 'export_1.zip')
+            with open(path_plain, 'wb') as file:
+                file.write(payload)
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                executor.submit(SftpFileManager.encrypt_file, path_plain, path_encrypted, 'aes-gcm-stream', self.key, self.chunk_size).result()
+            with open(path_encrypted, 'rb') as file:
+                self.assertEqual(payload, self.__decrypt(file.read()))
+
+    def test_container_size(self) -> None:
+        for size in [0, 1, self.chunk_size, self.chunk_size + 1, 3 * self.chunk_size]:
+            self.assertEqual(len(self.__encrypt(os.urandom(size))), AesGcmStreamCipher.calculate_container_size(size, self.chunk_size))
+
+    def test_detect_truncation(self) -> None:
+        file_encrypted = self.__encrypt(os.urandom(3 * self.chunk_size))
+        len_sealed_chunk = self.chunk_size + 16
+        with self.assertRaises(InvalidTag):
+            self.__decrypt(file_encrypted[:-len_sealed_chunk])
+
+    def test_detect_modification(self) -> None:
+        file_encrypted = bytearray(self.__encrypt(os.urandom(3 * self.chunk_size)))
+        file_encrypted[100] ^= 1
+        with self.assertRaises(InvalidTag):
+            self.__decrypt(bytes(file_encrypted))
+
+    def test_detect_unknown_format(self) -> None:
+        file_encrypted = Fernet(self.key).encrypt(os.urandom(self.chunk_size))
+        with self.assertRaises(ValueError):
+            self.__decrypt(file_encrypted)
+
+    def __encrypt(self, payload: bytes) -> bytes:
+        chunks = [payload[i:i + 100] for i in range(0, len(payload), 100)]
+        return b''.join(self.cipher.encrypt(chunks))
+
+    def __decrypt(self, file_encrypted: bytes, len_read: int = 4096) -> bytes:
+        chunks = [file_encrypted[i:i + len_read] for i in range(0, len(file_encrypted), len_read)]
+        return b''.join(self.cipher.decrypt(chunks))
+
+    @staticmethod
+    def __create_zip_file(size: int) -> bytes:
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as file_zip:
+            file_zip.writestr('result.txt', os.urandom(size))
+        return buffer.getvalue()
+
+
+if __name__ == '__main__':
+    unittest.main()
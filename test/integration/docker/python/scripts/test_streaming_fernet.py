@@ -0,0 +1,46 @@
+import os
+import unittest
+
+from cryptography.fernet import Fernet, InvalidToken
+from sftp_export import StreamingFernet
+
+
+class TestStreamingFernet(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.key = Fernet.generate_key()
+        self.cipher = StreamingFernet(self.key)
+
+    def test_decryption(self) -> None:
+        for size in [0, 1, 15, 16, 17, 100, 3 * 1024 + 5]:
+            with self.subTest(size=size):
+                payload = os.urandom(size)
+                self.assertEqual(payload, Fernet(self.key).decrypt(self.__encrypt(payload, 100)))
+
+    def test_decryption_of_uneven_chunks(self) -> None:
+        payload = os.urandom(1000)
+        for len_chunk in [1, 7, 48, 999, 1000]:
+            with self.subTest(len_chunk=len_chunk):
+                self.assertEqual(payload, Fernet(self.key).decrypt(self.__encrypt(payload, len_chunk)))
+
+    def test_token_size(self) -> None:
+        for size in [0, 1, 15, 16, 17, 100, 3 * 1024 + 5]:
+            with self.subTest(size=size):
+                self.assertEqual(StreamingFernet.calculate_token_size(size), len(self.__encrypt(os.urandom(size), 100)))
+
+    def test_decryption_with_wrong_key(self) -> None:
+        with self.assertRaises(InvalidToken):
+            Fernet(Fernet.generate_key()).decrypt(self.__encrypt(os.urandom(100), 10))
+
+    def test_reject_invalid_key(self) -> None:
+        with self.assertRaises(ValueError):
+            StreamingFernet(Fernet.generate_key()[:-4])
+
+    def __encrypt(self, payload: bytes, len_chunk: int) -> bytes:
+        encryptor = self.cipher.encryptor()
+        parts = [encryptor.update(payload[i:i + len_chunk]) for i in range(0, len(payload), len_chunk)]
+        return b''.join(parts) + encryptor.finalize()
+
+
+if __name__ == '__main__':
+    unittest.main()
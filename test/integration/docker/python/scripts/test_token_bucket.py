@@ -0,0 +1,41 @@
+import threading
+import time
+import unittest
+
+from sftp_export import TokenBucket
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst(self):
+        bucket = TokenBucket(100000)
+        started = time.monotonic()
+        bucket.consume(50000)
+        self.assertLess(time.monotonic() - started, 0.1)
+
+    def test_rate(self):
+        bucket = TokenBucket(100000)
+        started = time.monotonic()
+        for _ in range(4):
+            bucket.consume(50000)
+        self.assertGreaterEqual(time.monotonic() - started, 0.9)
+
+    def test_chunk_larger_than_burst(self):
+        bucket = TokenBucket(100000)
+        started = time.monotonic()
+        bucket.consume(130000)
+        self.assertGreaterEqual(time.monotonic() - started, 0.25)
+
+    def test_shared_between_threads(self):
+        bucket = TokenBucket(100000)
+        threads = [threading.Thread(target=bucket.consume, args=(50000,)) for _ in range(4)]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertGreaterEqual(time.monotonic() - started, 0.9)
+
+
+if __name__ == '__main__':
+    unittest.main()
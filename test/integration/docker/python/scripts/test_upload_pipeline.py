@@ -0,0 +1,101 @@
+import os
+import unittest
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+
+from fake_server_test_case import FakeServerTestCase
+from sftp_export import BrokerRequestResultManager, ExportTarget, ResultUploadPipeline, SftpFileManager
+
+
+class TestResultUploadPipeline(FakeServerTestCase):
+    def __create_broker(self) -> BrokerRequestResultManager:
+        broker = BrokerRequestResultManager()
+        self.addCleanup(broker.close)
+        return broker
+
+    def __run(self, names_target: tuple = ('default',), broker: BrokerRequestResultManager = None, **pipeline_config) -> (list, list):
+        os.environ.update({f'PIPELINE.{key.upper()}': str(value) for key, value in pipeline_config.items()})
+        targets = [ExportTarget(name, dict(self.config, **{'MISC.WORKING_DIR': os.path.join(self.dir_working, name)})) for name in names_target]
+        for target in targets:
+            self.addCleanup(target.close)
+        broker = broker or self.__create_broker()
+        dict_completion = broker.get_tagged_requests_completion_by_tag(['rki'])['rki']
+        pipeline = ResultUploadPipeline(broker, targets)
+        results = list(pipeline.run([(id_request, [(target, None) for target in targets]) for id_request in sorted(dict_completion)]))
+        return results, pipeline.failures
+
+    def __list_leftovers(self) -> list:
+        return [filename for _, _, filenames in os.walk(self.dir_working) for filename in filenames if filename.startswith('export_')]
+
+    def test_export_again_after_download_not_found(self):
+        broker = self.__create_broker()
+        broker.get_tagged_requests_completion_by_tag(['rki'])
+        ids_export = [broker.export_request_result(id_request) for id_request in ('0', '1', '2', '3')]
+        self.fake_broker.expire_exports()
+        results, failures = self.__run(broker=broker)
+        self.assertEqual([], failures)
+        self.assertEqual(4, len(results))
+        self.assertEqual(8, self.fake_broker.counts['export'])
+        self.assertEqual(8, self.fake_broker.counts['download'])
+        self.assertFalse(set(ids_export) & {broker.export_request_result(id_request) for id_request in ('0', '1', '2', '3')})
+        self.assertEqual(8, self.fake_broker.counts['export'])
+
+    def test_replace_broken_encrypt_pool(self):
+        submit_encryption = SftpFileManager.submit_encryption
+        calls = []
+
+        def break_first_submit(sftp, executor, path_plain, filename):
+            calls.append(filename)
+            if len(calls) == 1:
+                raise BrokenProcessPool('worker process was killed')
+            return submit_encryption(sftp, executor, path_plain, filename)
+
+        with mock.patch.object(SftpFileManager, 'submit_encryption', break_first_submit):
+            results, failures = self.__run(encrypt_processes=1)
+        self.assertEqual([], failures)
+        self.assertEqual(4, len(results))
+        self.assertEqual(['export_0.zip', 'export_1.zip', 'export_2.zip', 'export_3.zip'], sorted(os.listdir(self.dir_remote)))
+        self.assertEqual([], self.__list_leftovers())
+
+    def test_remove_files_of_failed_submit(self):
+        submit_encryption = SftpFileManager.submit_encryption
+        sftp_first = []
+
+        def break_second_target(sftp, executor, path_plain, filename):
+            sftp_first.append(sftp)
+            if sftp is not sftp_first[0]:
+                raise BrokenProcessPool('worker process was killed')
+            return submit_encryption(sftp, executor, path_plain, filename)
+
+        with mock.patch.object(SftpFileManager, 'submit_encryption', break_second_target):
+            results, failures = self.__run(('first', 'second'), encrypt_processes=1)
+        self.assertEqual([], results)
+        self.assertEqual(8, len(failures))
+        self.assertEqual([], os.listdir(self.dir_remote))
+        self.assertEqual([], self.__list_leftovers())
+
+    def test_retry_failed_download_once(self):
+        for status, num_downloads, num_exports in ((500, 16, 4), (403, 4, 0)):
+            with self.subTest(status=status):
+                self.fake_broker.counts.clear()
+                self.fake_broker.download_status = status
+                results, failures = self.__run()
+                self.assertEqual([], results)
+                self.assertEqual(4, len(failures))
+                self.assertEqual(num_downloads, self.fake_broker.counts['download'])
+                self.assertEqual(num_exports, self.fake_broker.counts['export'])
+
+    def test_repeat_interrupted_download(self):
+        for encrypt_processes in (0, 1):
+            with self.subTest(encrypt_processes=encrypt_processes):
+                self.fake_broker.counts.clear()
+                self.fake_broker.interrupted_downloads = 2
+                results, failures = self.__run(encrypt_processes=encrypt_processes)
+                self.assertEqual([], failures)
+                self.assertEqual(4, len(results))
+                self.assertEqual(6, self.fake_broker.counts['download'])
+                self.assertEqual([], self.__list_leftovers())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,8 @@ import os
 import time
 import unittest
 import xml.etree.ElementTree as et
+from datetime import datetime
+from unittest import mock
 
 from sftp_export import StatusXmlManager
 
@@ -13,10 +15,61 @@ class TestStatusXmlManager(unittest.TestCase):
         os.environ['MISC.WORKING_DIR'] = self.dir_current
         self.addCleanup(os.remove, os.path.join(self.dir_current, 'status.xml'))
 
+    def test_write_behind(self):
+        self.__enable_write_behind()
+        xml = StatusXmlManager()
+        xml.update_or_add_element('1', '10')
+        xml.update_or_add_element('2', '20')
+        self.assertEqual(0, len(list(et.parse(xml.path_status_xml).getroot())))
+        xml.flush()
+        self.assertEqual(2, len(list(et.parse(xml.path_status_xml).getroot())))
+        self.assertFalse(os.path.isfile(os.path.join(self.dir_current, 'status.journal')))
+
+    def test_write_behind_by_interval(self):
+        os.environ['MISC.STATUS_FLUSH_INTERVAL'] = '30'
+        self.addCleanup(os.environ.pop, 'MISC.STATUS_FLUSH_INTERVAL')
+        self.addCleanup(self.__remove_journal)
+        xml = StatusXmlManager()
+        for id_request in range(5):
+            xml.update_or_add_element(str(id_request), '10')
+        self.assertEqual(0, len(list(et.parse(xml.path_status_xml).getroot())))
+        with mock.patch.object(time, 'monotonic', return_value=time.monotonic() + 31):
+            xml.update_or_add_element('5', '10')
+        self.assertEqual(6, len(list(et.parse(xml.path_status_xml).getroot())))
+        self.assertFalse(os.path.isfile(os.path.join(self.dir_current, 'status.journal')))
+
+    def test_replay_journal(self):
+        self.__enable_write_behind()
+        xml = StatusXmlManager()
+        xml.update_or_add_element('1', '10')
+        xml.update_or_add_element('2', '20')
+        xml.update_or_add_element('1', '100')
+        xml.add_delete_tag_to_element('2')
+        ts_delete = xml.get_element_by_id('2').find('deleted').text
+        self.assertTrue(os.path.isfile(os.path.join(self.dir_current, 'status.journal')))
+        xml = StatusXmlManager()
+        self.assertFalse(os.path.isfile(os.path.join(self.dir_current, 'status.journal')))
+        self.assertEqual(2, len(list(et.parse(xml.path_status_xml).getroot())))
+        self.assertEqual({'1': '100', '2': '20'}, xml.get_request_completion_as_dict())
+        self.assertIsNotNone(xml.get_element_by_id('1').find('last-update'))
+        self.assertEqual(ts_delete, xml.get_element_by_id('2').find('deleted').text)
+
     def test_init(self):
         xml = StatusXmlManager()
         self.assertTrue(os.path.isfile(xml.path_status_xml))
 
+    def test_load_existing(self):
+        xml = StatusXmlManager()
+        xml.update_or_add_element('1', '10')
+        xml.update_or_add_element('2', '20')
+        xml.add_delete_tag_to_element('2')
+        xml = StatusXmlManager()
+        self.assertEqual('10', xml.get_element_by_id('1').find('completion').text)
+        self.assertIsNotNone(xml.get_element_by_id('2').find('deleted'))
+        self.assertIsNone(xml.get_element_by_id('3'))
+        xml.update_or_add_element('3', '30')
+        self.assertEqual({'1': '10', '2': '20', '3': '30'}, xml.get_request_completion_as_dict())
+
     def test_add_node(self):
         xml = StatusXmlManager()
         xml.update_or_add_element('1', '10')
@@ -85,6 +138,49 @@ class TestStatusXmlManager(unittest.TestCase):
         ts_delete2 = node_1.find('deleted').text
         self.assertNotEqual(ts_delete, ts_delete2)
 
+    def test_add_node_with_digest(self):
+        xml = StatusXmlManager()
+        xml.update_or_add_element('1', '10', 'abc', 100)
+        xml.update_or_add_element('2', '20')
+        node_1 = xml.get_element_by_id('1')
+        self.assertEqual('abc', node_1.find('digest').text)
+        self.assertEqual('100', node_1.find('size').text)
+        node_2 = xml.get_element_by_id('2')
+        self.assertIsNone(node_2.find('digest'))
+        self.assertIsNone(node_2.find('size'))
+
+    def test_update_completion_only(self):
+        xml = StatusXmlManager()
+        xml.update_or_add_element('1', '10', 'abc', 100)
+        xml.update_completion_of_element('1', '20')
+        node_1 = xml.get_element_by_id('1')
+        self.assertEqual('20', node_1.find('completion').text)
+        self.assertEqual('abc', node_1.find('digest').text)
+        self.assertIsNone(node_1.find('last-update'))
+
+    def test_dict_node_digest(self):
+        xml = StatusXmlManager()
+        xml.update_or_add_element('1', '10', 'abc', 100)
+        xml.update_or_add_element('2', '20')
+        xml.update_or_add_element('3', '30', 'def', 300)
+        xml.update_or_add_element('3', '40', 'ghi', 400)
+        self.assertEqual({'1': 'abc', '3': 'ghi'}, xml.get_request_digest_as_dict())
+
+    def test_dict_node_size(self):
+        xml = StatusXmlManager()
+        xml.update_or_add_element('1', '10', 'abc', 100)
+        xml.update_or_add_element('2', '20')
+        xml.update_or_add_element('1', '20', 'def', 200)
+        self.assertEqual({'1': 200}, xml.get_request_size_as_dict())
+
+    def test_dict_node_upload_time(self):
+        xml = StatusXmlManager()
+        xml.update_or_add_element('1', '10')
+        xml.update_or_add_element('2', '20')
+        dict_upload_time = xml.get_request_upload_time_as_dict()
+        self.assertEqual({'1', '2'}, dict_upload_time.keys())
+        self.assertLess(abs((datetime.utcnow() - dict_upload_time['1']).total_seconds()), 60)
+
     def test_dict_node_completion(self):
         xml = StatusXmlManager()
         xml = self.__fill_xml_tree(xml)
@@ -108,6 +204,14 @@ class TestStatusXmlManager(unittest.TestCase):
         _, set_update, _ = xml.compare_request_completion_between_broker_and_sftp(dict_broker, dict_xml)
         self.assertEqual(2, len(set_update))
 
+    def test_compare_completion_deleted_unchanged(self):
+        xml = StatusXmlManager()
+        xml = self.__fill_xml_tree(xml)
+        dict_broker = {'1': '100', '2': '300'}
+        dict_xml = xml.get_request_completion_as_dict()
+        set_new, set_update, set_delete = xml.compare_request_completion_between_broker_and_sftp(dict_broker, dict_xml)
+        self.assertEqual((set(), set(), {'3', '4'}), (set_new, set_update, set_delete))
+
     def test_compare_completion_only_delete(self):
         xml = StatusXmlManager()
         xml = self.__fill_xml_tree(xml)
@@ -116,6 +220,16 @@ class TestStatusXmlManager(unittest.TestCase):
         _, _, set_delete = xml.compare_request_completion_between_broker_and_sftp(dict_broker, dict_xml)
         self.assertEqual(1, len(set_delete))
 
+    def __enable_write_behind(self):
+        os.environ['MISC.STATUS_FLUSH_COUNT'] = '100'
+        self.addCleanup(os.environ.pop, 'MISC.STATUS_FLUSH_COUNT')
+        self.addCleanup(self.__remove_journal)
+
+    def __remove_journal(self):
+        path_journal = os.path.join(self.dir_current, 'status.journal')
+        if os.path.isfile(path_journal):
+            os.remove(path_journal)
+
     @staticmethod
     def __fill_xml_tree(xml: StatusXmlManager):
         xml.update_or_add_element('1', '100')
@@ -22,7 +22,21 @@ docker exec python pip install --no-cache-dir -r requirements.txt
 
 echo -e "${YEL} Copy python scripts from repository to python container and run unittest ${WHI}"
 docker cp $PROJECT_DIR/src/sftp_export.py python:/opt/
+docker cp $PROJECT_DIR/test/benchmark/benchmark.py python:/opt/
+docker cp $PROJECT_DIR/test/benchmark/fake_server_test_case.py python:/opt/
 docker exec python pytest test_xml_manager.py
+docker exec python pytest test_sqlite_manager.py
+docker exec python pytest test_run_metrics.py
+docker exec python pytest test_retry_policy.py
+docker exec python pytest test_bundle_cache.py
+docker exec python pytest test_status_manifest.py
+docker exec python pytest test_token_bucket.py
+docker exec python pytest test_streaming_fernet.py
+docker exec python pytest test_sftp_file_manager.py
+docker exec python pytest test_upload_pipeline.py
+docker exec python pytest test_manager.py
+docker exec python pytest test_broker_request_result_manager.py
+docker exec python pytest test_daemon.py
 
 echo -e "${YEL} Broker creates 3 requests with tag default and 3 with tag rki ${WHI}"
 for i in {0..2}; do
@@ -145,6 +159,9 @@ rm export_2.zip
 echo -e "${YEL} Test fernet encryption on python ${WHI}"
 docker exec python pytest test_fernet_decryption.py
 
+echo -e "${YEL} Test AES-GCM stream encryption on python ${WHI}"
+docker exec python pytest test_stream_decryption.py
+
 LIST_CONTAINER=( broker-server broker-connection python sftp )
 echo -e "${YEL} Clean up containers ${WHI}"
 for container in ${LIST_CONTAINER[*]}; do